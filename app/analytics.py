@@ -0,0 +1,281 @@
+import argparse
+from datetime import date, timedelta
+from typing import List, Optional
+
+from decouple import config
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.auth import get_current_admin
+from app.database import SessionLocal, get_db
+from app.jobs import JobContext, LocalJobContext, job_handler
+from app.models import Book, BorrowedBook, BorrowDailyStat, LibraryItem, Reader, ReaderDailyStat, User
+from app.profiling import ProfiledRoute
+from app.schemas import GenreUtilization, OverdueBorrow, ReaderActivity, TopBorrowedBook
+
+LOAN_PERIOD_DAYS = config("LOAN_PERIOD_DAYS", cast=int, default=14)
+
+analytics_router = APIRouter(prefix="/analytics", tags=["Analytics"], route_class=ProfiledRoute)
+
+
+# ======================================================================
+# Инкрементальное обновление агрегатов
+# ======================================================================
+
+def _bump(db: Session, model, key: dict, borrows: int = 0, returns: int = 0) -> None:
+    stmt = pg_insert(model).values(**key, borrow_count=borrows, return_count=returns)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            "borrow_count": model.borrow_count + stmt.excluded.borrow_count,
+            "return_count": model.return_count + stmt.excluded.return_count,
+        },
+    )
+    db.execute(stmt)
+
+
+def _lock_month(db: Session, day: date, shared: bool) -> None:
+    """
+    Блокировка месяца агрегатов до конца транзакции. Выдачи и возвраты берут её
+    совместно и друг другу не мешают; пересчёт месяца берёт её монопольно, поэтому
+    не начнётся, пока не зафиксированы уже учтённые в агрегатах выдачи, и их
+    приращения не потеряются при удалении и повторной вставке строк месяца.
+    """
+    lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+    db.execute(select(lock(func.hashtext(f"borrow_stats:{day:%Y-%m}"))))
+
+
+def record_borrow(db: Session, loan: BorrowedBook) -> None:
+    """
+    Учитывает выдачу в дневных агрегатах. Выполняется в транзакции выдачи.
+    Выдачи в филиалах (без book_id) попадают только в агрегаты по читателям.
+    """
+    _lock_month(db, loan.borrow_date, shared=True)
+    if loan.book_id is not None:
+        _bump(db, BorrowDailyStat, {"day": loan.borrow_date, "book_id": loan.book_id}, borrows=1)
+    _bump(db, ReaderDailyStat, {"day": loan.borrow_date, "reader_id": loan.reader_id}, borrows=1)
+
+
+def record_return(db: Session, loan: BorrowedBook) -> None:
+    _lock_month(db, loan.return_date, shared=True)
+    if loan.book_id is not None:
+        _bump(db, BorrowDailyStat, {"day": loan.return_date, "book_id": loan.book_id}, returns=1)
+    _bump(db, ReaderDailyStat, {"day": loan.return_date, "reader_id": loan.reader_id}, returns=1)
+
+
+# ======================================================================
+# Пересчёт агрегатов по истории выдач
+# ======================================================================
+
+def _backfill_stats(db: Session, model, key_column: str, start: date, end: date) -> None:
+    key = getattr(BorrowedBook, key_column)
+    events = union_all(
+        select(BorrowedBook.borrow_date.label("day"), key.label(key_column),
+               literal(1).label("borrows"), literal(0).label("returns"))
+        .where(BorrowedBook.borrow_date.between(start, end), key.isnot(None)),
+        select(BorrowedBook.return_date.label("day"), key.label(key_column),
+               literal(0).label("borrows"), literal(1).label("returns"))
+        .where(BorrowedBook.return_date.between(start, end), key.isnot(None)),
+    ).subquery()
+    db.query(model).filter(model.day.between(start, end)).delete(synchronize_session=False)
+    db.execute(
+        pg_insert(model).from_select(
+            ["day", key_column, "borrow_count", "return_count"],
+            select(events.c.day, events.c[key_column], func.sum(events.c.borrows), func.sum(events.c.returns))
+            .group_by(events.c.day, events.c[key_column]),
+        )
+    )
+
+
+def _month_ranges(start: date, end: date):
+    current = start
+    while current <= end:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        yield current, min(next_month - timedelta(days=1), end)
+        current = next_month
+
+
+def backfill_borrow_stats(db: Session, start: Optional[date] = None, end: Optional[date] = None,
+                          ctx: Optional[JobContext] = None) -> int:
+    """
+    Пересчитывает агрегаты за период помесячно, каждый месяц — отдельной транзакцией.
+    Возвращает количество обработанных месяцев.
+    """
+    start = start or db.query(func.min(BorrowedBook.borrow_date)).scalar()
+    end = end or date.today()
+    if start is None:
+        return 0
+    months = list(_month_ranges(start, end))
+    ctx = ctx or LocalJobContext(db)
+    done = ctx.progress
+    for month_start, month_end in months[done:]:
+        _lock_month(db, month_start, shared=False)
+        _backfill_stats(db, BorrowDailyStat, "book_id", month_start, month_end)
+        _backfill_stats(db, ReaderDailyStat, "reader_id", month_start, month_end)
+        done += 1
+        ctx.report_progress(done, total=len(months))
+    return len(months)
+
+
+@job_handler("backfill_borrow_stats")
+def backfill_borrow_stats_job(ctx: JobContext, params: dict) -> dict:
+    start = date.fromisoformat(params["start"]) if params.get("start") else None
+    end = date.fromisoformat(params["end"]) if params.get("end") else None
+    return {"months": backfill_borrow_stats(ctx.db, start, end, ctx=ctx)}
+
+
+# ======================================================================
+# Отчёты
+# ======================================================================
+
+def _period(start: Optional[date], end: Optional[date]):
+    # По умолчанию — текущий месяц
+    end = end or date.today()
+    return start or end.replace(day=1), end
+
+
+@analytics_router.get("/top-borrowed", response_model=List[TopBorrowedBook])
+def get_top_borrowed(
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        limit: int = 10,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    start, end = _period(start, end)
+    borrow_count = func.sum(BorrowDailyStat.borrow_count).label("borrow_count")
+    rows = (
+        db.query(Book.id, Book.title, borrow_count)
+        .join(BorrowDailyStat, BorrowDailyStat.book_id == Book.id)
+        .filter(BorrowDailyStat.day.between(start, end))
+        .group_by(Book.id, Book.title)
+        .having(func.sum(BorrowDailyStat.borrow_count) > 0)
+        .order_by(borrow_count.desc(), Book.id)
+        .limit(limit)
+        .all()
+    )
+    return [TopBorrowedBook(book_id=row.id, title=row.title, borrow_count=row.borrow_count) for row in rows]
+
+
+@analytics_router.get("/overdue", response_model=List[OverdueBorrow])
+def get_overdue(
+        skip: int = 0,
+        limit: int = 50,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    """
+    Открытые выдачи старше LOAN_PERIOD_DAYS (книг и в филиалах), начиная с самых давних.
+    """
+    today = date.today()
+    rows = (
+        db.query(BorrowedBook, Reader.name, func.coalesce(Book.title, LibraryItem.title))
+        .join(Reader, Reader.id == BorrowedBook.reader_id)
+        .outerjoin(Book, Book.id == BorrowedBook.book_id)
+        .outerjoin(LibraryItem, LibraryItem.id == BorrowedBook.item_id)
+        .filter(BorrowedBook.return_date.is_(None),
+                BorrowedBook.borrow_date < today - timedelta(days=LOAN_PERIOD_DAYS))
+        .order_by(BorrowedBook.borrow_date, BorrowedBook.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return [
+        OverdueBorrow(
+            id=loan.id,
+            reader_id=loan.reader_id,
+            reader_name=reader_name,
+            book_id=loan.book_id,
+            branch_id=loan.branch_id,
+            item_id=loan.item_id,
+            title=title,
+            borrow_date=loan.borrow_date,
+            days_overdue=(today - loan.borrow_date).days - LOAN_PERIOD_DAYS,
+        )
+        for loan, reader_name, title in rows
+    ]
+
+
+@analytics_router.get("/genre-utilization", response_model=List[GenreUtilization])
+def get_genre_utilization(
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    start, end = _period(start, end)
+    borrows = dict(
+        db.query(Book.genre, func.sum(BorrowDailyStat.borrow_count))
+        .join(BorrowDailyStat, BorrowDailyStat.book_id == Book.id)
+        .filter(BorrowDailyStat.day.between(start, end))
+        .group_by(Book.genre)
+        .all()
+    )
+    on_loan = dict(
+        db.query(Book.genre, func.count(BorrowedBook.id))
+        .join(BorrowedBook, BorrowedBook.book_id == Book.id)
+        .filter(BorrowedBook.return_date.is_(None))
+        .group_by(Book.genre)
+        .all()
+    )
+    available = dict(
+        db.query(Book.genre, func.coalesce(func.sum(Book.available_copies), 0))
+        .group_by(Book.genre)
+        .all()
+    )
+    result = []
+    for genre in sorted(set(borrows) | set(on_loan) | set(available), key=lambda g: (g is None, g or "")):
+        loaned = on_loan.get(genre, 0)
+        copies = int(available.get(genre, 0))
+        result.append(GenreUtilization(
+            genre=genre,
+            borrow_count=int(borrows.get(genre, 0)),
+            on_loan=loaned,
+            available_copies=copies,
+            utilization=round(loaned / (loaned + copies), 4) if loaned + copies else 0.0,
+        ))
+    return result
+
+
+@analytics_router.get("/reader-activity", response_model=List[ReaderActivity])
+def get_reader_activity(
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        reader_id: Optional[int] = None,
+        limit: int = 20,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    start, end = _period(start, end)
+    borrow_count = func.sum(ReaderDailyStat.borrow_count).label("borrow_count")
+    return_count = func.sum(ReaderDailyStat.return_count).label("return_count")
+    query = (
+        db.query(Reader.id, Reader.name, borrow_count, return_count)
+        .join(ReaderDailyStat, ReaderDailyStat.reader_id == Reader.id)
+        .filter(ReaderDailyStat.day.between(start, end))
+    )
+    if reader_id:
+        query = query.filter(Reader.id == reader_id)
+    rows = query.group_by(Reader.id, Reader.name).order_by(borrow_count.desc(), Reader.id).limit(limit).all()
+    return [
+        ReaderActivity(reader_id=row.id, name=row.name, borrow_count=row.borrow_count, return_count=row.return_count)
+        for row in rows
+    ]
+
+
+if __name__ == "__main__":
+    # python -m app.analytics backfill --start 2024-01-01 --end 2024-12-31
+    parser = argparse.ArgumentParser(description="Обслуживание агрегатов выдач")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--start", type=date.fromisoformat)
+    parser.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        months = backfill_borrow_stats(session, args.start, args.end)
+        print(f"Пересчитано месяцев: {months}")
+    finally:
+        session.close()
@@ -1,5 +1,8 @@
+import hashlib
+import secrets
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -8,10 +11,13 @@ from jose import jwt, JWTError
 from passlib.context import CryptContext
 import logging
 
-from app.models import User
-from app.schemas import UserCreate, Token, UserResponse
+from app.models import RefreshToken, User
+from app.profiling import ProfiledRoute
+from app.schemas import UserCreate, Token, UserResponse, RefreshRequest
 from app.database import get_db
-from app.utils import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.events import USER_CHANGED, InvalidationEvent, invalidation_bus
+from app.jobs import JobContext, LocalJobContext, job_handler, schedule_periodic_job
+from app.utils import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -19,7 +25,7 @@ logger.setLevel(logging.INFO)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-auth_router = APIRouter(prefix="/auth", tags=["Auth"])
+auth_router = APIRouter(prefix="/auth", tags=["Auth"], route_class=ProfiledRoute)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -37,6 +43,90 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def hash_refresh_token(token: str) -> str:
+    # Токен случайный и длинный, поэтому медленный bcrypt здесь не нужен
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """
+    Создаёт refresh-токен и добавляет его хеш в сессию. Коммит — на стороне вызывающего.
+    """
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or uuid.uuid4().hex,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+def revoke_refresh_token_family(db: Session, family_id: str) -> None:
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None)
+    ).update({RefreshToken.revoked_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[User, str]:
+    """
+    Обменивает refresh-токен на новый из той же цепочки.
+    Повторное использование отозванного токена отзывает всю цепочку.
+    """
+    invalid_token = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Недействительный refresh-токен",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    stored = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(token)
+    ).with_for_update().first()
+    if stored is None:
+        raise invalid_token
+    if stored.revoked_at is not None:
+        logger.warning("Повторное использование refresh-токена, цепочка %s отозвана", stored.family_id)
+        revoke_refresh_token_family(db, stored.family_id)
+        db.commit()
+        raise invalid_token
+    if stored.expires_at <= datetime.utcnow():
+        raise invalid_token
+    user = db.get(User, stored.user_id)
+    if user is None:
+        raise invalid_token
+    stored.revoked_at = datetime.utcnow()
+    new_token = create_refresh_token(db, stored.user_id, stored.family_id)
+    db.commit()
+    return user, new_token
+
+
+def purge_expired_refresh_tokens(db: Session, batch_size: int = 1000, ctx: Optional[JobContext] = None) -> int:
+    """
+    Удаляет истёкшие refresh-токены порциями, каждая порция — отдельной транзакцией.
+    """
+    ctx = ctx or LocalJobContext(db)
+    deleted = 0
+    while True:
+        batch = (
+            db.query(RefreshToken.id)
+            .filter(RefreshToken.expires_at < datetime.utcnow())
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        count = db.query(RefreshToken).filter(RefreshToken.id.in_(batch)).delete(synchronize_session=False)
+        deleted += count
+        ctx.report_progress(deleted)
+        if count < batch_size:
+            return deleted
+
+
+@job_handler("purge_refresh_tokens")
+def purge_refresh_tokens_job(ctx: JobContext, params: dict) -> dict:
+    return {"deleted": purge_expired_refresh_tokens(ctx.db, params.get("batch_size", 1000), ctx=ctx)}
+
+
+schedule_periodic_job("purge_refresh_tokens", interval_seconds=24 * 60 * 60)
+
+
 def get_user(db: Session, username: str) -> Optional[User]:
     return db.query(User).filter(User.username == username).first()
 
@@ -72,6 +162,8 @@ def register_user(db: Session, user: UserCreate) -> UserResponse:
         is_admin=True if user.role and user.role.lower() == "admin" else False
     )
     db.add(db_user)
+    db.flush()
+    invalidation_bus.publish(db, InvalidationEvent(USER_CHANGED, db_user.id))
     db.commit()
     db.refresh(db_user)
     return UserResponse(
@@ -108,20 +200,51 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         )
 
 
+def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+    return current_user
+
+
 @auth_router.post("/register", response_model=Token)
 def register(user: UserCreate, db: Session = Depends(get_db)):
     logger.info("Регистрация пользователя: %s", user.username)
     user_response = register_user(db, user)
     access_token = create_access_token(data={"sub": user_response.username})
+    refresh_token = create_refresh_token(db, user_response.id)
+    db.commit()
     logger.info("Создан токен для пользователя: %s", user_response.username)
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 
 @auth_router.post("/login", response_model=Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = authenticate_user(db, form_data.username, form_data.password)
     access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
+    refresh_token = create_refresh_token(db, user.id)
+    db.commit()
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@auth_router.post("/refresh", response_model=Token)
+def refresh(request: RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Выдаёт новый access-токен без проверки пароля; refresh-токен при этом ротируется.
+    """
+    user, refresh_token = rotate_refresh_token(db, request.refresh_token)
+    access_token = create_access_token(data={"sub": user.username})
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+@auth_router.post("/logout", response_model=dict)
+def logout(request: RefreshRequest, db: Session = Depends(get_db)):
+    stored = db.query(RefreshToken).filter(
+        RefreshToken.token_hash == hash_refresh_token(request.refresh_token)
+    ).first()
+    if stored is not None:
+        revoke_refresh_token_family(db, stored.family_id)
+        db.commit()
+    return {"detail": "Refresh token revoked"}
 
 
 @auth_router.get("/me", response_model=UserResponse)
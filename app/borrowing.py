@@ -0,0 +1,71 @@
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.analytics import record_borrow, record_return
+from app.auth import get_current_admin
+from app.branches import move_branch_copy
+from app.database import get_db
+from app.models import Book, BorrowedBook, Reader, User
+from app.profiling import ProfiledRoute
+from app.schemas import BorrowCreate, BorrowRead
+
+borrowing_router = APIRouter(prefix="/borrowings", tags=["Borrowings"], route_class=ProfiledRoute)
+
+
+@borrowing_router.post("/", response_model=BorrowRead)
+def borrow_book(
+        borrow: BorrowCreate,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    """
+    Выдаёт книгу читателю: уменьшает число доступных экземпляров и обновляет агрегаты.
+    """
+    if not db.get(Reader, borrow.reader_id):
+        raise HTTPException(status_code=404, detail="Reader not found")
+    # Условное обновление не даёт уйти в минус при одновременных выдачах
+    updated = db.query(Book).filter(Book.id == borrow.book_id, Book.available_copies > 0).update(
+        {Book.available_copies: Book.available_copies - 1}, synchronize_session=False
+    )
+    if not updated:
+        db.rollback()
+        if not db.get(Book, borrow.book_id):
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=409, detail="No copies available")
+    loan = BorrowedBook(reader_id=borrow.reader_id, book_id=borrow.book_id, borrow_date=date.today())
+    db.add(loan)
+    record_borrow(db, loan)
+    db.commit()
+    db.refresh(loan)
+    return loan
+
+
+@borrowing_router.post("/{borrowing_id}/return", response_model=BorrowRead)
+def return_book(
+        borrowing_id: int,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    loan = db.get(BorrowedBook, borrowing_id)
+    if not loan:
+        raise HTTPException(status_code=404, detail="Borrowing not found")
+    returned = db.query(BorrowedBook).filter(
+        BorrowedBook.id == borrowing_id, BorrowedBook.return_date.is_(None)
+    ).update({BorrowedBook.return_date: date.today()}, synchronize_session=False)
+    if not returned:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Book already returned")
+    if loan.branch_id is not None:
+        # Выдача в филиале: экземпляр возвращается в фонд филиала (элемент мог быть удалён)
+        if loan.item_id is not None:
+            move_branch_copy(db, loan.branch_id, loan.item_id, 1)
+    else:
+        db.query(Book).filter(Book.id == loan.book_id).update(
+            {Book.available_copies: Book.available_copies + 1}, synchronize_session=False
+        )
+    db.refresh(loan)
+    record_return(db, loan)
+    db.commit()
+    return loan
@@ -0,0 +1,253 @@
+from datetime import date
+from typing import List, Optional
+
+from decouple import config
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.analytics import record_borrow
+from app.auth import get_current_admin, get_current_user
+from app.database import get_db
+from app.events import CATALOG_VERSION_BUMPED, ITEM_CHANGED, InvalidationEvent, invalidation_bus
+from app.jobs import JobContext, LocalJobContext, job_handler, schedule_periodic_job
+from app.changefeed import pending_change_seq
+from app.models import Branch, BranchInventory, BorrowedBook, InventoryDelta, LibraryItem, Reader, User
+from app.profiling import ProfiledRoute
+from app.schemas import BorrowRead, BranchCheckout, BranchCreate, BranchInventoryRead, BranchInventoryUpdate, BranchRead
+
+# Размер порции журнала изменений, сворачиваемой одной транзакцией
+INVENTORY_FOLD_BATCH_SIZE = config("INVENTORY_FOLD_BATCH_SIZE", cast=int, default=10000)
+INVENTORY_FOLD_INTERVAL_SECONDS = config("INVENTORY_FOLD_INTERVAL_SECONDS", cast=int, default=60)
+
+branches_router = APIRouter(prefix="/branches", tags=["Branches"], route_class=ProfiledRoute)
+
+
+# ======================================================================
+# Секции и журнал изменений
+# ======================================================================
+
+def partition_name(branch_id: int) -> str:
+    return f"{BranchInventory.__tablename__}_b{int(branch_id)}"
+
+
+def create_branch_partition(db: Session, branch_id: int) -> None:
+    """
+    Создаёт секцию branch_inventory для филиала. Без PostgreSQL таблица не секционирована.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(branch_id)} "
+        f"PARTITION OF {BranchInventory.__tablename__} FOR VALUES IN ({int(branch_id)})"
+    ))
+
+
+def record_inventory_delta(db: Session, branch_id: int, item_id: int, delta: int) -> None:
+    """
+    Добавляет запись в журнал вместо обновления общей строки LibraryItem,
+    за которую иначе конкурировали бы все филиалы.
+    """
+    if delta:
+        db.add(InventoryDelta(branch_id=branch_id, item_id=item_id, available_delta=delta))
+
+
+def move_branch_copy(db: Session, branch_id: int, item_id: int, delta: int) -> None:
+    """
+    Выдаёт (delta=-1) или возвращает (delta=1) экземпляр в филиале: условное обновление
+    одной строки секции филиала и запись в журнал. Общая строка LibraryItem не
+    блокируется, её догоняет fold_inventory_deltas. Коммит — на стороне вызывающего.
+    """
+    condition = (
+        BranchInventory.available_copies > 0 if delta < 0
+        else BranchInventory.available_copies < BranchInventory.total_copies
+    )
+    updated = db.execute(
+        update(BranchInventory)
+        .where(BranchInventory.branch_id == branch_id, BranchInventory.item_id == item_id, condition)
+        .values(available_copies=BranchInventory.available_copies + delta),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    if not updated:
+        db.rollback()
+        if db.get(BranchInventory, (branch_id, item_id)) is None:
+            raise HTTPException(status_code=404, detail="Item is not stocked in this branch")
+        raise HTTPException(
+            status_code=409, detail="No copies available" if delta < 0 else "All copies are already returned"
+        )
+    record_inventory_delta(db, branch_id, item_id, delta)
+    # Списки с фильтром по филиалу и их кешированные количества читают branch_inventory
+    invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, item_id))
+
+
+def fold_inventory_deltas(db: Session, batch_size: int = INVENTORY_FOLD_BATCH_SIZE,
+                          ctx: Optional[JobContext] = None) -> int:
+    """
+    Сворачивает журнал в LibraryItem.available_copies порциями: каждая порция —
+    один запрос (DELETE ... RETURNING, суммы по элементам, UPDATE) в отдельной транзакции.
+    Записи незавершённых транзакций не видны и попадут в следующий запуск.
+    """
+    ctx = ctx or LocalJobContext(db)
+    folded = 0
+    while True:
+        batch = select(InventoryDelta.id).order_by(InventoryDelta.id).limit(batch_size).subquery()
+        upper = db.execute(select(func.max(batch.c.id))).scalar()
+        if upper is None:
+            return folded
+        deleted = (
+            delete(InventoryDelta)
+            .where(InventoryDelta.id <= upper)
+            .returning(InventoryDelta.item_id, InventoryDelta.available_delta)
+            .cte("deleted")
+        )
+        sums = (
+            select(deleted.c.item_id, func.sum(deleted.c.available_delta).label("delta"))
+            .group_by(deleted.c.item_id)
+            .cte("sums")
+        )
+        updated = (
+            update(LibraryItem)
+            .where(LibraryItem.id == sums.c.item_id, sums.c.delta != 0)
+            .values(
+                available_copies=LibraryItem.available_copies + sums.c.delta,
+                version=LibraryItem.version + 1,
+                change_seq=pending_change_seq(db),
+            )
+            .returning(LibraryItem.id)
+            .cte("updated")
+        )
+        deltas, items = db.execute(select(
+            select(func.count()).select_from(deleted).scalar_subquery(),
+            select(func.count()).select_from(updated).scalar_subquery(),
+        )).one()
+        if items:
+            invalidation_bus.publish(db, InvalidationEvent(CATALOG_VERSION_BUMPED))
+        folded += deltas
+        ctx.report_progress(folded)
+
+
+@job_handler("fold_inventory_deltas")
+def fold_inventory_deltas_job(ctx: JobContext, params: dict) -> dict:
+    return {"folded": fold_inventory_deltas(ctx.db, params.get("batch_size", INVENTORY_FOLD_BATCH_SIZE), ctx=ctx)}
+
+
+schedule_periodic_job("fold_inventory_deltas", interval_seconds=INVENTORY_FOLD_INTERVAL_SECONDS)
+
+
+# ======================================================================
+# Филиалы и их фонд
+# ======================================================================
+
+def _get_branch(db: Session, branch_id: int) -> Branch:
+    branch = db.get(Branch, branch_id)
+    if branch is None:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    return branch
+
+
+@branches_router.post("/", response_model=BranchRead)
+def create_branch(
+        branch: BranchCreate,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    """
+    Создаёт филиал вместе с секцией его фонда (в одной транзакции).
+    """
+    db_branch = Branch(name=branch.name)
+    db.add(db_branch)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Branch already exists")
+    create_branch_partition(db, db_branch.id)
+    db.commit()
+    db.refresh(db_branch)
+    return db_branch
+
+
+@branches_router.get("/", response_model=List[BranchRead])
+def get_branches(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return db.query(Branch).order_by(Branch.id).all()
+
+
+@branches_router.get("/{branch_id}/inventory/{item_id}", response_model=BranchInventoryRead)
+def get_branch_inventory(
+        branch_id: int,
+        item_id: int,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    inventory = db.get(BranchInventory, (branch_id, item_id))
+    if inventory is None:
+        raise HTTPException(status_code=404, detail="Item is not stocked in this branch")
+    return inventory
+
+
+@branches_router.put("/{branch_id}/inventory/{item_id}", response_model=BranchInventoryRead)
+def set_branch_inventory(
+        branch_id: int,
+        item_id: int,
+        stock: BranchInventoryUpdate,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    """
+    Задаёт число экземпляров элемента в филиале. Доступные экземпляры меняются
+    на ту же величину, выданные остаются выданными.
+    """
+    _get_branch(db, branch_id)
+    if db.get(LibraryItem, item_id) is None:
+        raise HTTPException(status_code=404, detail="Library item not found")
+    inventory = (
+        db.query(BranchInventory)
+        .filter(BranchInventory.branch_id == branch_id, BranchInventory.item_id == item_id)
+        .with_for_update()
+        .first()
+    )
+    if inventory is None:
+        inventory = BranchInventory(branch_id=branch_id, item_id=item_id, total_copies=0, available_copies=0)
+        db.add(inventory)
+    delta = stock.total_copies - inventory.total_copies
+    if inventory.available_copies + delta < 0:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="More copies are on loan than the new total")
+    inventory.total_copies = stock.total_copies
+    inventory.available_copies += delta
+    record_inventory_delta(db, branch_id, item_id, delta)
+    # Списки с фильтром по филиалу и их кешированные количества читают branch_inventory
+    invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, item_id))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Одновременное первое заполнение той же позиции
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Inventory was changed concurrently, retry the request")
+    db.refresh(inventory)
+    return inventory
+
+
+@branches_router.post("/{branch_id}/inventory/{item_id}/checkout", response_model=BorrowRead)
+def checkout_branch_copy(
+        branch_id: int,
+        item_id: int,
+        checkout: BranchCheckout,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_admin)
+):
+    """
+    Выдаёт читателю экземпляр из фонда филиала. Выдачи в разных филиалах меняют
+    строки разных секций branch_inventory и не конкурируют за общий счётчик.
+    Возврат — POST /borrowings/{id}/return.
+    """
+    if not db.get(Reader, checkout.reader_id):
+        raise HTTPException(status_code=404, detail="Reader not found")
+    move_branch_copy(db, branch_id, item_id, -1)
+    loan = BorrowedBook(reader_id=checkout.reader_id, branch_id=branch_id, item_id=item_id, borrow_date=date.today())
+    db.add(loan)
+    record_borrow(db, loan)
+    db.commit()
+    db.refresh(loan)
+    return loan
@@ -0,0 +1,84 @@
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+
+from app.models import CatalogChangeCounter, LibraryItem, LibraryItemTombstone
+
+COUNTER_ID = 1
+_PENDING_KEY = "pending_change_seq"
+
+
+def pending_change_seq(db: Session):
+    """
+    Значение change_seq для изменяемой строки каталога. До коммита строка помечена
+    номером своей транзакции (со знаком минус и невидима другим транзакциям);
+    настоящий номер выдаётся при коммите.
+
+    nextval() в самом запросе для этого не годится: номер берётся при выполнении
+    запроса, а коммит происходит позже, поэтому номер 10 мог стать видимым после
+    номера 11, и клиент ленты, уже получивший 11, пропустил бы 10 навсегда.
+    """
+    db.info[_PENDING_KEY] = True
+    return -func.txid_current()
+
+
+def last_change_seq(db: Session) -> int:
+    """
+    Последний зафиксированный номер изменения: все изменения с номером не больше
+    него уже видны, а новые получат номера больше него.
+    """
+    return db.query(CatalogChangeCounter.value).filter(CatalogChangeCounter.id == COUNTER_ID).scalar() or 0
+
+
+def _renumber(session: Session, model, key, base: int) -> None:
+    ranked = (
+        select(key.label("key"), func.row_number().over(order_by=key).label("position"))
+        .where(model.change_seq == -func.txid_current())
+        .subquery()
+    )
+    session.execute(
+        update(model).where(key == ranked.c.key).values(change_seq=base + ranked.c.position),
+        execution_options={"synchronize_session": False},
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _track_new_catalog_rows(session: Session, flush_context, instances) -> None:
+    # Строки, добавленные через ORM, получают временный номер значением по умолчанию
+    if any(isinstance(obj, (LibraryItem, LibraryItemTombstone)) for obj in session.new):
+        session.info[_PENDING_KEY] = True
+
+
+@event.listens_for(Session, "before_commit")
+def _assign_change_seqs(session: Session) -> None:
+    """
+    Выдаёт изменённым строкам транзакции номера из CatalogChangeCounter.
+    Блокировка строки счётчика держится до конца коммита, поэтому следующая
+    транзакция получит номера только после того, как эта станет видимой.
+    """
+    session.flush()
+    if not session.info.pop(_PENDING_KEY, False):
+        return
+    pending = -func.txid_current()
+    items, tombstones = session.execute(select(
+        select(func.count()).select_from(LibraryItem).where(LibraryItem.change_seq == pending).scalar_subquery(),
+        select(func.count()).select_from(LibraryItemTombstone)
+        .where(LibraryItemTombstone.change_seq == pending).scalar_subquery(),
+    )).one()
+    if not items and not tombstones:
+        return
+    last = session.execute(
+        update(CatalogChangeCounter)
+        .where(CatalogChangeCounter.id == COUNTER_ID)
+        .values(value=CatalogChangeCounter.value + items + tombstones)
+        .returning(CatalogChangeCounter.value)
+    ).scalar_one()
+    base = last - items - tombstones
+    if items:
+        _renumber(session, LibraryItem, LibraryItem.id, base)
+    if tombstones:
+        _renumber(session, LibraryItemTombstone, LibraryItemTombstone.item_id, base + items)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.orm import Query, Session
+
+from app.events import CATALOG_VERSION_BUMPED, ITEM_CHANGED, InvalidationEvent, invalidation_bus
+
+# Порог, ниже которого оценка планировщика уточняется точным COUNT(*)
+EXACT_COUNT_THRESHOLD = config("EXACT_COUNT_THRESHOLD", cast=int, default=10000)
+# Время жизни закешированного точного значения (страховка для других воркеров)
+COUNT_CACHE_TTL_SECONDS = config("COUNT_CACHE_TTL_SECONDS", cast=int, default=60)
+# Ключ кеша содержит произвольный текст фильтров, поэтому число записей ограничено
+COUNT_CACHE_MAX_ENTRIES = config("COUNT_CACHE_MAX_ENTRIES", cast=int, default=1024)
+
+COUNT_MODE_EXACT = "exact"
+COUNT_MODE_ESTIMATE = "estimate"
+COUNT_MODE_CACHED = "cached"
+COUNT_MODE_SNAPSHOT = "snapshot"  # Точное значение по снимку каталога в памяти (app/snapshot.py)
+
+
+class CountCache:
+    """
+    LRU-кеш точных количеств с временем жизни записей. Не потокобезопасен:
+    вызывающий код держит _cache_lock.
+    """
+
+    def __init__(self, max_entries: int = COUNT_CACHE_MAX_ENTRIES, ttl: float = COUNT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, Tuple[int, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, now: float) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[1] >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: tuple, total: int, now: float) -> None:
+        self._entries[key] = (total, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # Давно не читавшиеся записи лежат в начале: истёкшие из них удаляются сразу,
+        # остальные истёкшие — при чтении
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if now - self._entries[oldest][1] < self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_cache = CountCache()
+_cache_lock = threading.Lock()
+_catalog_version = 0
+
+
+def invalidate_counts(invalidation: Optional[InvalidationEvent] = None) -> None:
+    """
+    Сбрасывает кеш количеств. Вызывается шиной инвалидации после каждой записи в каталог.
+    """
+    global _catalog_version
+    with _cache_lock:
+        _catalog_version += 1
+        _cache.clear()
+
+
+invalidation_bus.subscribe(ITEM_CHANGED, invalidate_counts)
+invalidation_bus.subscribe(CATALOG_VERSION_BUMPED, invalidate_counts)
+
+
+def _table_estimate(db: Session, table_name: str) -> Optional[int]:
+    # reltuples = -1, если таблица ещё ни разу не анализировалась
+    reltuples = db.execute(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+        {"name": table_name},
+    ).scalar()
+    if reltuples is None or reltuples < 0:
+        return None
+    return int(reltuples)
+
+
+def _plan_estimate(db: Session, query: Query) -> int:
+    compiled = query.statement.compile(dialect=db.get_bind().dialect)
+    plan = db.connection().exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+    ).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _estimate(db: Session, query: Query, table_name: str, filtered: bool) -> int:
+    if not filtered:
+        estimate = _table_estimate(db, table_name)
+        if estimate is not None:
+            return estimate
+    return _plan_estimate(db, query)
+
+
+def count_items(db: Session, query: Query, table_name: str, filters: dict) -> Tuple[int, str]:
+    """
+    Возвращает общее количество строк запроса (без пагинации) и режим подсчёта.
+
+    Для широких запросов используется оценка планировщика PostgreSQL, для
+    селективных — точный COUNT(*), результат которого кешируется до следующей
+    записи в каталог.
+    """
+    key = (table_name,) + tuple(sorted((k, v) for k, v in filters.items() if v is not None))
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key, now)
+        version = _catalog_version
+    if cached is not None:
+        return cached, COUNT_MODE_CACHED
+
+    if db.get_bind().dialect.name == "postgresql":
+        estimate = _estimate(db, query, table_name, filtered=len(key) > 1)
+        if estimate > EXACT_COUNT_THRESHOLD:
+            return estimate, COUNT_MODE_ESTIMATE
+
+    total = query.order_by(None).count()
+    with _cache_lock:
+        # Не кешируем значение, если во время подсчёта каталог изменился
+        if version == _catalog_version:
+            _cache.put(key, total, now)
+    return total, COUNT_MODE_EXACT
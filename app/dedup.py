@@ -0,0 +1,295 @@
+import logging
+import re
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from decouple import config
+from sqlalchemy import delete, func, insert, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.jobs import JobContext, LocalJobContext, job_handler
+from app.models import LibraryItem, LibraryItemLshBand
+
+logger = logging.getLogger(__name__)
+
+# Параметры сигнатур хранятся вместе с данными: при их изменении нужен повторный scan_duplicates
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3
+
+# Минимальная оценка сходства Жаккара, при которой элементы считаются дубликатами
+DEDUP_THRESHOLD = config("DEDUP_THRESHOLD", cast=float, default=0.7)
+DEDUP_SCAN_CHUNK_SIZE = config("DEDUP_SCAN_CHUNK_SIZE", cast=int, default=5000)
+# Корзины крупнее этого размера при сканировании проверяются частично
+DEDUP_MAX_BUCKET = config("DEDUP_MAX_BUCKET", cast=int, default=1000)
+DEDUP_MAX_REPORTED_CLUSTERS = 1000
+
+_PRIME = (1 << 31) - 1
+# Значение сигнатуры пустого текста: настоящие минимумы хешей меньше _PRIME
+UNSIGNED = np.iinfo(np.uint32).max
+# Фиксированное зерно: сигнатуры должны совпадать во всех процессах и после перезапуска
+_random = np.random.RandomState(20261019)
+_HASH_A = _random.randint(1, _PRIME, size=NUM_PERMUTATIONS).astype(np.int64)
+_HASH_B = _random.randint(0, _PRIME, size=NUM_PERMUTATIONS).astype(np.int64)
+
+
+def normalize(title: str, author: str) -> str:
+    """
+    Приводит название и автора к виду, нечувствительному к регистру,
+    диакритике и пунктуации.
+    """
+    text = unicodedata.normalize("NFKD", f"{title} {author}")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return re.sub(r"[\W_]+", " ", text).strip()
+
+
+def _shingles(text: str) -> np.ndarray:
+    grams = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    return np.fromiter((zlib.crc32(gram.encode()) for gram in grams), dtype=np.int64, count=len(grams))
+
+
+def signatures(pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+    """
+    MinHash-сигнатуры пар (название, автор): массив (n, NUM_PERMUTATIONS).
+    Все перестановки считаются одной операцией над шинглами всей порции.
+    Если после нормализации текст пуст, строка заполняется UNSIGNED: иначе все
+    такие элементы совпали бы друг с другом на 100%.
+    """
+    result = np.full((len(pairs), NUM_PERMUTATIONS), UNSIGNED, dtype=np.uint32)
+    texts = [(i, normalize(title, author)) for i, (title, author) in enumerate(pairs)]
+    texts = [(i, text) for i, text in texts if text]
+    # Порции ограничивают размер промежуточной матрицы хешей
+    for start in range(0, len(texts), 1000):
+        chunk = texts[start:start + 1000]
+        shingles = [_shingles(text) for _, text in chunk]
+        offsets = np.cumsum([0] + [len(s) for s in shingles[:-1]])
+        hashes = (_HASH_A[:, None] * np.concatenate(shingles)[None, :] + _HASH_B[:, None]) % _PRIME
+        result[[i for i, _ in chunk]] = np.minimum.reduceat(hashes, offsets, axis=1).T
+    return result
+
+
+def _signed(sigs: np.ndarray) -> np.ndarray:
+    return sigs[:, 0] != UNSIGNED
+
+
+def encode_signature(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+
+def decode_signature(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4")
+
+
+def band_buckets(sigs: np.ndarray) -> np.ndarray:
+    """
+    Хеши полос сигнатур: массив (n, LSH_BANDS) int64.
+    """
+    bands = sigs.reshape(len(sigs), LSH_BANDS, LSH_ROWS).astype(np.uint64)
+    buckets = np.zeros(bands.shape[:2], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for row in range(LSH_ROWS):
+            buckets = buckets * np.uint64(1000003) + bands[:, :, row]
+    return buckets.view(np.int64)
+
+
+def store_bands(db: Session, item_ids: Sequence[int], sigs: np.ndarray) -> None:
+    """
+    Записывает полосы сигнатур элементов (без коммита). Элементы без сигнатуры
+    в LSH-корзины не попадают и дубликатами не считаются.
+    """
+    buckets = band_buckets(sigs)
+    signed = _signed(sigs)
+    rows = [
+        {"band": band, "bucket": int(buckets[i, band]), "item_id": item_id}
+        for i, item_id in enumerate(item_ids) if signed[i]
+        for band in range(LSH_BANDS)
+    ]
+    if rows:
+        db.execute(insert(LibraryItemLshBand), rows)
+
+
+def reindex_item(db: Session, item_id: int, sig: np.ndarray) -> None:
+    """
+    Записывает новую сигнатуру элемента (массив из одной строки) после изменения
+    названия или автора (без коммита).
+    """
+    db.execute(update(LibraryItem).where(LibraryItem.id == item_id).values(minhash=encode_signature(sig[0])))
+    db.execute(delete(LibraryItemLshBand).where(LibraryItemLshBand.item_id == item_id))
+    store_bands(db, [item_id], sig)
+
+
+def _similarities(sig: np.ndarray, others: np.ndarray) -> np.ndarray:
+    # Доля совпавших минимумов — несмещённая оценка сходства Жаккара
+    return (others == sig).mean(axis=1)
+
+
+def find_duplicates(db: Session, sigs: np.ndarray) -> List[List[Tuple[int, float]]]:
+    """
+    Для каждой сигнатуры возвращает похожие элементы каталога [(id, сходство)],
+    по убыванию сходства. Кандидаты берутся только из совпавших LSH-корзин,
+    поэтому стоимость не зависит от размера каталога.
+    """
+    results: List[List[Tuple[int, float]]] = [[] for _ in range(len(sigs))]
+    if not len(sigs):
+        return results
+    buckets = band_buckets(sigs)
+    signed = _signed(sigs)
+    keys = {(band, int(buckets[i, band])) for i in np.flatnonzero(signed) for band in range(LSH_BANDS)}
+    if not keys:
+        return results
+    candidates: Dict[Tuple[int, int], List[int]] = {}
+    for band, bucket, item_id in db.query(
+            LibraryItemLshBand.band, LibraryItemLshBand.bucket, LibraryItemLshBand.item_id
+    ).filter(tuple_(LibraryItemLshBand.band, LibraryItemLshBand.bucket).in_(keys)):
+        candidates.setdefault((band, bucket), []).append(item_id)
+    if not candidates:
+        return results
+    candidate_ids = {item_id for ids in candidates.values() for item_id in ids}
+    stored = {
+        item_id: decode_signature(minhash)
+        for item_id, minhash in db.query(LibraryItem.id, LibraryItem.minhash).filter(
+            LibraryItem.id.in_(candidate_ids), LibraryItem.minhash.isnot(None)
+        )
+    }
+    for i, sig in enumerate(sigs):
+        if not signed[i]:
+            continue
+        ids = sorted({
+            item_id
+            for band in range(LSH_BANDS)
+            for item_id in candidates.get((band, int(buckets[i, band])), [])
+            if item_id in stored
+        })
+        if not ids:
+            continue
+        scores = _similarities(sig, np.stack([stored[item_id] for item_id in ids]))
+        matches = [(item_id, float(score)) for item_id, score in zip(ids, scores) if score >= DEDUP_THRESHOLD]
+        results[i] = sorted(matches, key=lambda match: -match[1])
+    return results
+
+
+def duplicates_within(sigs: np.ndarray) -> List[Optional[int]]:
+    """
+    Для каждой сигнатуры порции — индекс более раннего дубликата в той же порции или None.
+    """
+    buckets = band_buckets(sigs)
+    signed = _signed(sigs)
+    seen: Dict[Tuple[int, int], List[int]] = {}
+    result: List[Optional[int]] = []
+    for i, sig in enumerate(sigs):
+        if not signed[i]:
+            result.append(None)
+            continue
+        earlier = sorted({j for band in range(LSH_BANDS) for j in seen.get((band, int(buckets[i, band])), [])})
+        match = None
+        if earlier:
+            scores = _similarities(sig, sigs[earlier])
+            if scores.max() >= DEDUP_THRESHOLD:
+                match = earlier[int(scores.argmax())]
+        result.append(match)
+        for band in range(LSH_BANDS):
+            seen.setdefault((band, int(buckets[i, band])), []).append(i)
+    return result
+
+
+# ======================================================================
+# Сканирование каталога
+# ======================================================================
+
+def _backfill_signatures(db: Session, ctx: Optional[JobContext] = None) -> int:
+    """
+    Считает сигнатуры элементов, у которых их ещё нет (например, созданных до миграции).
+    """
+    ctx = ctx or LocalJobContext(db)
+    filled, last_id = 0, 0
+    while True:
+        rows = (
+            db.query(LibraryItem.id, LibraryItem.title, LibraryItem.author)
+            .filter(LibraryItem.id > last_id, LibraryItem.minhash.is_(None))
+            .order_by(LibraryItem.id)
+            .limit(DEDUP_SCAN_CHUNK_SIZE)
+            .all()
+        )
+        if not rows:
+            return filled
+        sigs = signatures([(row.title, row.author) for row in rows])
+        ids = [row.id for row in rows]
+        db.execute(
+            update(LibraryItem),
+            [{"id": item_id, "minhash": encode_signature(sig)} for item_id, sig in zip(ids, sigs)],
+        )
+        store_bands(db, ids, sigs)
+        filled += len(rows)
+        last_id = ids[-1]
+        ctx.report_progress(filled)
+
+
+def _find(parents: Dict[int, int], item_id: int) -> int:
+    root = item_id
+    while parents.setdefault(root, root) != root:
+        root = parents[root]
+    while parents[item_id] != root:
+        parents[item_id], item_id = root, parents[item_id]
+    return root
+
+
+def _candidate_groups(db: Session) -> Iterable[List[int]]:
+    groups = (
+        db.query(func.array_agg(LibraryItemLshBand.item_id))
+        .group_by(LibraryItemLshBand.band, LibraryItemLshBand.bucket)
+        .having(func.count() > 1)
+        .yield_per(DEDUP_SCAN_CHUNK_SIZE)
+    )
+    for (ids,) in groups:
+        if len(ids) > DEDUP_MAX_BUCKET:
+            logger.warning("LSH-корзина из %s элементов проверена частично", len(ids))
+            ids = sorted(ids)[:DEDUP_MAX_BUCKET]
+        yield ids
+
+
+def scan_duplicates(db: Session, ctx: Optional[JobContext] = None) -> dict:
+    """
+    Находит кластеры вероятных дубликатов во всём каталоге. Попарно сравниваются
+    только элементы из общих LSH-корзин, сравнения внутри корзины векторизованы.
+    """
+    backfilled = _backfill_signatures(db, ctx)
+    groups = [sorted(ids) for ids in _candidate_groups(db)]
+    candidate_ids = sorted({item_id for ids in groups for item_id in ids})
+    stored: Dict[int, np.ndarray] = {}
+    for start in range(0, len(candidate_ids), DEDUP_SCAN_CHUNK_SIZE):
+        chunk = candidate_ids[start:start + DEDUP_SCAN_CHUNK_SIZE]
+        for item_id, minhash in db.query(LibraryItem.id, LibraryItem.minhash).filter(LibraryItem.id.in_(chunk)):
+            stored[item_id] = decode_signature(minhash)
+
+    parents: Dict[int, int] = {}
+    for ids in groups:
+        ids = [item_id for item_id in ids if item_id in stored]
+        if len(ids) < 2:
+            continue
+        sigs = np.stack([stored[item_id] for item_id in ids])
+        scores = (sigs[:, None, :] == sigs[None, :, :]).mean(axis=2)
+        for i, j in zip(*np.nonzero(np.triu(scores >= DEDUP_THRESHOLD, k=1))):
+            parents[_find(parents, ids[i])] = _find(parents, ids[j])
+
+    clusters: Dict[int, List[int]] = {}
+    for item_id in parents:
+        clusters.setdefault(_find(parents, item_id), []).append(item_id)
+    ordered = sorted((sorted(ids) for ids in clusters.values()), key=lambda ids: (-len(ids), ids[0]))
+    return {
+        "signatures_backfilled": backfilled,
+        "cluster_count": len(ordered),
+        "duplicate_items": sum(len(ids) for ids in ordered),
+        "clusters": ordered[:DEDUP_MAX_REPORTED_CLUSTERS],
+    }
+
+
+@job_handler("scan_duplicates")
+def scan_duplicates_job(ctx: JobContext, params: dict) -> dict:
+    """
+    Фоновое сканирование каталога на дубликаты; кластеры возвращаются в результате задачи.
+    Объединить дубликаты можно через POST /library_items/{item_id}/merge.
+    """
+    return scan_duplicates(ctx.db, ctx=ctx)
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from decouple import config
+from sqlalchemy import event, func
+from sqlalchemy import select as sql_select
+from sqlalchemy.orm import Session
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+# Типы событий инвалидации
+ITEM_CHANGED = "item_changed"
+USER_CHANGED = "user_changed"
+CATALOG_VERSION_BUMPED = "catalog_version_bumped"
+
+NOTIFY_CHANNEL = "library_invalidation"
+INVALIDATION_BUS = config(
+    "INVALIDATION_BUS", default="postgres" if engine.dialect.name == "postgresql" else "memory"
+)
+
+# Идентификатор процесса: собственные уведомления уже доставлены локально
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_PENDING_KEY = "pending_invalidations"
+
+
+@dataclass(frozen=True)
+class InvalidationEvent:
+    kind: str
+    id: Optional[int] = None
+
+
+class InvalidationBus:
+    """
+    Шина событий инвалидации кешей. События, опубликованные в сессии,
+    доставляются локальным подписчикам после коммита транзакции.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[Callable[[InvalidationEvent], None]]] = defaultdict(list)
+
+    def subscribe(self, kind: str, callback: Callable[[InvalidationEvent], None]) -> None:
+        self._subscribers[kind].append(callback)
+
+    def publish(self, db: Session, invalidation: InvalidationEvent) -> None:
+        db.info.setdefault(_PENDING_KEY, []).append(invalidation)
+        self._publish_remote(db, invalidation)
+
+    def dispatch(self, invalidation: InvalidationEvent) -> None:
+        for callback in self._subscribers.get(invalidation.kind, []):
+            try:
+                callback(invalidation)
+            except Exception:
+                logger.exception("Ошибка подписчика на событие %s", invalidation.kind)
+
+    def _publish_remote(self, db: Session, invalidation: InvalidationEvent) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class InMemoryInvalidationBus(InvalidationBus):
+    """
+    Шина в пределах одного процесса. Используется в тестах и без PostgreSQL.
+    """
+
+
+class PostgresInvalidationBus(InvalidationBus):
+    """
+    Шина на LISTEN/NOTIFY: уведомление отправляется в транзакции записи
+    и доставляется другим воркерам только после её коммита.
+    """
+
+    def __init__(self, channel: str = NOTIFY_CHANNEL, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _publish_remote(self, db: Session, invalidation: InvalidationEvent) -> None:
+        payload = json.dumps({**asdict(invalidation), "origin": ORIGIN})
+        db.execute(sql_select(func.pg_notify(self.channel, payload)))
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._listen, name="invalidation-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _receive(self, payload: str) -> None:
+        message = json.loads(payload)
+        if message.pop("origin", None) == ORIGIN:
+            return
+        self.dispatch(InvalidationEvent(**message))
+
+    def _listen(self) -> None:
+        while not self._stopped.is_set():
+            dbapi_connection = None
+            try:
+                # Отдельное соединение вне пула: оно занято слушателем всё время работы
+                connection = engine.raw_connection()
+                dbapi_connection = connection.driver_connection
+                connection.detach()
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                # Пока слушатель был отключён, события могли быть пропущены
+                self.dispatch(InvalidationEvent(CATALOG_VERSION_BUMPED))
+                while not self._stopped.is_set():
+                    if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        self._receive(dbapi_connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Слушатель событий инвалидации отключился, переподключение")
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                if dbapi_connection is not None:
+                    dbapi_connection.close()
+
+
+def create_invalidation_bus(backend: str = INVALIDATION_BUS) -> InvalidationBus:
+    if backend == "postgres":
+        return PostgresInvalidationBus()
+    if backend == "memory":
+        return InMemoryInvalidationBus()
+    raise ValueError(f"Unknown invalidation bus backend: {backend}")
+
+
+invalidation_bus = create_invalidation_bus()
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_after_commit(session: Session) -> None:
+    for invalidation in dict.fromkeys(session.info.pop(_PENDING_KEY, [])):
+        invalidation_bus.dispatch(invalidation)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
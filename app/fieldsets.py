@@ -0,0 +1,63 @@
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict, create_model
+
+from app.models import LibraryItem
+
+# Поля, доступные через параметр fields=, и их типы в ответе
+LIBRARY_ITEM_FIELDS: Dict[str, type] = {
+    "id": int,
+    "title": str,
+    "author": str,
+    "genre": Optional[str],
+    "published_year": Optional[int],
+    "description": Optional[str],
+    "available_copies": int,
+    "version": int,
+}
+# Список по умолчанию не читает description: на страницах списка это большая часть объёма
+DEFAULT_LIST_FIELDS = ("id", "title", "author", "genre", "published_year", "available_copies")
+DEFAULT_DETAIL_FIELDS = tuple(LIBRARY_ITEM_FIELDS)
+
+
+def parse_fields(fields: Optional[str], default: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    Разбирает параметр fields (например, "title,available_copies" или "*").
+    id возвращается всегда; порядок полей фиксирован, чтобы одинаковые наборы
+    давали один и тот же ключ.
+    """
+    if not fields:
+        return default
+    if fields.strip() == "*":
+        return tuple(LIBRARY_ITEM_FIELDS)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - LIBRARY_ITEM_FIELDS.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed values: {', '.join(LIBRARY_ITEM_FIELDS)}",
+        )
+    requested.add("id")
+    return tuple(name for name in LIBRARY_ITEM_FIELDS if name in requested)
+
+
+@lru_cache(maxsize=None)
+def fieldset_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """
+    Модель ответа для набора полей. Наборов не больше 2^7, поэтому кеш не ограничен.
+    """
+    return create_model(
+        "LibraryItemFields_" + "_".join(fields),
+        __config__=ConfigDict(from_attributes=True),
+        **{name: (LIBRARY_ITEM_FIELDS[name], ...) for name in fields},
+    )
+
+
+def fieldset_columns(fields: Tuple[str, ...], columns: Optional[Dict[str, Any]] = None) -> List:
+    """
+    Столбцы для набора полей; columns заменяет отдельные столбцы LibraryItem.
+    """
+    columns = columns or {}
+    return [columns[name].label(name) if name in columns else getattr(LibraryItem, name) for name in fields]
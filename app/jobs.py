@@ -0,0 +1,335 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from decouple import config
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, get_db
+from app.models import Job
+from app.profiling import ProfiledRoute
+from app.schemas import JobCreate, JobRead
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = config("JOB_WORKERS", cast=int, default=2)
+JOB_POLL_INTERVAL_SECONDS = config("JOB_POLL_INTERVAL_SECONDS", cast=float, default=2.0)
+# Задача без heartbeat дольше этого времени считается потерянной (воркер упал)
+JOB_STALE_SECONDS = config("JOB_STALE_SECONDS", cast=int, default=300)
+JOB_RETRY_DELAY_SECONDS = config("JOB_RETRY_DELAY_SECONDS", cast=int, default=5)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_HANDLERS: Dict[str, Callable[["JobContext", dict], Any]] = {}
+# Периодические задачи: вид задачи -> (интервал в секундах, параметры)
+PERIODIC_JOBS: Dict[str, Tuple[int, dict]] = {}
+
+# Доступ только для администраторов задаётся при подключении роутера в main.py
+jobs_router = APIRouter(prefix="/jobs", tags=["Jobs"], route_class=ProfiledRoute)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """
+    Контекст выполнения задачи, передаваемый обработчику.
+    Обработчик работает с собственной сессией ctx.db.
+    """
+
+    def __init__(self, db: Session, job: Job):
+        self.db = db
+        self.job_id = job.id
+        self.attempt = job.attempts
+        # Прогресс предыдущей попытки: обработчик может продолжить с этого места
+        self.progress = job.progress
+
+    def report_progress(self, progress: int, total: Optional[int] = None) -> None:
+        """
+        Сохраняет прогресс и фиксирует текущую транзакцию обработчика.
+        Если задачу попросили отменить, выбрасывает JobCancelled.
+        """
+        values = {"progress": progress, "heartbeat_at": datetime.utcnow()}
+        if total is not None:
+            values["total"] = total
+        cancel_requested = self.db.execute(
+            update(Job).where(Job.id == self.job_id).values(**values).returning(Job.cancel_requested)
+        ).scalar()
+        self.db.commit()
+        self.progress = progress
+        if cancel_requested:
+            raise JobCancelled()
+
+
+class LocalJobContext(JobContext):
+    """
+    Контекст для запуска обработчика вне очереди (CLI, вызов из кода):
+    сохранение прогресса только фиксирует транзакцию.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.job_id = None
+        self.attempt = 1
+        self.progress = 0
+
+    def report_progress(self, progress: int, total: Optional[int] = None) -> None:
+        self.db.commit()
+        self.progress = progress
+
+
+def job_handler(kind: str):
+    """
+    Регистрирует функцию handler(ctx, params) как обработчик задач вида kind.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def schedule_periodic_job(kind: str, interval_seconds: int, params: Optional[dict] = None) -> None:
+    """
+    Регистрирует задачу, которую JobRunner ставит в очередь раз в interval_seconds.
+    """
+    PERIODIC_JOBS[kind] = (interval_seconds, params or {})
+
+
+def enqueue_job(db: Session, kind: str, params: Optional[dict] = None, max_attempts: int = 3) -> Job:
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(kind=kind, params=params or {}, status=JOB_QUEUED, max_attempts=max_attempts)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    job_runner.wakeup()
+    return job
+
+
+def _claim_next_job() -> Optional[int]:
+    # SKIP LOCKED позволяет нескольким процессам разбирать очередь без конфликтов
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        candidate = (
+            select(Job.id)
+            .where(Job.status == JOB_QUEUED, or_(Job.run_after.is_(None), Job.run_after <= now))
+            .order_by(Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        job_id = db.execute(
+            update(Job)
+            .where(Job.id == candidate)
+            .values(status=JOB_RUNNING, started_at=now, heartbeat_at=now,
+                    attempts=Job.attempts + 1, run_after=None)
+            .returning(Job.id)
+        ).scalar()
+        db.commit()
+        return job_id
+    finally:
+        db.close()
+
+
+def _maintain_jobs(running_ids: list) -> None:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        if running_ids:
+            db.execute(
+                update(Job)
+                .where(Job.id.in_(running_ids), Job.status == JOB_RUNNING)
+                .values(heartbeat_at=now)
+            )
+        stale = Job.status == JOB_RUNNING, Job.heartbeat_at < now - timedelta(seconds=JOB_STALE_SECONDS)
+        db.execute(
+            update(Job).where(*stale, Job.attempts >= Job.max_attempts)
+            .values(status=JOB_FAILED, error="Job worker lost", finished_at=now)
+        )
+        db.execute(update(Job).where(*stale).values(status=JOB_QUEUED))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _enqueue_due_periodic_jobs() -> None:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        for kind, (interval, params) in PERIODIC_JOBS.items():
+            # Блокировка транзакции не даёт двум воркерам поставить одну задачу дважды
+            db.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"jobs:{kind}"))))
+            recent = db.query(Job.id).filter(
+                Job.kind == kind,
+                or_(Job.status.in_([JOB_QUEUED, JOB_RUNNING]),
+                    Job.created_at > now - timedelta(seconds=interval)),
+            ).first()
+            if recent is None:
+                db.add(Job(kind=kind, params=params, status=JOB_QUEUED))
+            db.commit()
+    finally:
+        db.close()
+
+
+def _finish_job(db: Session, job_id: int, **values) -> None:
+    db.query(Job).filter(Job.id == job_id).update(values)
+    db.commit()
+
+
+def _execute_job(job_id: int) -> None:
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        if job is None:
+            # Задачу удалили после того, как воркер её взял
+            logger.warning("Задача %s не найдена", job_id)
+            return
+        handler = JOB_HANDLERS.get(job.kind)
+        if handler is None:
+            _finish_job(db, job_id, status=JOB_FAILED, error=f"Unknown job kind: {job.kind}",
+                        finished_at=datetime.utcnow())
+            return
+        ctx = JobContext(db, job)
+        try:
+            result = handler(ctx, job.params or {})
+            db.commit()
+        except JobCancelled:
+            db.rollback()
+            _finish_job(db, job_id, status=JOB_CANCELLED, finished_at=datetime.utcnow())
+        except Exception as exc:
+            db.rollback()
+            logger.exception("Задача %s (%s) завершилась ошибкой", job_id, job.kind)
+            if job.attempts < job.max_attempts:
+                delay = JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+                _finish_job(db, job_id, status=JOB_QUEUED, error=str(exc),
+                            run_after=datetime.utcnow() + timedelta(seconds=delay))
+            else:
+                _finish_job(db, job_id, status=JOB_FAILED, error=str(exc), finished_at=datetime.utcnow())
+        else:
+            _finish_job(db, job_id, status=JOB_SUCCEEDED, result=result, error=None,
+                        finished_at=datetime.utcnow())
+    finally:
+        db.close()
+
+
+class JobRunner:
+    """
+    Выполняет задачи из таблицы jobs в собственном пуле потоков,
+    не занимая пул потоков обработчиков запросов.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Future] = {}
+
+    async def start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        # Незавершённые задачи будут подхвачены заново после истечения JOB_STALE_SECONDS
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._task = None
+        self._loop = None
+
+    def wakeup(self) -> None:
+        """
+        Будит цикл опроса очереди. Можно вызывать из любого потока.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(_maintain_jobs, list(self._running))
+                if PERIODIC_JOBS:
+                    await asyncio.to_thread(_enqueue_due_periodic_jobs)
+                while len(self._running) < self.workers:
+                    job_id = await asyncio.to_thread(_claim_next_job)
+                    if job_id is None:
+                        break
+                    future = self._loop.run_in_executor(self._executor, _execute_job, job_id)
+                    self._running[job_id] = future
+                    future.add_done_callback(lambda _, job_id=job_id: self._on_job_done(job_id))
+            except Exception:
+                logger.exception("Ошибка в цикле обработки задач")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            self._wakeup.clear()
+
+    def _on_job_done(self, job_id: int) -> None:
+        self._running.pop(job_id, None)
+        self._wakeup.set()
+
+
+job_runner = JobRunner()
+
+
+@jobs_router.post("/", response_model=JobRead)
+def create_job(
+        job: JobCreate,
+        db: Session = Depends(get_db)
+):
+    try:
+        return enqueue_job(db, job.kind, job.params, max_attempts=job.max_attempts)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@jobs_router.get("/{job_id}", response_model=JobRead)
+def get_job(
+        job_id: int,
+        db: Session = Depends(get_db)
+):
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@jobs_router.post("/{job_id}/cancel", response_model=JobRead)
+def cancel_job(
+        job_id: int,
+        db: Session = Depends(get_db)
+):
+    """
+    Отменяет задачу: ожидающая задача отменяется сразу,
+    выполняющаяся — при следующем сохранении прогресса.
+    """
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status not in (JOB_QUEUED, JOB_RUNNING):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    db.query(Job).filter(Job.id == job_id).update({"cancel_requested": True})
+    # Условие на статус защищает от гонки с воркером, который как раз взял задачу
+    db.query(Job).filter(Job.id == job_id, Job.status == JOB_QUEUED).update(
+        {"status": JOB_CANCELLED, "finished_at": datetime.utcnow()}
+    )
+    db.commit()
+    db.refresh(job)
+    return job
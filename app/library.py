@@ -1,105 +1,510 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from decouple import config
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
-from app.models import LibraryItem, User
-from app.schemas import LibraryItemRead, LibraryItemCreate, LibraryItemUpdate, LibraryItemResponse
+from app.models import BorrowedBook, BranchInventory, InventoryDelta, LibraryItem, LibraryItemTombstone, User
+from app.profiling import ProfiledRoute
+from app.schemas import (
+    LibraryItemRead, LibraryItemCreate, LibraryItemUpdate, LibraryItemResponse,
+    LibraryItemChange, LibraryItemChangeFeed, LibraryItemFields, LibraryItemMerge, SimilarLibraryItem,
+)
 from app.database import get_db
+from app.changefeed import pending_change_seq
 from app.auth import get_current_user
+from app.counting import COUNT_MODE_SNAPSHOT, count_items
+from app.sorting import library_item_order_by, library_item_sort_keys
+from app.snapshot import catalog_snapshot
+from app.fieldsets import (
+    DEFAULT_DETAIL_FIELDS, DEFAULT_LIST_FIELDS, fieldset_columns, fieldset_model, parse_fields,
+)
+from app.events import CATALOG_VERSION_BUMPED, ITEM_CHANGED, InvalidationEvent, invalidation_bus
+from app.jobs import JobContext, job_handler
+from app.similarity import SIMILAR_ITEMS_K, get_similarity_index
+from app import dedup
+from app.singleflight import SingleFlight
 
-library_router = APIRouter(prefix="/library_items", tags=["Library Items"])
+BULK_LOAD_CHUNK_SIZE = config("BULK_LOAD_CHUNK_SIZE", cast=int, default=1000)
+
+library_router = APIRouter(prefix="/library_items", tags=["Library Items"], route_class=ProfiledRoute)
+
+# Одинаковые одновременные запросы списка выполняются одним запросом к БД
+_list_flight = SingleFlight("library_items_list")
+invalidation_bus.subscribe(ITEM_CHANGED, _list_flight.invalidate)
+invalidation_bus.subscribe(CATALOG_VERSION_BUMPED, _list_flight.invalidate)
+
+
+def _etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _parse_if_match(if_match: Optional[str]) -> Optional[List[int]]:
+    """
+    Возвращает список допустимых версий из If-Match или None, если проверка не нужна.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.isdigit():
+            versions.append(int(tag))
+    return versions
+
+
+def _write_failed(db: Session, item_id: int) -> HTTPException:
+    # Запись не затронула строку: элемента нет либо версия не совпала с If-Match
+    if db.query(LibraryItem.id).filter(LibraryItem.id == item_id).first() is None:
+        return HTTPException(status_code=404, detail="Library item not found")
+    return HTTPException(status_code=412, detail="Library item was modified by another request")
 
 
 @library_router.post("/", response_model=LibraryItemRead)
 def create_library_item(
         item: LibraryItemCreate,
+        response: Response,
         db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        current_user: User = Depends(get_current_user),
+        force: bool = False
 ):
+    """
+    Создаёт элемент библиотеки. Если в каталоге уже есть похожий элемент
+    (по названию и автору), возвращается 409 со списком кандидатов;
+    force=true создаёт элемент без этой проверки.
+    """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access forbidden")
-    db_item = LibraryItem(**item.dict())
-    db.add(db_item)
+    sigs = dedup.signatures([(item.title, item.author)])
+    if not force:
+        duplicates = dedup.find_duplicates(db, sigs)[0]
+        if duplicates:
+            raise HTTPException(status_code=409, detail={
+                "message": "Possible duplicate of existing library items",
+                "duplicates": [{"id": item_id, "similarity": score} for item_id, score in duplicates],
+            })
     try:
+        db_item = db.execute(
+            insert(LibraryItem)
+            .values(**item.dict(), minhash=dedup.encode_signature(sigs[0]), change_seq=pending_change_seq(db))
+            .returning(LibraryItem)
+        ).scalar_one()
+        # Ответ строится до коммита, чтобы не перечитывать строку после него
+        created = LibraryItemRead.model_validate(db_item, from_attributes=True)
+        dedup.store_bands(db, [created.id], sigs)
+        invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, created.id))
         db.commit()
-        db.refresh(db_item)
-        return db_item
+        response.headers["ETag"] = _etag(created.version)
+        return created
     except SQLAlchemyError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Error creating item")
 
 
-@library_router.get("/", response_model=List[LibraryItemResponse])
+@library_router.get("/", response_model=None, responses={200: {"model": List[LibraryItemFields]}})
 def get_library_items(
+        response: Response,
         db: Session = Depends(get_db),
         current_user: User = Depends(get_current_user),  # Проверяем, авторизован ли пользователь
         author: Optional[str] = None,
         published_year: Optional[int] = None,
         genre: Optional[str] = None,
         skip: int = 0,
-        limit: int = 10
+        limit: int = 10,
+        include_total: bool = False,
+        sort: Optional[str] = None,
+        fields: Optional[str] = None,
+        branch_id: Optional[int] = None,
+        in_stock: bool = False
 ):
     """
     Получает список элементов библиотеки с фильтрацией по автору, году публикации и жанру.
     Только авторизованные пользователи могут делать этот запрос.
+    Параметр sort принимает одну из допустимых сортировок (например, "-published_year,title").
+    При include_total=true общее количество возвращается в заголовке X-Total-Count,
+    а способ подсчёта (exact, estimate или cached) — в заголовке X-Total-Count-Mode.
+    Одинаковые одновременные запросы (с учётом роли пользователя) ждут результат
+    первого из них вместо повторного запроса к БД.
+    При CATALOG_SNAPSHOT=true запрос обслуживается из снимка каталога в памяти.
+    Параметр fields задаёт возвращаемые поля через запятую ("*" — все); по умолчанию
+    возвращаются все поля, кроме description. Из БД читаются только эти столбцы.
+    С branch_id возвращаются только элементы фонда филиала, а available_copies
+    в ответе — экземпляры этого филиала; запрос читает одну секцию. Сортировка
+    по available_copies вместе с branch_id не поддерживается.
+    in_stock=true оставляет элементы, у которых есть доступные экземпляры.
     """
-    query = db.query(LibraryItem)
+    # Пустые значения фильтров не фильтруют: приводим их к None до построения запроса и ключей кеша
+    author, published_year, genre = author or None, published_year or None, genre or None
+    selected = parse_fields(fields, DEFAULT_LIST_FIELDS)
+    model = fieldset_model(selected)
+    if catalog_snapshot.enabled and branch_id is None:
+        items, total = catalog_snapshot.query(
+            db, author, published_year, genre, library_item_sort_keys(sort), skip, limit, include_total, model,
+            in_stock,
+        )
+        if include_total:
+            response.headers["X-Total-Count"] = str(total)
+            response.headers["X-Total-Count-Mode"] = COUNT_MODE_SNAPSHOT
+        return items
+
+    # В филиале доступные экземпляры берутся из его фонда, а не из общего счётчика
+    available = LibraryItem.available_copies
+    overrides = {}
+    if branch_id is not None:
+        # Под сортировку по фонду филиала с названием нет индекса: она сортировала бы всю секцию
+        if any(name == "available_copies" for name, _ in library_item_sort_keys(sort)):
+            raise HTTPException(status_code=400, detail="Sorting by available_copies is not supported with branch_id")
+        available = BranchInventory.available_copies
+        overrides = {"available_copies": available}
+    order_by = library_item_order_by(sort, overrides)
+
+    def load():
+        query = db.query(*fieldset_columns(selected, overrides))
+        if branch_id is not None:
+            query = query.join(
+                BranchInventory,
+                (BranchInventory.item_id == LibraryItem.id) & (BranchInventory.branch_id == branch_id),
+            )
+
+        if author:
+            query = query.filter(LibraryItem.author.ilike(f"%{author}%"))
+        if published_year:
+            query = query.filter(LibraryItem.published_year == published_year)
+        if genre:
+            query = query.filter(LibraryItem.genre.ilike(f"%{genre}%"))
+        if in_stock:
+            query = query.filter(available > 0)
+
+        total = mode = None
+        if include_total:
+            total, mode = count_items(
+                db, query, LibraryItem.__tablename__,
+                {"author": author and author.lower(), "published_year": published_year, "genre": genre and genre.lower(),
+                 "branch_id": branch_id, "in_stock": in_stock or None},
+            )
 
-    if author:
-        query = query.filter(LibraryItem.author.ilike(f"%{author}%"))
-    if published_year:
-        query = query.filter(LibraryItem.published_year == published_year)
-    if genre:
-        query = query.filter(LibraryItem.genre.ilike(f"%{genre}%"))
+        # Результат отдаётся и другим запросам, поэтому он не должен зависеть от сессии
+        items = [
+            model.model_validate(row, from_attributes=True)
+            for row in query.order_by(*order_by).offset(skip).limit(limit).all()
+        ]
+        return items, total, mode
 
-    items = query.offset(skip).limit(limit).all()
+    # ilike не зависит от регистра, поэтому и ключ тоже
+    key = (
+        current_user.role, author and author.lower(), published_year, genre and genre.lower(),
+        skip, limit, include_total, sort and sort.replace(" ", ""), selected, branch_id, in_stock,
+    )
+    items, total, mode = _list_flight.do(key, load)
+    if include_total:
+        response.headers["X-Total-Count"] = str(total)
+        response.headers["X-Total-Count-Mode"] = mode
     return items
 
 
-@library_router.get("/{item_id}", response_model=LibraryItemRead)
-def get_library_item(item_id: int, db: Session = Depends(get_db)):
-    db_item = db.query(LibraryItem).filter(LibraryItem.id == item_id).first()
-    if not db_item:
+@library_router.get("/changes", response_model=LibraryItemChangeFeed)
+def get_library_item_changes(
+        since: int = 0,
+        limit: int = 100,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Возвращает изменения каталога с номером больше since в порядке номеров.
+    Клиент сохраняет next_since и передаёт его в следующем запросе.
+    """
+    limit = max(1, min(limit, 1000))
+    items = (
+        db.query(LibraryItem)
+        .filter(LibraryItem.change_seq > since)
+        .order_by(LibraryItem.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    tombstones = (
+        db.query(LibraryItemTombstone)
+        .filter(LibraryItemTombstone.change_seq > since)
+        .order_by(LibraryItemTombstone.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    changes = [
+        LibraryItemChange(seq=item.change_seq, item_id=item.id, item=LibraryItemRead.model_validate(item, from_attributes=True))
+        for item in items
+    ] + [
+        LibraryItemChange(seq=tombstone.change_seq, item_id=tombstone.item_id, deleted=True)
+        for tombstone in tombstones
+    ]
+    changes.sort(key=lambda change: change.seq)
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return LibraryItemChangeFeed(
+        changes=changes,
+        next_since=changes[-1].seq if changes else since,
+        has_more=has_more,
+    )
+
+
+@library_router.get("/{item_id}", response_model=None, responses={200: {"model": LibraryItemFields}})
+def get_library_item(
+        item_id: int,
+        response: Response,
+        db: Session = Depends(get_db),
+        fields: Optional[str] = None
+):
+    """
+    Возвращает элемент библиотеки. Параметр fields ограничивает набор полей
+    (по умолчанию — все); версия для ETag читается всегда.
+    """
+    selected = parse_fields(fields, DEFAULT_DETAIL_FIELDS)
+    row = (
+        db.query(*fieldset_columns(selected), LibraryItem.version.label("etag_version"))
+        .filter(LibraryItem.id == item_id)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Library item not found")
+    response.headers["ETag"] = _etag(row.etag_version)
+    return fieldset_model(selected).model_validate(row, from_attributes=True)
+
+
+@library_router.get("/{item_id}/similar", response_model=List[SimilarLibraryItem])
+def get_similar_library_items(
+        item_id: int,
+        limit: int = 10,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Возвращает элементы, похожие на данный по названию, жанру и описанию.
+    Соседи заранее посчитаны в индексе (см. app/similarity.py); новые и изменённые
+    элементы попадают в него после фонового обновления.
+    """
+    index = get_similarity_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Similarity index is not built yet")
+    neighbors = index.similar(item_id, SIMILAR_ITEMS_K)
+    if not neighbors and not db.query(LibraryItem.id).filter(LibraryItem.id == item_id).first():
         raise HTTPException(status_code=404, detail="Library item not found")
-    return db_item
+    # Удалённые после построения индекса элементы отсеиваются здесь
+    items = {
+        item.id: item
+        for item in db.query(LibraryItem).filter(LibraryItem.id.in_([neighbor_id for neighbor_id, _ in neighbors])).all()
+    }
+    return [
+        SimilarLibraryItem(
+            **LibraryItemResponse.model_validate(items[neighbor_id], from_attributes=True).model_dump(),
+            score=score,
+        )
+        for neighbor_id, score in neighbors
+        if neighbor_id in items
+    ][:max(limit, 1)]
 
 
 @library_router.put("/{item_id}", response_model=LibraryItemRead)
 def update_library_item(
         item_id: int,
         item_update: LibraryItemUpdate,
+        response: Response,
         db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        current_user: User = Depends(get_current_user),
+        if_match: Optional[str] = Header(None)
 ):
+    """
+    Обновляет элемент одним UPDATE ... RETURNING.
+    При заголовке If-Match обновление выполняется только для указанной версии,
+    иначе возвращается 412.
+    """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access forbidden")
-    db_item = db.query(LibraryItem).filter(LibraryItem.id == item_id).first()
-    if not db_item:
-        raise HTTPException(status_code=404, detail="Library item not found")
-    for key, value in item_update.dict(exclude_unset=True).items():
-        setattr(db_item, key, value)
+    stmt = update(LibraryItem).where(LibraryItem.id == item_id)
+    expected_versions = _parse_if_match(if_match)
+    if expected_versions is not None:
+        stmt = stmt.where(LibraryItem.version.in_(expected_versions))
+    stmt = stmt.values(
+        **item_update.dict(exclude_unset=True),
+        version=LibraryItem.version + 1,
+        change_seq=pending_change_seq(db),
+    ).returning(LibraryItem)
+    db_item = db.execute(stmt, execution_options={"synchronize_session": False}).scalar_one_or_none()
+    if db_item is None:
+        raise _write_failed(db, item_id)
+    updated = LibraryItemRead.model_validate(db_item, from_attributes=True)
+    if item_update.title is not None or item_update.author is not None:
+        # Сигнатура и полосы переписываются, только если обновлённая строка с ними расходится
+        sig = dedup.signatures([(updated.title, updated.author)])
+        if db_item.minhash != dedup.encode_signature(sig[0]):
+            dedup.reindex_item(db, item_id, sig)
+    invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, item_id))
     db.commit()
-    db.refresh(db_item)
-    return db_item
+    response.headers["ETag"] = _etag(updated.version)
+    return updated
 
 
 @library_router.delete("/{item_id}", response_model=dict)
 def delete_library_item(
         item_id: int,
         db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
+        current_user: User = Depends(get_current_user),
+        if_match: Optional[str] = Header(None)
 ):
+    """
+    Удаляет элемент и записывает tombstone одним запросом (DELETE ... RETURNING в CTE).
+    """
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access forbidden")
-    db_item = db.query(LibraryItem).filter(LibraryItem.id == item_id).first()
-    if not db_item:
-        raise HTTPException(status_code=404, detail="Library item not found")
+    deleted = delete(LibraryItem).where(LibraryItem.id == item_id)
+    expected_versions = _parse_if_match(if_match)
+    if expected_versions is not None:
+        deleted = deleted.where(LibraryItem.version.in_(expected_versions))
+    deleted = deleted.returning(LibraryItem.id).cte("deleted")
+    stmt = (
+        insert(LibraryItemTombstone)
+        .from_select(["item_id", "change_seq"], select(deleted.c.id, pending_change_seq(db)))
+        .add_cte(deleted)
+        .returning(LibraryItemTombstone.item_id)
+    )
     try:
-        db.delete(db_item)
+        if db.execute(stmt).scalar_one_or_none() is None:
+            raise _write_failed(db, item_id)
+        invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, item_id))
         db.commit()
         return {"detail": "Item deleted successfully"}
     except SQLAlchemyError:
         db.rollback()
         raise HTTPException(status_code=500, detail="Failed to delete item")
+
+
+@library_router.post("/{item_id}/merge", response_model=LibraryItemRead)
+def merge_library_items(
+        item_id: int,
+        merge: LibraryItemMerge,
+        response: Response,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user)
+):
+    """
+    Объединяет дубликаты с элементом: их экземпляры прибавляются к available_copies,
+    а сами дубликаты удаляются (с tombstone для ленты изменений) одним запросом.
+    Фонд дубликатов в филиалах и несвёрнутый журнал его изменений
+    предварительно переносятся на элемент.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access forbidden")
+    duplicate_ids = sorted(set(merge.duplicate_ids))
+    if not duplicate_ids or item_id in duplicate_ids:
+        raise HTTPException(status_code=400, detail="duplicate_ids must be non-empty and must not include the item itself")
+    # Блокировка дубликатов не даёт параллельно добавить для них записи журнала фонда
+    found = {row.id for row in db.query(LibraryItem.id).filter(LibraryItem.id.in_(duplicate_ids)).with_for_update()}
+    missing = [duplicate_id for duplicate_id in duplicate_ids if duplicate_id not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Library items not found: {missing}")
+
+    if db.get(LibraryItem, item_id) is None:
+        raise HTTPException(status_code=404, detail="Library item not found")
+
+    # Фонд дубликатов в филиалах переходит к элементу до каскадного удаления
+    moved = (
+        select(BranchInventory.branch_id, literal(item_id), func.sum(BranchInventory.total_copies),
+               func.sum(BranchInventory.available_copies))
+        .where(BranchInventory.item_id.in_(duplicate_ids))
+        .group_by(BranchInventory.branch_id)
+    )
+    stock = pg_insert(BranchInventory).from_select(
+        ["branch_id", "item_id", "total_copies", "available_copies"], moved
+    )
+    db.execute(stock.on_conflict_do_update(
+        index_elements=["branch_id", "item_id"],
+        set_={
+            "total_copies": BranchInventory.total_copies + stock.excluded.total_copies,
+            "available_copies": BranchInventory.available_copies + stock.excluded.available_copies,
+        },
+    ))
+    # Ещё не свёрнутые изменения фонда дубликатов переходят к элементу, а не удаляются каскадом
+    db.execute(
+        update(InventoryDelta).where(InventoryDelta.item_id.in_(duplicate_ids)).values(item_id=item_id),
+        execution_options={"synchronize_session": False},
+    )
+    # Выдачи дубликатов в филиалах тоже: иначе возврат не вернул бы экземпляр в фонд
+    db.execute(
+        update(BorrowedBook).where(BorrowedBook.item_id.in_(duplicate_ids)).values(item_id=item_id),
+        execution_options={"synchronize_session": False},
+    )
+    deleted = (
+        delete(LibraryItem)
+        .where(LibraryItem.id.in_(duplicate_ids))
+        .returning(LibraryItem.id, LibraryItem.available_copies)
+        .cte("deleted")
+    )
+    tombstones = (
+        insert(LibraryItemTombstone)
+        .from_select(["item_id", "change_seq"], select(deleted.c.id, pending_change_seq(db)))
+        .returning(LibraryItemTombstone.item_id)
+        .cte("tombstones")
+    )
+    stmt = (
+        update(LibraryItem)
+        .where(LibraryItem.id == item_id)
+        .values(
+            available_copies=LibraryItem.available_copies
+            + select(func.coalesce(func.sum(deleted.c.available_copies), 0)).scalar_subquery(),
+            version=LibraryItem.version + 1,
+            change_seq=pending_change_seq(db),
+        )
+        .add_cte(deleted)
+        .add_cte(tombstones)
+        .returning(LibraryItem)
+    )
+    db_item = db.execute(stmt, execution_options={"synchronize_session": False}).scalar_one_or_none()
+    if db_item is None:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Library item not found")
+    merged = LibraryItemRead.model_validate(db_item, from_attributes=True)
+    for changed_id in [item_id, *duplicate_ids]:
+        invalidation_bus.publish(db, InvalidationEvent(ITEM_CHANGED, changed_id))
+    db.commit()
+    response.headers["ETag"] = _etag(merged.version)
+    return merged
+
+
+@job_handler("bulk_load_items")
+def bulk_load_items(ctx: JobContext, params: dict) -> dict:
+    """
+    Фоновая массовая загрузка элементов: params = {"items": [...]}.
+    Каждая порция фиксируется вместе с прогрессом, поэтому повтор
+    после ошибки продолжает с первой незагруженной порции.
+    Дубликаты уже существующих элементов и элементов той же порции
+    пропускаются, если не передано "skip_duplicates": false.
+    """
+    items = [LibraryItemCreate(**raw).dict() for raw in params.get("items", [])]
+    chunk_size = params.get("chunk_size", BULK_LOAD_CHUNK_SIZE)
+    skip_duplicates = params.get("skip_duplicates", True)
+    loaded_before = ctx.progress
+    inserted, skipped = 0, []
+    for start in range(loaded_before, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        sigs = dedup.signatures([(item["title"], item["author"]) for item in chunk])
+        if skip_duplicates:
+            existing = dedup.find_duplicates(ctx.db, sigs)
+            keep = [
+                i for i, earlier in enumerate(dedup.duplicates_within(sigs))
+                if earlier is None and not existing[i]
+            ]
+            kept = set(keep)
+            skipped.extend(start + i for i in range(len(chunk)) if i not in kept)
+            chunk, sigs = [chunk[i] for i in keep], sigs[keep]
+        if chunk:
+            item_ids = ctx.db.execute(
+                insert(LibraryItem)
+                .values(change_seq=pending_change_seq(ctx.db))
+                .returning(LibraryItem.id, sort_by_parameter_order=True),
+                [{**item, "minhash": dedup.encode_signature(sig)} for item, sig in zip(chunk, sigs)],
+            ).scalars().all()
+            dedup.store_bands(ctx.db, item_ids, sigs)
+            inserted += len(item_ids)
+        invalidation_bus.publish(ctx.db, InvalidationEvent(CATALOG_VERSION_BUMPED))
+        ctx.report_progress(min(start + chunk_size, len(items)), total=len(items))
+    return {"inserted": inserted, "skipped_duplicates": skipped}
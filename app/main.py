@@ -1,16 +1,44 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI
 import logging
 
-from app.database import create_db
-from app.auth import auth_router
+from app.database import SessionLocal, create_db
+from app.auth import auth_router, get_current_admin
 from app.library import library_router
+from app.jobs import jobs_router, job_runner
+from app.borrowing import borrowing_router
+from app.branches import branches_router
+from app.analytics import analytics_router
+from app.reconciliation import inventory_router
+from app.metrics import metrics_router
+from app.profiling import install_profiling, profiling_router
+from app.events import invalidation_bus
+from app.similarity import similarity_refresher
+from app.snapshot import catalog_snapshot
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
-app = FastAPI(title="Library Catalog API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Фоновые задачи и слушатель инвалидации работают в том же процессе, что и приложение
+    invalidation_bus.start()
+    await job_runner.start()
+    similarity_refresher.start()
+    # Снимок каталога загружается до первого запроса
+    with SessionLocal() as db:
+        catalog_snapshot.preload(db)
+    yield
+    similarity_refresher.stop()
+    await job_runner.stop()
+    invalidation_bus.stop()
+
+
+app = FastAPI(title="Library Catalog API", lifespan=lifespan)
 
 # Создаем таблицы при запуске приложения
 create_db()
@@ -18,6 +46,16 @@ create_db()
 # Подключаем роутеры
 app.include_router(auth_router)
 app.include_router(library_router)
+app.include_router(jobs_router, dependencies=[Depends(get_current_admin)])
+app.include_router(borrowing_router)
+app.include_router(branches_router)
+app.include_router(analytics_router)
+app.include_router(inventory_router, dependencies=[Depends(get_current_admin)])
+app.include_router(metrics_router)
+app.include_router(profiling_router, dependencies=[Depends(get_current_admin)])
+
+# Профилирование отдельных запросов по запросу администратора (заголовок X-Profile)
+install_profiling(app)
 
 
 @app.get("/")
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+
+from app.auth import get_current_admin
+from app.models import User
+from app.profiling import ProfiledRoute
+from app.singleflight import single_flight_stats
+from app.snapshot import catalog_snapshot
+
+metrics_router = APIRouter(prefix="/metrics", tags=["Metrics"], route_class=ProfiledRoute)
+
+
+@metrics_router.get("/coalescing", response_model=dict)
+def get_coalescing_metrics(current_user: User = Depends(get_current_admin)):
+    """
+    Статистика объединения одинаковых одновременных запросов (в пределах воркера).
+    """
+    return single_flight_stats()
+
+
+@metrics_router.get("/catalog-snapshot", response_model=dict)
+def get_catalog_snapshot_metrics(current_user: User = Depends(get_current_admin)):
+    """
+    Размер снимка каталога в памяти этого воркера (в байтах по столбцам).
+    """
+    return catalog_snapshot.footprint()
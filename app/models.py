@@ -1,8 +1,14 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey, Boolean
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Text, Date, DateTime, Float, ForeignKey, Boolean, JSON, Index, LargeBinary, DDL, CheckConstraint, event, func, text
 from sqlalchemy.orm import relationship
 from app.database import Base  # Импортируем Base из database.py
 
+# Временный номер изменения до коммита (номер транзакции со знаком минус).
+# Настоящий номер выдаётся при коммите из CatalogChangeCounter (см. app/changefeed.py)
+PENDING_CHANGE_SEQ = text("(-txid_current())")
+
 
 # Модель для авторов
 class Author(Base):
@@ -27,6 +33,9 @@ class Book(Base):
     author_id = Column(Integer, ForeignKey('authors.id'), nullable=False)
     genre = Column(String, nullable=True)
     available_copies = Column(Integer, default=1)
+    # Всего экземпляров (доступные + выданные), задаётся явно; по нему сверяется available_copies
+    # (app/reconciliation.py). NULL — значение неизвестно, книга не сверяется
+    total_copies = Column(Integer, nullable=True)
 
     author = relationship("Author", back_populates="books")
 
@@ -44,17 +53,60 @@ class Reader(Base):
 
 # Модель для записей о взятых книгах
 class BorrowedBook(Base):
+    """
+    Выдача читателю: книги (book_id, общий счётчик Book.available_copies) или
+    экземпляра элемента библиотеки из фонда филиала (branch_id и item_id,
+    счётчик BranchInventory этого филиала, см. app/branches.py).
+    """
     __tablename__ = 'borrowed_books'
 
     id = Column(Integer, primary_key=True, index=True)
     reader_id = Column(Integer, ForeignKey('readers.id'), nullable=False)
-    book_id = Column(Integer, ForeignKey('books.id'), nullable=False)
+    book_id = Column(Integer, ForeignKey('books.id'), nullable=True)
+    branch_id = Column(Integer, ForeignKey('branches.id'), nullable=True)
+    # NULL после удаления элемента: история выдач филиала сохраняется
+    item_id = Column(Integer, ForeignKey('library_items.id', ondelete='SET NULL'), nullable=True)
     borrow_date = Column(Date, nullable=False)
     return_date = Column(Date, nullable=True)
 
     reader = relationship("Reader", back_populates="borrowed_books")
     book = relationship("Book")
 
+    __table_args__ = (
+        # Частичный индекс по открытым выдачам для отчёта о просрочках
+        Index("ix_borrowed_books_open_borrow_date", "borrow_date",
+              postgresql_where=text("return_date IS NULL")),
+        # Открытые выдачи по книгам для сверки доступных экземпляров
+        Index("ix_borrowed_books_open_book_id", "book_id",
+              postgresql_where=text("return_date IS NULL")),
+        Index("ix_borrowed_books_item_id", "item_id"),
+        # Либо выдача книги, либо выдача в филиале
+        CheckConstraint("book_id IS NULL OR (branch_id IS NULL AND item_id IS NULL)",
+                        name="ck_borrowed_books_book_or_branch"),
+        CheckConstraint("book_id IS NOT NULL OR branch_id IS NOT NULL",
+                        name="ck_borrowed_books_has_source"),
+    )
+
+
+# Дневные агрегаты выдач по книгам
+class BorrowDailyStat(Base):
+    __tablename__ = 'borrow_daily_stats'
+
+    day = Column(Date, primary_key=True)
+    book_id = Column(Integer, ForeignKey('books.id'), primary_key=True)
+    borrow_count = Column(Integer, nullable=False, default=0)
+    return_count = Column(Integer, nullable=False, default=0)
+
+
+# Дневные агрегаты выдач по читателям
+class ReaderDailyStat(Base):
+    __tablename__ = 'reader_daily_stats'
+
+    day = Column(Date, primary_key=True)
+    reader_id = Column(Integer, ForeignKey('readers.id'), primary_key=True)
+    borrow_count = Column(Integer, nullable=False, default=0)
+    return_count = Column(Integer, nullable=False, default=0)
+
 
 # Модель для элементов библиотеки
 class LibraryItem(Base):
@@ -70,6 +122,108 @@ class LibraryItem(Base):
     published_year = Column(Integer, nullable=False)
     description = Column(Text, nullable=True)
     available_copies = Column(Integer, nullable=False, default=1)
+    change_seq = Column(BigInteger, nullable=False, index=True, server_default=PENDING_CHANGE_SEQ)
+    # Версия для оптимистичной блокировки (ETag / If-Match)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # MinHash-сигнатура нормализованных названия и автора (см. app/dedup.py)
+    minhash = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        # Индексы под допустимые сортировки списка (см. app/sorting.py)
+        Index("ix_library_items_title_id", title, id),
+        Index("ix_library_items_year_title_id", published_year, title, id),
+        Index("ix_library_items_year_desc_title_id", published_year.desc(), title, id),
+        Index("ix_library_items_copies_title_id", available_copies, title, id),
+        Index("ix_library_items_copies_desc_title_id", available_copies.desc(), title, id),
+    )
+
+
+# Модель для LSH-корзин MinHash-сигнатур элементов библиотеки
+class LibraryItemLshBand(Base):
+    """
+    Хеш одной полосы MinHash-сигнатуры. Элементы с совпадающей полосой —
+    кандидаты в дубликаты.
+    """
+    __tablename__ = 'library_item_lsh_bands'
+
+    band = Column(SmallInteger, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    item_id = Column(Integer, ForeignKey("library_items.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+
+# Модель для филиалов библиотеки
+class Branch(Base):
+    __tablename__ = 'branches'
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Модель для экземпляров элемента библиотеки в филиале
+class BranchInventory(Base):
+    """
+    Экземпляры элемента библиотеки в одном филиале. На PostgreSQL таблица
+    секционирована по branch_id (LIST), секция создаётся вместе с филиалом
+    (см. app/branches.py), поэтому выдачи в разных филиалах не пересекаются
+    ни по строкам, ни по секциям.
+    """
+    __tablename__ = 'branch_inventory'
+
+    branch_id = Column(Integer, ForeignKey("branches.id", ondelete="CASCADE"), primary_key=True)
+    item_id = Column(Integer, ForeignKey("library_items.id", ondelete="CASCADE"), primary_key=True, index=True)
+    total_copies = Column(Integer, nullable=False, default=0)
+    available_copies = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        {"postgresql_partition_by": "LIST (branch_id)"},
+    )
+
+
+# Модель для журнала изменений доступных экземпляров в филиалах
+class InventoryDelta(Base):
+    """
+    Изменение числа доступных экземпляров в филиале, ещё не учтённое в
+    LibraryItem.available_copies. Журнал только дополняется; задача
+    fold_inventory_deltas сворачивает его в общие счётчики.
+    """
+    __tablename__ = 'inventory_deltas'
+
+    id = Column(BigInteger, primary_key=True)
+    item_id = Column(Integer, ForeignKey("library_items.id", ondelete="CASCADE"), nullable=False)
+    branch_id = Column(Integer, nullable=False)
+    available_delta = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Модель для записей об удалённых элементах библиотеки
+class LibraryItemTombstone(Base):
+    """
+    Запись об удалении элемента библиотеки для ленты изменений.
+    """
+    __tablename__ = 'library_item_tombstones'
+
+    item_id = Column(Integer, primary_key=True)
+    change_seq = Column(BigInteger, nullable=False, index=True, server_default=PENDING_CHANGE_SEQ)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+# Счётчик номеров ленты изменений каталога
+class CatalogChangeCounter(Base):
+    """
+    Одна строка с последним выданным номером изменения. Номера выдаются при
+    коммите под блокировкой этой строки, поэтому их порядок совпадает с порядком коммитов.
+    """
+    __tablename__ = 'catalog_change_counter'
+
+    id = Column(SmallInteger, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+event.listen(
+    CatalogChangeCounter.__table__, "after_create",
+    DDL("INSERT INTO catalog_change_counter (id, value) VALUES (1, 0)"),
+)
 
 
 # Модель для пользователей
@@ -82,3 +236,65 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     role = Column(String, default="user")
     is_admin = Column(Boolean, default=False)
+
+
+# Модель для refresh-токенов
+class RefreshToken(Base):
+    """
+    Refresh-токен хранится только в виде SHA-256 хеша.
+    Токены одной цепочки ротаций объединены общим family_id.
+    """
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    family_id = Column(String(32), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Модель для фоновых задач
+class Job(Base):
+    """
+    Фоновая задача, выполняемая JobRunner'ом вне обработчиков запросов.
+    """
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued", index=True)
+    params = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    run_after = Column(DateTime, nullable=True)  # Для отложенного повтора после ошибки
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class ProfileReport(Base):
+    """
+    Профиль одного запроса (см. app/profiling.py).
+    """
+    __tablename__ = "profile_reports"
+
+    id = Column(String(32), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    method = Column(String(10), nullable=False)
+    path = Column(String, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    duration_ms = Column(Float, nullable=False)
+    mode = Column(String(20), nullable=False)  # sample или deterministic
+    sampled = Column(Boolean, nullable=False, default=False)  # Выбран непрерывным режимом
+    samples = Column(Integer, nullable=False, default=0)
+    collapsed = Column(Text, nullable=True)  # Стеки в формате flamegraph (collapsed)
+    sql = Column(JSON, nullable=True)
+    stats = Column(Text, nullable=True)  # Отчёт cProfile для режима deterministic
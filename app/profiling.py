@@ -0,0 +1,442 @@
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from urllib.parse import parse_qs
+
+import anyio
+from decouple import config
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import is_async_gen_callable, is_coroutine_callable, is_gen_callable
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, engine, get_db
+from app.models import ProfileReport
+from app.schemas import ProfileReportRead, ProfileReportSummary
+
+logger = logging.getLogger(__name__)
+
+# Доля запросов, профилируемых в непрерывном режиме (0 — выключен)
+PROFILE_SAMPLE_RATE = config("PROFILE_SAMPLE_RATE", cast=float, default=0.0)
+PROFILE_SAMPLE_INTERVAL_MS = config("PROFILE_SAMPLE_INTERVAL_MS", cast=float, default=1.0)
+PROFILE_RETENTION_DAYS = config("PROFILE_RETENTION_DAYS", cast=int, default=7)
+PROFILE_MAX_SQL_STATEMENTS = 1000
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_PARAM = "profile"
+MODE_SAMPLE = "sample"
+MODE_DETERMINISTIC = "deterministic"
+
+_active_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("active_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Профиль одного запроса: стеки потоков, выполняющих его код, и SQL-запросы с временем.
+    """
+
+    def __init__(self, mode: str, method: str, path: str, sampled: bool = False):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.threads: Set[int] = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.sql: List[dict] = []
+        self.stats: Optional[pstats.Stats] = None
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        """
+        Выполняет синхронную часть запроса в потоке пула, делая поток видимым сэмплеру.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.threads.add(thread_id)
+        profiler = cProfile.Profile() if self.mode == MODE_DETERMINISTIC else None
+        try:
+            if profiler is None:
+                return func(*args, **kwargs)
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.threads.discard(thread_id)
+                if profiler is not None:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+
+    def record_sql(self, statement: str, duration_ms: float, executemany: bool) -> None:
+        with self._lock:
+            if len(self.sql) < PROFILE_MAX_SQL_STATEMENTS:
+                self.sql.append({
+                    "statement": statement[:2000],
+                    "duration_ms": round(duration_ms, 3),
+                    "executemany": executemany,
+                })
+
+    def sample(self, frames: dict) -> None:
+        with self._lock:
+            threads = list(self.threads)
+        for thread_id in threads:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+                self.samples += 1
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def stats_text(self, limit: int = 50) -> Optional[str]:
+        if self.stats is None:
+            return None
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+def _collapse(frame) -> str:
+    # Стек от корня к листу; кадры ниже RequestProfile.run относятся к пулу потоков,
+    # а Profile.runcall (режим deterministic) — к самому профилировщику
+    names = []
+    while frame is not None and frame.f_code is not RequestProfile.run.__code__:
+        if frame.f_code is not cProfile.Profile.runcall.__code__:
+            names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler:
+    """
+    Фоновый поток, снимающий стеки активных профилей. Работает, только пока
+    есть хотя бы один профилируемый запрос.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: Set[RequestProfile] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval)
+
+
+_sampler = _Sampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+
+# ======================================================================
+# Подключение к FastAPI и SQLAlchemy
+# ======================================================================
+
+def _profiled(endpoint):
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        return profile.run(endpoint, *args, **kwargs)
+    return run
+
+
+class _ProfiledDependency:
+    """
+    Синхронная зависимость маршрута, выполняемая через RequestProfile.run.
+    Сравнивается и хешируется как исходная функция, поэтому
+    app.dependency_overrides по-прежнему находит её.
+    """
+
+    def __init__(self, call):
+        functools.update_wrapper(self, call)
+
+    def __call__(self, *args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return self.__wrapped__(*args, **kwargs)
+        return profile.run(self.__wrapped__, *args, **kwargs)
+
+    def __eq__(self, other):
+        return self.__wrapped__ == getattr(other, "__wrapped__", other)
+
+    def __hash__(self):
+        return hash(self.__wrapped__)
+
+
+class _ProfiledGeneratorDependency(_ProfiledDependency):
+    """
+    Зависимость-генератор (например, get_db): FastAPI продвигает её отдельными
+    вызовами в пуле потоков, поэтому через RequestProfile.run выполняется каждый шаг.
+    """
+
+    def __call__(self, *args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return (yield from self.__wrapped__(*args, **kwargs))
+        gen = profile.run(self.__wrapped__, *args, **kwargs)
+        step, value = gen.send, None
+        while True:
+            try:
+                value = profile.run(step, value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, step = (yield value), gen.send
+            except GeneratorExit:
+                gen.close()
+                raise
+            except BaseException as exc:
+                value, step = exc, gen.throw
+
+
+def _profile_dependencies(dependant: Dependant) -> None:
+    for sub_dependant in dependant.dependencies:
+        call = sub_dependant.call
+        if not isinstance(call, _ProfiledDependency) and not is_coroutine_callable(call) \
+                and not is_async_gen_callable(call):
+            wrapper = _ProfiledGeneratorDependency if is_gen_callable(call) else _ProfiledDependency
+            sub_dependant.call = wrapper(call)
+        _profile_dependencies(sub_dependant)
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Маршрут, синхронные обработчик и зависимости которого помечают свой поток пула
+    для сэмплера, пока профилируется текущий запрос. Контекст запроса
+    (и _active_profile) передаётся в поток пула вместе с вызовом.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+        # Сигнатуры уже разобраны, заменяются только вызываемые объекты
+        _profile_dependencies(self.dependant)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profile.get() is not None:
+        conn.info.setdefault("profile_query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active_profile.get()
+    started = conn.info.get("profile_query_started")
+    if profile is not None and started:
+        profile.record_sql(statement, (time.perf_counter() - started.pop()) * 1000, executemany)
+
+
+def _requested_mode(scope) -> Optional[str]:
+    value = None
+    for name, header in scope["headers"]:
+        if name == PROFILE_HEADER.encode():
+            value = header.decode()
+    if value is None and PROFILE_QUERY_PARAM.encode() in scope.get("query_string", b""):
+        values = parse_qs(scope["query_string"].decode(), keep_blank_values=True).get(PROFILE_QUERY_PARAM)
+        value = values[0] if values else None
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return MODE_SAMPLE if value in ("", "1", "true") else value
+
+
+def _is_admin(scope) -> bool:
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode()
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    # Импорт здесь: app.auth сам подключает ProfiledRoute из этого модуля
+    from app.auth import get_current_user
+
+    db = SessionLocal()
+    try:
+        return get_current_user(token, db).role == "admin"
+    except HTTPException:
+        return False
+    finally:
+        db.close()
+
+
+def _store_report(profile: RequestProfile, status_code: Optional[int]) -> None:
+    db = SessionLocal()
+    try:
+        db.add(ProfileReport(
+            id=profile.id,
+            method=profile.method,
+            path=profile.path,
+            status_code=status_code,
+            duration_ms=round(profile.duration_ms, 3),
+            mode=profile.mode,
+            sampled=profile.sampled,
+            samples=profile.samples,
+            collapsed=profile.collapsed(),
+            sql=profile.sql,
+            stats=profile.stats_text(),
+        ))
+        db.commit()
+    except Exception:
+        logger.exception("Не удалось сохранить профиль запроса %s", profile.id)
+    finally:
+        db.close()
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует запрос с заголовком X-Profile (или параметром ?profile=) от администратора,
+    а также случайную долю PROFILE_SAMPLE_RATE всех запросов. Значение — режим:
+    sample (по умолчанию, сэмплирование стеков) или deterministic (дополнительно cProfile).
+    Идентификатор сохранённого профиля возвращается в заголовке X-Profile-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        mode = _requested_mode(scope)
+        sampled = False
+        if mode is None:
+            if not PROFILE_SAMPLE_RATE or random.random() >= PROFILE_SAMPLE_RATE:
+                return await self.app(scope, receive, send)
+            mode, sampled = MODE_SAMPLE, True
+        elif mode not in (MODE_SAMPLE, MODE_DETERMINISTIC):
+            response = JSONResponse({"detail": f"Unknown profile mode: {mode}"}, status_code=400)
+            return await response(scope, receive, send)
+        elif not await anyio.to_thread.run_sync(_is_admin, scope):
+            response = JSONResponse({"detail": "Profiling is available to admins only"}, status_code=403)
+            return await response(scope, receive, send)
+
+        profile = RequestProfile(mode, scope["method"], scope["path"], sampled)
+        status = {}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if not sampled:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        token = _active_profile.set(profile)
+        _sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _sampler.remove(profile)
+            _active_profile.reset(token)
+            profile.finish()
+            await anyio.to_thread.run_sync(_store_report, profile, status.get("code"))
+
+
+def install_profiling(app: FastAPI) -> None:
+    """
+    Подключает профилирование. Стеки снимаются с потоков синхронных обработчиков
+    маршрутов ProfiledRoute (route_class роутеров приложения); SQL-запросы
+    учитываются для всего запроса.
+    """
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(ProfilingMiddleware)
+    # Импорт здесь: app.jobs сам подключает ProfiledRoute из этого модуля
+    from app.jobs import job_handler, schedule_periodic_job
+
+    job_handler("purge_profile_reports")(purge_profile_reports_job)
+    schedule_periodic_job("purge_profile_reports", interval_seconds=24 * 60 * 60)
+
+
+def purge_profile_reports_job(ctx, params: dict) -> dict:
+    """
+    Удаляет профили старше PROFILE_RETENTION_DAYS порциями, каждая порция — отдельной транзакцией.
+    """
+    batch_size = params.get("batch_size", 1000)
+    cutoff = datetime.utcnow() - timedelta(days=PROFILE_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        batch = (
+            ctx.db.query(ProfileReport.id)
+            .filter(ProfileReport.created_at < cutoff)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        count = ctx.db.query(ProfileReport).filter(ProfileReport.id.in_(batch)).delete(synchronize_session=False)
+        deleted += count
+        ctx.report_progress(deleted)
+        if count < batch_size:
+            return {"deleted": deleted}
+
+
+# ======================================================================
+# Просмотр сохранённых профилей
+# ======================================================================
+
+profiling_router = APIRouter(prefix="/profiles", tags=["Profiling"], route_class=ProfiledRoute)
+
+
+@profiling_router.get("/", response_model=List[ProfileReportSummary])
+def list_profiles(limit: int = 50, db: Session = Depends(get_db)):
+    return db.query(ProfileReport).order_by(ProfileReport.created_at.desc()).limit(min(limit, 500)).all()
+
+
+def _get_report(db: Session, profile_id: str) -> ProfileReport:
+    report = db.get(ProfileReport, profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return report
+
+
+@profiling_router.get("/{profile_id}", response_model=ProfileReportRead)
+def get_profile(profile_id: str, db: Session = Depends(get_db)):
+    return _get_report(db, profile_id)
+
+
+@profiling_router.get("/{profile_id}/collapsed", response_class=PlainTextResponse)
+def get_profile_collapsed(profile_id: str, db: Session = Depends(get_db)):
+    """
+    Стеки в формате collapsed (flamegraph.pl, speedscope, inferno).
+    """
+    return _get_report(db, profile_id).collapsed or ""
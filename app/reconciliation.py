@@ -0,0 +1,301 @@
+import argparse
+import csv
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from decouple import config
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import Integer, cast, column, func, select, update, values
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, get_db
+from app.jobs import JobContext, LocalJobContext, job_handler, schedule_periodic_job
+from app.models import Book, BorrowedBook
+from app.profiling import ProfiledRoute
+from app.schemas import BookCopiesRead, BookCopiesUpdate
+
+logger = logging.getLogger(__name__)
+
+# Число книг, сверяемых одной короткой транзакцией
+RECONCILE_CHUNK_SIZE = config("RECONCILE_CHUNK_SIZE", cast=int, default=5000)
+RECONCILE_INTERVAL_SECONDS = config("RECONCILE_INTERVAL_SECONDS", cast=int, default=6 * 60 * 60)
+# Сколько идентификаторов книг с расхождением попадает в отчёт
+RECONCILE_SAMPLE_SIZE = 20
+
+# Доступ только для администраторов задаётся при подключении роутера в main.py
+inventory_router = APIRouter(prefix="/inventory", tags=["Inventory"], route_class=ProfiledRoute)
+
+
+def _new_stats() -> dict:
+    return {
+        "scanned": 0,
+        "drifted": 0,  # available_copies не совпадает с total_copies - открытые выдачи
+        "corrected": 0,
+        "skipped_concurrent": 0,  # Строка изменилась между чтением и исправлением
+        "unknown_total": 0,  # total_copies не задан: сверять не с чем, строка пропущена
+        "over_loaned": 0,  # Открытых выдач больше, чем экземпляров
+        "total_abs_drift": 0,
+        "max_abs_drift": 0,
+        "drifted_ids": [],
+        "unknown_total_ids": [],
+        "last_id": 0,
+    }
+
+
+def plan_corrections(rows: list, stats: dict) -> List[Tuple[int, Optional[int], int]]:
+    """
+    Сравнивает строки (id, available_copies, total_copies, on_loan) с ожидаемым
+    значением total_copies - on_loan и возвращает исправления (id, прочитанное, ожидаемое).
+    total_copies задаётся только явно (PUT /inventory/books/{book_id} или массово —
+    set_book_totals): вычислять его по текущим счётчикам нельзя, иначе накопленное
+    расхождение стало бы нормой.
+    """
+    corrections = []
+    for row in rows:
+        if row.total_copies is None:
+            stats["unknown_total"] += 1
+            if len(stats["unknown_total_ids"]) < RECONCILE_SAMPLE_SIZE:
+                stats["unknown_total_ids"].append(row.id)
+            continue
+        expected = row.total_copies - row.on_loan
+        if expected < 0:
+            stats["over_loaned"] += 1
+            expected = 0
+        drift = (row.available_copies or 0) - expected
+        # Незаданный available_copies исправляется, даже если ожидается 0
+        if not drift and row.available_copies is not None:
+            continue
+        stats["drifted"] += 1
+        stats["total_abs_drift"] += abs(drift)
+        stats["max_abs_drift"] = max(stats["max_abs_drift"], abs(drift))
+        if len(stats["drifted_ids"]) < RECONCILE_SAMPLE_SIZE:
+            stats["drifted_ids"].append(row.id)
+        corrections.append((row.id, row.available_copies, expected))
+    return corrections
+
+
+def reconcile_chunk(db: Session, after_id: int, stats: dict,
+                    chunk_size: int = RECONCILE_CHUNK_SIZE, dry_run: bool = False) -> Optional[int]:
+    """
+    Сверяет следующую порцию книг (id > after_id) с открытыми выдачами.
+    Ожидаемое значение считается одним запросом (порция книг + агрегат открытых выдач
+    по её диапазону id), исправления применяются одним UPDATE ... FROM (VALUES ...).
+    Исправление применяется, только если available_copies не изменился с момента
+    чтения, поэтому выдачи не блокируются и не теряются: такие строки сверятся
+    при следующем запуске. Возвращает последний id порции или None, если книги кончились.
+    """
+    chunk = (
+        select(Book.id, Book.available_copies, Book.total_copies)
+        .where(Book.id > after_id)
+        .order_by(Book.id)
+        .limit(chunk_size)
+        .cte("chunk")
+    )
+    open_loans = (
+        select(BorrowedBook.book_id, func.count().label("on_loan"))
+        .where(
+            BorrowedBook.return_date.is_(None),
+            BorrowedBook.book_id > after_id,
+            BorrowedBook.book_id <= select(func.max(chunk.c.id)).scalar_subquery(),
+        )
+        .group_by(BorrowedBook.book_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(chunk.c.id, chunk.c.available_copies, chunk.c.total_copies,
+               func.coalesce(open_loans.c.on_loan, 0).label("on_loan"))
+        .outerjoin(open_loans, open_loans.c.book_id == chunk.c.id)
+        .order_by(chunk.c.id)
+    ).all()
+    if not rows:
+        return None
+
+    corrections = plan_corrections(rows, stats)
+    stats["scanned"] += len(rows)
+    stats["last_id"] = rows[-1].id
+
+    if corrections and not dry_run:
+        fixes = values(
+            column("id", Integer), column("observed", Integer), column("expected", Integer),
+            name="fixes",
+        ).data(corrections)
+        updated = db.execute(
+            update(Book)
+            .where(
+                # Тип столбцов VALUES выводится из данных: в порции из одних NULL он был бы text
+                Book.id == cast(fixes.c.id, Integer),
+                # NULL-безопасное сравнение: available_copies может быть не задан
+                Book.available_copies.is_not_distinct_from(cast(fixes.c.observed, Integer)),
+            )
+            .values(available_copies=cast(fixes.c.expected, Integer))
+            .returning(Book.id),
+            execution_options={"synchronize_session": False},
+        ).all()
+        stats["corrected"] += len(updated)
+        stats["skipped_concurrent"] += len(corrections) - len(updated)
+    return rows[-1].id
+
+
+def reconcile_inventory(db: Session, chunk_size: int = RECONCILE_CHUNK_SIZE, dry_run: bool = False,
+                        ctx: Optional[JobContext] = None) -> dict:
+    """
+    Сверяет Book.available_copies с открытыми выдачами по всему каталогу,
+    порциями в порядке id, каждая порция — отдельной транзакцией.
+    Задача после повтора продолжает с последнего сверенного id.
+    """
+    stats = _new_stats()
+    ctx = ctx or LocalJobContext(db)
+    after_id = ctx.progress
+    while True:
+        last_id = reconcile_chunk(db, after_id, stats, chunk_size, dry_run)
+        if last_id is None:
+            break
+        after_id = last_id
+        ctx.report_progress(after_id)
+    db.commit()
+    logger.info(
+        "Сверка экземпляров: просмотрено %s, расхождений %s, исправлено %s, пропущено %s, без total_copies %s",
+        stats["scanned"], stats["drifted"], stats["corrected"], stats["skipped_concurrent"], stats["unknown_total"],
+    )
+    return stats
+
+
+@job_handler("reconcile_inventory")
+def reconcile_inventory_job(ctx: JobContext, params: dict) -> dict:
+    return reconcile_inventory(
+        ctx.db, params.get("chunk_size", RECONCILE_CHUNK_SIZE), params.get("dry_run", False), ctx=ctx
+    )
+
+
+schedule_periodic_job("reconcile_inventory", interval_seconds=RECONCILE_INTERVAL_SECONDS)
+
+
+def set_book_totals(db: Session, totals: Dict[int, int], chunk_size: int = RECONCILE_CHUNK_SIZE,
+                    ctx: Optional[JobContext] = None) -> dict:
+    """
+    Массово задаёт total_copies (например, по итогам инвентаризации) и пересчитывает
+    available_copies как total_copies - открытые выдачи, как PUT /inventory/books/{book_id}.
+    Книги обрабатываются порциями в порядке id, каждая порция — отдельной транзакцией:
+    строки порции блокируются до подсчёта выдач, значения записываются одним
+    UPDATE ... FROM (VALUES ...). Книги без строки, с отрицательным total_copies или
+    с числом открытых выдач больше нового total_copies пропускаются и попадают в отчёт.
+    """
+    stats = {"updated": 0, "not_found": 0, "invalid": 0, "over_loaned": 0,
+             "not_found_ids": [], "invalid_ids": [], "over_loaned_ids": []}
+
+    def skip(reason: str, book_id: int) -> None:
+        stats[reason] += 1
+        if len(stats[f"{reason}_ids"]) < RECONCILE_SAMPLE_SIZE:
+            stats[f"{reason}_ids"].append(book_id)
+
+    ctx = ctx or LocalJobContext(db)
+    book_ids = sorted(totals)
+    # После повтора задача продолжает с первой необработанной книги
+    for start in range(ctx.progress, len(book_ids), chunk_size):
+        chunk = book_ids[start:start + chunk_size]
+        # Блокировка в порядке id: одновременные выдачи ждут, взаимных блокировок нет
+        found = set(db.execute(
+            select(Book.id).where(Book.id.in_(chunk)).order_by(Book.id).with_for_update()
+        ).scalars())
+        on_loan = dict(db.execute(
+            select(BorrowedBook.book_id, func.count())
+            .where(BorrowedBook.book_id.in_(chunk), BorrowedBook.return_date.is_(None))
+            .group_by(BorrowedBook.book_id)
+        ).all())
+        rows = []
+        for book_id in chunk:
+            total = totals[book_id]
+            if book_id not in found:
+                skip("not_found", book_id)
+            elif total < 0:
+                skip("invalid", book_id)
+            elif total < on_loan.get(book_id, 0):
+                skip("over_loaned", book_id)
+            else:
+                rows.append((book_id, total, total - on_loan.get(book_id, 0)))
+        if rows:
+            new_values = values(
+                column("id", Integer), column("total", Integer), column("available", Integer),
+                name="new_values",
+            ).data(rows)
+            db.execute(
+                update(Book)
+                .where(Book.id == new_values.c.id)
+                .values(total_copies=new_values.c.total, available_copies=new_values.c.available),
+                execution_options={"synchronize_session": False},
+            )
+            stats["updated"] += len(rows)
+        ctx.report_progress(start + len(chunk), len(book_ids))
+    db.commit()
+    logger.info(
+        "Общее число экземпляров: задано %s, нет книги %s, некорректно %s, выдано больше %s",
+        stats["updated"], stats["not_found"], stats["invalid"], stats["over_loaned"],
+    )
+    return stats
+
+
+def read_totals_csv(path: str) -> Dict[int, int]:
+    """
+    Читает CSV с колонками book_id и total_copies (строка заголовка обязательна).
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        return {int(row["book_id"]): int(row["total_copies"]) for row in csv.DictReader(file)}
+
+
+@job_handler("set_book_totals")
+def set_book_totals_job(ctx: JobContext, params: dict) -> dict:
+    # Ключи объекта JSON — строки
+    totals = {int(book_id): int(total) for book_id, total in params["totals"].items()}
+    return set_book_totals(ctx.db, totals, params.get("chunk_size", RECONCILE_CHUNK_SIZE), ctx=ctx)
+
+
+@inventory_router.put("/books/{book_id}", response_model=BookCopiesRead)
+def set_book_copies(
+        book_id: int,
+        copies: BookCopiesUpdate,
+        db: Session = Depends(get_db)
+):
+    """
+    Задаёт общее число экземпляров книги (например, по итогам инвентаризации)
+    и пересчитывает available_copies как total_copies - открытые выдачи.
+    Строка книги блокируется до подсчёта выдач: выдача и возврат меняют её
+    в той же транзакции, что и выдачу, поэтому подсчёт не устареет.
+    """
+    book = db.query(Book.id).filter(Book.id == book_id).with_for_update().first()
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    on_loan = db.query(func.count(BorrowedBook.id)).filter(
+        BorrowedBook.book_id == book_id, BorrowedBook.return_date.is_(None)
+    ).scalar()
+    if copies.total_copies < on_loan:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="More copies are on loan than the new total")
+    db.query(Book).filter(Book.id == book_id).update(
+        {Book.total_copies: copies.total_copies, Book.available_copies: copies.total_copies - on_loan},
+        synchronize_session=False,
+    )
+    db.commit()
+    return BookCopiesRead(
+        id=book_id, total_copies=copies.total_copies, available_copies=copies.total_copies - on_loan, on_loan=on_loan
+    )
+
+
+if __name__ == "__main__":
+    # python -m app.reconciliation --chunk-size 5000 --dry-run
+    # python -m app.reconciliation --totals-csv inventory.csv
+    parser = argparse.ArgumentParser(description="Сверка доступных экземпляров книг с открытыми выдачами")
+    parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Только отчёт, без исправлений")
+    parser.add_argument("--totals-csv", help="Задать total_copies из CSV (book_id,total_copies) вместо сверки")
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        if args.totals_csv:
+            result = set_book_totals(session, read_totals_csv(args.totals_csv), args.chunk_size)
+        else:
+            result = reconcile_inventory(session, args.chunk_size, args.dry_run)
+        for name, value in result.items():
+            print(f"{name}: {value}")
+    finally:
+        session.close()
@@ -1,5 +1,5 @@
-from datetime import date
-from typing import Optional
+from datetime import date, datetime
+from typing import Any, List, Optional
 from pydantic import BaseModel, EmailStr, Field, field_validator
 
 
@@ -30,9 +30,10 @@ class LibraryItemCreate(LibraryItemBase):
 class LibraryItemRead(LibraryItemBase):
     """
     Схема для чтения (вывода) элемента библиотеки.
-    Добавляется поле идентификатора.
+    Добавляются идентификатор и версия (совпадает с ETag).
     """
     id: int
+    version: int = 1
 
 
 class LibraryItemUpdate(BaseModel):
@@ -55,7 +56,7 @@ class LibraryItemResponse(BaseModel):
     id: int
     title: str
     description: Optional[str]
-    publication_date: Optional[str]
+    publication_date: Optional[str] = None
     author: str
     genre: Optional[str]
     available_copies: int
@@ -65,6 +66,79 @@ class LibraryItemResponse(BaseModel):
         from_attributes = True  # Поддержка SQLAlchemy моделей
 
 
+class LibraryItemFields(BaseModel):
+    """
+    Элемент библиотеки с выборочным набором полей (параметр fields=).
+    Используется для документации: в ответе есть только запрошенные поля.
+    """
+    id: int
+    title: Optional[str] = None
+    author: Optional[str] = None
+    genre: Optional[str] = None
+    published_year: Optional[int] = None
+    description: Optional[str] = None
+    available_copies: Optional[int] = None
+    version: Optional[int] = None
+
+
+class LibraryItemChange(BaseModel):
+    """
+    Одна запись ленты изменений: изменённый или удалённый элемент.
+    """
+    seq: int
+    item_id: int
+    deleted: bool = False
+    item: Optional[LibraryItemRead] = None
+
+
+class LibraryItemChangeFeed(BaseModel):
+    changes: List[LibraryItemChange]
+    next_since: int  # Значение since для следующего запроса
+    has_more: bool
+
+
+class LibraryItemMerge(BaseModel):
+    """
+    Схема для объединения дубликатов с элементом библиотеки.
+    """
+    duplicate_ids: List[int]
+
+
+class SimilarLibraryItem(LibraryItemResponse):
+    score: float  # Косинусная близость описаний (0..1)
+
+
+# ======================================================================
+# Схемы для работы с филиалами
+# ======================================================================
+
+class BranchCreate(BaseModel):
+    name: str = Field(min_length=1)
+
+
+class BranchRead(BaseModel):
+    id: int
+    name: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class BranchInventoryUpdate(BaseModel):
+    total_copies: int = Field(ge=0)
+
+
+class BranchInventoryRead(BaseModel):
+    branch_id: int
+    item_id: int
+    total_copies: int
+    available_copies: int
+
+    class Config:
+        from_attributes = True
+
+
 # ======================================================================
 # Схемы для работы с пользователями
 # ======================================================================
@@ -108,3 +182,131 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+# ======================================================================
+# Схемы для выдачи книг и аналитики
+# ======================================================================
+
+class BorrowCreate(BaseModel):
+    reader_id: int
+    book_id: int
+
+
+class BranchCheckout(BaseModel):
+    reader_id: int
+
+
+class BorrowRead(BaseModel):
+    id: int
+    reader_id: int
+    book_id: Optional[int] = None
+    branch_id: Optional[int] = None
+    item_id: Optional[int] = None
+    borrow_date: date
+    return_date: Optional[date] = None
+
+    class Config:
+        from_attributes = True
+
+
+class BookCopiesUpdate(BaseModel):
+    total_copies: int = Field(ge=0)
+
+
+class BookCopiesRead(BaseModel):
+    id: int
+    total_copies: int
+    available_copies: int
+    on_loan: int
+
+
+class TopBorrowedBook(BaseModel):
+    book_id: int
+    title: str
+    borrow_count: int
+
+
+class OverdueBorrow(BaseModel):
+    id: int
+    reader_id: int
+    reader_name: str
+    book_id: Optional[int] = None
+    branch_id: Optional[int] = None
+    item_id: Optional[int] = None
+    title: Optional[str] = None
+    borrow_date: date
+    days_overdue: int
+
+
+class GenreUtilization(BaseModel):
+    genre: Optional[str] = None
+    borrow_count: int
+    on_loan: int
+    available_copies: int
+    utilization: float  # Доля экземпляров жанра, находящихся на руках
+
+
+class ReaderActivity(BaseModel):
+    reader_id: int
+    name: str
+    borrow_count: int
+    return_count: int
+
+
+# ======================================================================
+# Схемы для работы с фоновыми задачами
+# ======================================================================
+
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = Field(default_factory=dict)
+    max_attempts: int = Field(default=3, ge=1)
+
+
+class JobRead(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: int
+    total: Optional[int] = None
+    attempts: int
+    max_attempts: int
+    cancel_requested: bool
+    error: Optional[str] = None
+    result: Optional[Any] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# ======================================================================
+# Схемы для профилирования запросов
+# ======================================================================
+
+class ProfileReportSummary(BaseModel):
+    id: str
+    created_at: datetime
+    method: str
+    path: str
+    status_code: Optional[int] = None
+    duration_ms: float
+    mode: str
+    sampled: bool
+    samples: int
+
+    class Config:
+        from_attributes = True
+
+
+class ProfileReportRead(ProfileReportSummary):
+    sql: Optional[List[dict]] = None
+    stats: Optional[str] = None
@@ -0,0 +1,568 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from decouple import config
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from app.changefeed import last_change_seq
+from app.database import SessionLocal
+from app.events import CATALOG_VERSION_BUMPED, ITEM_CHANGED, InvalidationEvent, invalidation_bus
+from app.jobs import JobContext, job_handler
+from app.models import LibraryItem, LibraryItemTombstone
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_INDEX_DIR = config("SIMILARITY_INDEX_DIR", default="data/similarity")
+SIMILAR_ITEMS_K = config("SIMILAR_ITEMS_K", cast=int, default=20)
+SIMILARITY_FEATURES = config("SIMILARITY_FEATURES", cast=int, default=2 ** 18)
+# Термы, встречающиеся чаще чем в этой доле документов, не учитываются
+SIMILARITY_MAX_DF = config("SIMILARITY_MAX_DF", cast=float, default=0.5)
+SIMILARITY_BATCH_SIZE = config("SIMILARITY_BATCH_SIZE", cast=int, default=1024)
+SIMILARITY_REFRESH_SECONDS = config("SIMILARITY_REFRESH_SECONDS", cast=int, default=60)
+# После стольких инкрементальных изменений индекс перестраивается целиком
+SIMILARITY_MAX_DELTA = config("SIMILARITY_MAX_DELTA", cast=int, default=10000)
+
+_TOKEN_RE = re.compile(r"\w{2,}")
+_READ_CHUNK_SIZE = 10000
+
+
+# ======================================================================
+# Векторизация: хешированный TF-IDF
+# ======================================================================
+
+def _item_text(title: str, genre: Optional[str], description: Optional[str]) -> str:
+    # Название повторяется, чтобы весить больше описания
+    return " ".join(filter(None, [title, title, genre, description]))
+
+
+class _FeatureHasher:
+    def __init__(self, n_features: int):
+        self.n_features = n_features
+        self._cache: Dict[str, int] = {}
+
+    def __call__(self, token: str) -> int:
+        feature = self._cache.get(token)
+        if feature is None:
+            feature = zlib.crc32(token.encode()) % self.n_features
+            if len(self._cache) < 1_000_000:
+                self._cache[token] = feature
+        return feature
+
+
+def _term_frequencies(texts: List[str], hasher: _FeatureHasher) -> sparse.csr_matrix:
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        features = [hasher(token) for token in _TOKEN_RE.findall(text.lower())]
+        rows.extend([row] * len(features))
+        cols.extend(features)
+    tf = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.float32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+        shape=(len(texts), hasher.n_features),
+    )
+    tf.sum_duplicates()
+    tf.data = 1 + np.log(tf.data)
+    return tf
+
+
+def _tfidf(tf: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    """
+    Взвешивает частоты по IDF и нормирует строки, чтобы скалярное
+    произведение строк было косинусной близостью.
+    """
+    weighted = tf.multiply(idf[np.newaxis, :]).tocsr()
+    weighted.eliminate_zeros()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(weighted).tocsr().astype(np.float32)
+
+
+def _batch_top_k(sims: sparse.csr_matrix, self_positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Для каждой строки пакета сходств выбирает k лучших позиций без циклов по строкам.
+    """
+    batch = sims.shape[0]
+    rows = np.repeat(np.arange(batch), np.diff(sims.indptr))
+    keep = (sims.indices != self_positions[rows]) & (sims.data > 0)
+    rows, cols, data = rows[keep], sims.indices[keep], sims.data[keep]
+    order = np.lexsort((-data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, np.arange(batch))[rows]
+    top = rank < k
+    positions = np.full((batch, k), -1, dtype=np.int64)
+    scores = np.zeros((batch, k), dtype=np.float32)
+    positions[rows[top], rank[top]] = cols[top]
+    scores[rows[top], rank[top]] = data[top]
+    return positions, scores
+
+
+# ======================================================================
+# Хранение индекса в memory-mapped файлах
+# ======================================================================
+
+def _current_path() -> Optional[str]:
+    link = os.path.join(SIMILARITY_INDEX_DIR, "current")
+    return os.path.realpath(link) if os.path.exists(link) else None
+
+
+@contextmanager
+def _index_lock(blocking: bool = True):
+    """
+    Межпроцессная блокировка каталога индекса (один индекс на хост).
+    """
+    os.makedirs(SIMILARITY_INDEX_DIR, exist_ok=True)
+    with open(os.path.join(SIMILARITY_INDEX_DIR, ".lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_meta(path: str, meta: dict) -> None:
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+def _new_generation_path() -> str:
+    path = os.path.join(SIMILARITY_INDEX_DIR, f"index-{time.time_ns()}")
+    os.makedirs(path)
+    return path
+
+
+def _switch_current(path: str) -> None:
+    """
+    Делает поколение индекса текущим: ссылка current подменяется через os.replace,
+    поэтому читатели видят либо прежнее поколение, либо новое целиком.
+    Прежнее поколение удаляется; уже открытые memmap'ы остаются валидными.
+    """
+    previous = _current_path()
+    link = os.path.join(SIMILARITY_INDEX_DIR, "current")
+    tmp_link = link + ".tmp"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(path), tmp_link)
+    os.replace(tmp_link, link)
+    if previous and previous != path:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+class SimilarityIndex:
+    """
+    Списки соседей в memory-mapped массивах: ids (отсортированные id элементов),
+    neighbors (id соседей) и scores (косинусная близость). Страницы файлов общие
+    для всех воркеров хоста.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        mode = "r+" if writable else "r"
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mode)
+        self.neighbors = np.load(os.path.join(path, "neighbors.npy"), mmap_mode=mode)
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode=mode)
+
+    @property
+    def count(self) -> int:
+        return self.meta["count"]
+
+    def position(self, item_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.ids[:self.count], item_id))
+        if pos < self.count and self.ids[pos] == item_id:
+            return pos
+        return None
+
+    def similar(self, item_id: int, limit: int) -> List[Tuple[int, float]]:
+        pos = self.position(item_id)
+        if pos is None:
+            return []
+        neighbors = self.neighbors[pos, :limit]
+        scores = self.scores[pos, :limit]
+        return [(int(n), float(s)) for n, s in zip(neighbors, scores) if n >= 0]
+
+    def flush(self) -> None:
+        for array in (self.ids, self.neighbors, self.scores):
+            array.flush()
+
+
+_reader: Optional[SimilarityIndex] = None
+_reader_path: Optional[str] = None
+_reader_checked_at = 0.0
+_reader_lock = threading.Lock()
+
+
+def get_similarity_index() -> Optional[SimilarityIndex]:
+    """
+    Возвращает индекс для чтения; не чаще раза в секунду проверяет, не сменилось ли
+    текущее поколение (пока индекса нет — при каждом вызове).
+    """
+    global _reader, _reader_path, _reader_checked_at
+    with _reader_lock:
+        now = time.monotonic()
+        if _reader is None or now - _reader_checked_at >= 1.0:
+            _reader_checked_at = now
+            path = _current_path()
+            if path != _reader_path:
+                try:
+                    _reader = SimilarityIndex(path) if path else None
+                    _reader_path = path
+                except FileNotFoundError:
+                    # Поколение заменено и удалено между чтением ссылки и открытием файлов:
+                    # остаётся прежний индекс, новое поколение откроется при следующем вызове
+                    _reader_checked_at = 0.0
+        return _reader
+
+
+# ======================================================================
+# Полное построение
+# ======================================================================
+
+def _iter_item_rows(db: Session):
+    last_id = 0
+    while True:
+        rows = (
+            db.query(LibraryItem.id, LibraryItem.title, LibraryItem.genre, LibraryItem.description)
+            .filter(LibraryItem.id > last_id)
+            .order_by(LibraryItem.id)
+            .limit(_READ_CHUNK_SIZE)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def build_similarity_index(db: Session, ctx: Optional[JobContext] = None) -> dict:
+    """
+    Строит индекс с нуля в новом каталоге и атомарно подменяет им текущий.
+    Вызывается под блокировкой _index_lock.
+    """
+    # Номер фиксируется до чтения: изменения после него подхватит инкрементальное обновление
+    change_seq = last_change_seq(db)
+    hasher = _FeatureHasher(SIMILARITY_FEATURES)
+    ids, chunks = [], []
+    for rows in _iter_item_rows(db):
+        ids.extend(row.id for row in rows)
+        chunks.append(_term_frequencies([_item_text(row.title, row.genre, row.description) for row in rows], hasher))
+    count = len(ids)
+    tf = sparse.vstack(chunks).tocsr() if chunks else sparse.csr_matrix((0, SIMILARITY_FEATURES), dtype=np.float32)
+
+    df = np.bincount(tf.indices, minlength=SIMILARITY_FEATURES)
+    idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+    idf[df > max(1, SIMILARITY_MAX_DF * count)] = 0
+    matrix = _tfidf(tf, idf)
+
+    previous = _current_path()
+    generation = 0
+    if previous:
+        with open(os.path.join(previous, "meta.json")) as f:
+            generation = json.load(f).get("generation", 0)
+    path = _new_generation_path()
+    capacity = max(int(count * 1.25), count + 1000)
+    k = SIMILAR_ITEMS_K
+    item_ids = np.lib.format.open_memmap(os.path.join(path, "ids.npy"), mode="w+", dtype=np.int32, shape=(capacity,))
+    neighbors = np.lib.format.open_memmap(os.path.join(path, "neighbors.npy"), mode="w+", dtype=np.int32,
+                                          shape=(capacity, k))
+    scores = np.lib.format.open_memmap(os.path.join(path, "scores.npy"), mode="w+", dtype=np.float32,
+                                       shape=(capacity, k))
+    item_ids[:count] = ids
+    neighbors[:] = -1
+
+    ids_array = np.asarray(ids, dtype=np.int32)
+    transposed = matrix.T.tocsr()
+    for start in range(0, count, SIMILARITY_BATCH_SIZE):
+        end = min(start + SIMILARITY_BATCH_SIZE, count)
+        positions, batch_scores = _batch_top_k(matrix[start:end] @ transposed, np.arange(start, end), k)
+        neighbors[start:end] = np.where(positions >= 0, ids_array[np.maximum(positions, 0)], -1)
+        scores[start:end] = batch_scores
+        if ctx:
+            ctx.report_progress(end, total=count)
+
+    for array in (item_ids, neighbors, scores):
+        array.flush()
+    np.save(os.path.join(path, "idf.npy"), idf)
+    np.save(os.path.join(path, "matrix_data.npy"), matrix.data)
+    np.save(os.path.join(path, "matrix_indices.npy"), matrix.indices)
+    np.save(os.path.join(path, "matrix_indptr.npy"), matrix.indptr)
+    _write_meta(path, {"count": count, "base_count": count, "k": k, "change_seq": change_seq, "delta": 0,
+                       "generation": generation + 1})
+    _switch_current(path)
+    logger.info("Индекс похожих элементов построен: %s элементов", count)
+    return {"items": count}
+
+
+# ======================================================================
+# Инкрементальное обновление по ленте изменений
+# ======================================================================
+
+class _IndexUpdater:
+    """
+    Готовит следующее поколение индекса. Списки соседей копируются из текущего
+    поколения в новый каталог и меняются только там; неизменяемые файлы полного
+    построения (idf и матрица) переносятся жёсткими ссылками. Текущее поколение,
+    которое читают воркеры, не меняется никогда.
+    """
+
+    def __init__(self, source: str):
+        self.path = _new_generation_path()
+        for name in ("ids.npy", "neighbors.npy", "scores.npy", "meta.json"):
+            shutil.copyfile(os.path.join(source, name), os.path.join(self.path, name))
+        for name in ("idf.npy", "matrix_data.npy", "matrix_indices.npy", "matrix_indptr.npy"):
+            os.link(os.path.join(source, name), os.path.join(self.path, name))
+        self.index = SimilarityIndex(self.path, writable=True)
+        self.idf = np.load(os.path.join(self.path, "idf.npy"))
+        self.base = sparse.csr_matrix(
+            (np.load(os.path.join(self.path, "matrix_data.npy"), mmap_mode="r"),
+             np.load(os.path.join(self.path, "matrix_indices.npy"), mmap_mode="r"),
+             np.load(os.path.join(self.path, "matrix_indptr.npy"), mmap_mode="r")),
+            shape=(self.index.meta["base_count"], SIMILARITY_FEATURES),
+        )
+        # Строки, изменённые после полного построения: позиция -> вектор
+        self.delta: Dict[int, sparse.csr_matrix] = {}
+        delta_path = os.path.join(source, "delta.npz")
+        if os.path.exists(delta_path):
+            stored = np.load(delta_path)
+            matrix = sparse.csr_matrix((stored["data"], stored["indices"], stored["indptr"]),
+                                       shape=(len(stored["positions"]), SIMILARITY_FEATURES))
+            self.delta = {int(pos): matrix[i] for i, pos in enumerate(stored["positions"])}
+        self.hasher = _FeatureHasher(SIMILARITY_FEATURES)
+
+    def _vector(self, pos: int) -> sparse.csr_matrix:
+        if pos in self.delta:
+            return self.delta[pos]
+        if pos < self.base.shape[0]:
+            return self.base[pos]
+        return sparse.csr_matrix((1, SIMILARITY_FEATURES), dtype=np.float32)
+
+    def _similarities(self, vectors: sparse.csr_matrix) -> sparse.csr_matrix:
+        """
+        Близость векторов ко всем элементам индекса: строка на вектор, столбец на позицию.
+        """
+        count = self.index.count
+        sims = (vectors @ self.base.T).tocsr()
+        sims.resize((vectors.shape[0], count))
+        if self.delta:
+            positions = np.fromiter(self.delta, dtype=np.int64)
+            keep = np.ones(count, dtype=np.float32)
+            keep[positions] = 0
+            delta = (vectors @ sparse.vstack(list(self.delta.values())).T).tocoo()
+            sims = sims @ sparse.diags(keep) + sparse.csr_matrix(
+                (delta.data, (delta.row, positions[delta.col])), shape=sims.shape)
+        return sims.tocsr()
+
+    def _insert_neighbor(self, pos: int, item_id: int, score: float) -> None:
+        index = self.index
+        row_ids, row_scores = index.neighbors[pos], index.scores[pos]
+        keep = (row_ids != item_id) & (row_ids >= 0)
+        row_ids, row_scores = row_ids[keep], row_scores[keep]
+        if len(row_ids) == index.meta["k"] and score <= row_scores[-1]:
+            return
+        at = int(np.searchsorted(-row_scores, -score, side="right"))
+        row_ids = np.insert(row_ids, at, item_id)[:index.meta["k"]]
+        row_scores = np.insert(row_scores, at, score)[:index.meta["k"]]
+        index.neighbors[pos, :len(row_ids)] = row_ids
+        index.scores[pos, :len(row_scores)] = row_scores
+
+    def apply(self, changes: List[Tuple[int, Optional[str]]]) -> bool:
+        """
+        Применяет изменения (id, текст; None — элемент удалён). Списки соседей
+        пересчитываются целиком у изменённых элементов и у всех элементов, в чьих
+        списках они были: прежняя близость к ним устарела. Остальным элементам
+        изменённые добавляются, если проходят в их k лучших.
+        Возвращает False, если нужна полная перестройка.
+        """
+        index = self.index
+        k = index.meta["k"]
+        changed: Dict[int, int] = {}
+        for item_id, text in changes:
+            pos = index.position(item_id)
+            if text is None:
+                if pos is None:
+                    continue
+                vector = sparse.csr_matrix((1, SIMILARITY_FEATURES), dtype=np.float32)
+            else:
+                if pos is None:
+                    # Новые id больше существующих, поэтому добавление в конец сохраняет сортировку
+                    if index.count >= len(index.ids) or (index.count and item_id < index.ids[index.count - 1]):
+                        return False
+                    pos = index.count
+                    index.ids[pos] = item_id
+                    index.meta["count"] += 1
+                vector = _tfidf(_term_frequencies([text], self.hasher), self.idf)
+            self.delta[pos] = vector
+            changed[item_id] = pos
+        if not changed:
+            return True
+
+        count = index.count
+        changed_ids = np.fromiter(changed, dtype=np.int64)
+        changed_positions = np.fromiter(changed.values(), dtype=np.int64)
+        stale = np.isin(index.neighbors[:count], changed_ids).any(axis=1)
+        stale[changed_positions] = True
+        stale_positions = np.flatnonzero(stale)
+        for start in range(0, len(stale_positions), SIMILARITY_BATCH_SIZE):
+            batch = stale_positions[start:start + SIMILARITY_BATCH_SIZE]
+            vectors = sparse.vstack([self._vector(int(pos)) for pos in batch]).tocsr()
+            positions, scores = _batch_top_k(self._similarities(vectors), batch, k)
+            index.neighbors[batch] = np.where(positions >= 0, index.ids[np.maximum(positions, 0)], -1)
+            index.scores[batch] = scores
+
+        # Порог попадания в список: k-я близость заполненного списка, иначе любая положительная
+        floor = np.where(index.neighbors[:count, -1] >= 0, index.scores[:count, -1], 0)
+        sims = self._similarities(sparse.vstack([self.delta[pos] for pos in changed_positions]).tocsr()).tocoo()
+        candidates = (sims.data > floor[sims.col]) & ~stale[sims.col]
+        for row, col, score in zip(sims.row[candidates], sims.col[candidates], sims.data[candidates]):
+            self._insert_neighbor(int(col), int(changed_ids[row]), float(score))
+        return True
+
+    def publish(self, change_seq: int) -> None:
+        """
+        Сохраняет поколение и делает его текущим.
+        """
+        index = self.index
+        index.flush()
+        positions = np.fromiter(self.delta, dtype=np.int64)
+        matrix = sparse.vstack(list(self.delta.values())).tocsr() if self.delta else sparse.csr_matrix(
+            (0, SIMILARITY_FEATURES), dtype=np.float32)
+        np.savez(os.path.join(self.path, "delta.npz"),
+                 positions=positions, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr)
+        index.meta.update(change_seq=change_seq, delta=len(self.delta),
+                          generation=index.meta.get("generation", 0) + 1)
+        _write_meta(self.path, index.meta)
+        _switch_current(self.path)
+
+    def discard(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def refresh_similarity_index(db: Session, limit: int = 1000) -> dict:
+    """
+    Применяет к индексу изменения каталога из ленты изменений (change_seq).
+    Номера выдаются при коммите в порядке видимости (app/changefeed.py), поэтому
+    наибольший применённый номер можно сохранять как отметку: меньшие номера
+    позже не появятся.
+    Вызывается под блокировкой _index_lock.
+    """
+    path = _current_path()
+    if path is None:
+        return build_similarity_index(db)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    since = meta["change_seq"]
+    items = (
+        db.query(LibraryItem.id, LibraryItem.title, LibraryItem.genre, LibraryItem.description, LibraryItem.change_seq)
+        .filter(LibraryItem.change_seq > since)
+        .order_by(LibraryItem.change_seq)
+        .limit(limit)
+        .all()
+    )
+    tombstones = (
+        db.query(LibraryItemTombstone.item_id, LibraryItemTombstone.change_seq)
+        .filter(LibraryItemTombstone.change_seq > since)
+        .order_by(LibraryItemTombstone.change_seq)
+        .limit(limit)
+        .all()
+    )
+    changes = sorted(
+        [(row.change_seq, row.id, _item_text(row.title, row.genre, row.description)) for row in items]
+        + [(row.change_seq, row.item_id, None) for row in tombstones]
+    )[:limit]
+    if not changes:
+        return {"updated": 0}
+    if meta["delta"] + len(changes) > SIMILARITY_MAX_DELTA:
+        return build_similarity_index(db)
+    updater = _IndexUpdater(path)
+    try:
+        applied = updater.apply([(item_id, text) for _, item_id, text in changes])
+        if applied:
+            updater.publish(changes[-1][0])
+    except BaseException:
+        updater.discard()
+        raise
+    if not applied:
+        updater.discard()
+        return build_similarity_index(db)
+    return {"updated": len(changes)}
+
+
+@job_handler("rebuild_similar_items")
+def rebuild_similar_items(ctx: JobContext, params: dict) -> dict:
+    """
+    Полная перестройка индекса на хосте, где выполняется задача.
+    """
+    with _index_lock():
+        return build_similarity_index(ctx.db, ctx=ctx)
+
+
+class SimilarityRefresher:
+    """
+    Фоновый поток воркера: после изменений каталога (или по таймеру) обновляет
+    индекс хоста. Обновляет тот воркер, который первым захватил блокировку.
+    """
+
+    def __init__(self, interval: int = SIMILARITY_REFRESH_SECONDS):
+        self.interval = interval
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        invalidation_bus.subscribe(ITEM_CHANGED, self._mark_changed)
+        # Массовая загрузка публикует только смену версии каталога, без id элементов
+        invalidation_bus.subscribe(CATALOG_VERSION_BUMPED, self._mark_changed)
+
+    def _mark_changed(self, invalidation: Optional[InvalidationEvent] = None) -> None:
+        self._changed.set()
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._changed.set()
+        self._thread = threading.Thread(target=self._run, name="similarity-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._changed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._changed.wait(self.interval)
+            # Небольшая пауза, чтобы объединить серию изменений в одно обновление
+            self._stopped.wait(1.0)
+            self._changed.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                with _index_lock(blocking=False) as acquired:
+                    if not acquired:
+                        continue
+                    db = SessionLocal()
+                    try:
+                        while refresh_similarity_index(db).get("updated"):
+                            pass
+                    finally:
+                        db.close()
+            except Exception:
+                logger.exception("Ошибка обновления индекса похожих элементов")
+
+
+similarity_refresher = SimilarityRefresher()
@@ -0,0 +1,91 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from app.events import InvalidationEvent
+
+# Все группы по имени, для метрик
+_registry: Dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные вызовы: первый вызов (лидер) выполняет
+    функцию, остальные с тем же ключом ждут его результат, не обращаясь к БД.
+    Завершённые результаты не кешируются.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[tuple, _Call] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_followers = 0
+        _registry[name] = self
+
+    def invalidate(self, invalidation: Optional[InvalidationEvent] = None) -> None:
+        """
+        После записи новые вызовы не присоединяются к начатым до неё,
+        иначе они могли бы получить данные без этой записи.
+        """
+        with self._lock:
+            self._generation += 1
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            key = (self._generation, key)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self.max_followers = max(self.max_followers, call.followers)
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.leaders + self.coalesced
+            return {
+                "requests": total,
+                "executed": self.leaders,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+                "errors": self.errors,
+                "in_flight": len(self._calls),
+                "max_followers": self.max_followers,
+            }
+
+
+def single_flight_stats() -> Dict[str, dict]:
+    return {name: flight.stats() for name, flight in _registry.items()}
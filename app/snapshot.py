@@ -0,0 +1,470 @@
+import re
+import sys
+import threading
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from decouple import config
+from pydantic import BaseModel
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from app.changefeed import last_change_seq
+from app.events import CATALOG_VERSION_BUMPED, ITEM_CHANGED, InvalidationEvent, invalidation_bus
+from app.models import LibraryItem, LibraryItemTombstone
+
+# Режим обслуживания списка каталога из снимка в памяти (выключен по умолчанию)
+CATALOG_SNAPSHOT = config("CATALOG_SNAPSHOT", cast=bool, default=False)
+# Если изменений больше, снимок загружается заново вместо применения ленты
+SNAPSHOT_MAX_CHANGES = config("SNAPSHOT_MAX_CHANGES", cast=int, default=50000)
+
+_NULL_INT = np.iinfo(np.int32).min
+_LOAD_CHUNK_SIZE = 10000
+_PATTERN_CACHE_SIZE = 1024
+
+
+def _like_regex(pattern: str) -> "re.Pattern":
+    """
+    Переводит шаблон ILIKE '%pattern%' в регулярное выражение (с учётом % и _).
+    """
+    parts, escaped = [], False
+    for ch in pattern:
+        if escaped:
+            parts.append(re.escape(ch))
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == "%":
+            parts.append(".*")
+        elif ch == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile("".join(parts), re.IGNORECASE | re.DOTALL)
+
+
+class _Dictionary:
+    """
+    Словарное кодирование строкового столбца: значения хранятся один раз, строки — кодами.
+    """
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = list(values or [])
+        self.codes: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+        self._lowered: Optional[np.ndarray] = None
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return code
+
+    def copy(self) -> "_Dictionary":
+        return _Dictionary(self.values)
+
+    def matching(self, pattern: str) -> np.ndarray:
+        """
+        Коды значений, подходящих под ILIKE '%pattern%'.
+        """
+        if not any(ch in pattern for ch in "%_\\"):
+            if self._lowered is None:
+                self._lowered = np.array([value.lower() for value in self.values] or [""], dtype=str)
+            found = np.char.find(self._lowered, pattern.lower()) >= 0
+            return np.flatnonzero(found[:len(self.values)])
+        regex = _like_regex(pattern)
+        return np.array([code for code, value in enumerate(self.values) if regex.search(value)], dtype=np.int64)
+
+
+class _TextColumn:
+    """
+    Строковый столбец одним буфером UTF-8 со смещениями строк: без отдельного
+    объекта str на каждую строку снимка.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values: List[str]) -> "_TextColumn":
+        encoded = [value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos: int) -> str:
+        return self.data[self.offsets[pos]:self.offsets[pos + 1]].tobytes().decode()
+
+    def take(self, positions: np.ndarray) -> "_TextColumn":
+        starts = self.offsets[positions]
+        lengths = self.offsets[np.asarray(positions) + 1] - starts
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return _TextColumn(self.data[index], offsets)
+
+    def concat(self, other: "_TextColumn") -> "_TextColumn":
+        return _TextColumn(np.concatenate([self.data, other.data]),
+                           np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]))
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + self.offsets.nbytes)
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый столбцовый снимок library_items, упорядоченный по id.
+    Числовые столбцы — массивы NumPy, автор и жанр — коды словарей, названия —
+    один буфер UTF-8. Описания в снимке не хранятся: их читают из БД по id.
+    """
+
+    def __init__(self, ids, years, copies, versions, author_codes, authors, genre_codes, genres,
+                 titles, title_ranks, title_order, change_seq):
+        self.ids = ids
+        self.years = years
+        self.copies = copies
+        self.versions = versions
+        self.author_codes = author_codes
+        self.authors = authors
+        self.genre_codes = genre_codes
+        self.genres = genres
+        self.titles = titles
+        # Ранг названия в порядке сортировки БД (по её правилам сравнения строк)
+        self.title_ranks = title_ranks
+        # Позиции строк в порядке (title, id)
+        self.title_order = title_order
+        self.change_seq = change_seq
+        self._orders: Dict[tuple, np.ndarray] = {}
+        self._patterns: Dict[tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _codes_matching(self, column: str, pattern: str) -> np.ndarray:
+        key = (column, pattern)
+        codes = self._patterns.get(key)
+        if codes is None:
+            codes = getattr(self, column).matching(pattern)
+            with self._lock:
+                if len(self._patterns) >= _PATTERN_CACHE_SIZE:
+                    self._patterns.clear()
+                self._patterns[key] = codes
+        return codes
+
+    def filter_mask(self, author: Optional[str], published_year: Optional[int],
+                    genre: Optional[str], in_stock: bool = False) -> Optional[np.ndarray]:
+        mask = None
+        if author:
+            mask = np.isin(self.author_codes, self._codes_matching("authors", author))
+        if published_year:
+            year_mask = self.years == published_year
+            mask = year_mask if mask is None else mask & year_mask
+        if genre:
+            genre_mask = np.isin(self.genre_codes, self._codes_matching("genres", genre))
+            mask = genre_mask if mask is None else mask & genre_mask
+        if in_stock:
+            stock_mask = self.copies > 0
+            mask = stock_mask if mask is None else mask & stock_mask
+        return mask
+
+    def _column(self, name: str) -> np.ndarray:
+        if name == "title":
+            return self.title_ranks
+        return {"id": self.ids, "published_year": self.years, "available_copies": self.copies}[name]
+
+    def order(self, sort_keys: Tuple[Tuple[str, bool], ...]) -> Optional[np.ndarray]:
+        """
+        Перестановка позиций для сортировки (None — порядок по id). Кешируется в снимке.
+        """
+        if sort_keys == (("id", False),):
+            return None
+        order = self._orders.get(sort_keys)
+        if order is None:
+            columns = [
+                -self._column(name).astype(np.int64) if desc else self._column(name)
+                for name, desc in sort_keys
+            ]
+            # lexsort сортирует по последнему ключу в первую очередь
+            order = np.lexsort(columns[::-1])
+            with self._lock:
+                self._orders[sort_keys] = order
+        return order
+
+    def value(self, name: str, pos: int):
+        if name == "author":
+            return self.authors.values[self.author_codes[pos]]
+        if name == "genre":
+            code = int(self.genre_codes[pos])
+            return self.genres.values[code] if code >= 0 else None
+        if name == "title":
+            return self.titles[pos]
+        if name == "published_year":
+            year = int(self.years[pos])
+            return None if year == _NULL_INT else year
+        return int({"id": self.ids, "available_copies": self.copies, "version": self.versions}[name][pos])
+
+    def item(self, pos: int, model: Type[BaseModel], extra: Optional[dict] = None) -> BaseModel:
+        extra = extra or {}
+        return model(**{name: extra[name] if name in extra else self.value(name, pos) for name in model.model_fields})
+
+    def footprint(self) -> dict:
+        """
+        Оценка занимаемой памяти в байтах по столбцам.
+        """
+        def strings(values) -> int:
+            return sum(sys.getsizeof(value) for value in values if value is not None)
+
+        arrays = {
+            "ids": self.ids, "published_year": self.years, "available_copies": self.copies,
+            "versions": self.versions, "author_codes": self.author_codes, "genre_codes": self.genre_codes,
+            "title_ranks": self.title_ranks, "title_order": self.title_order,
+        }
+        columns = {name: int(array.nbytes) for name, array in arrays.items()}
+        columns["titles"] = self.titles.nbytes
+        columns["author_dictionary"] = strings(self.authors.values)
+        columns["genre_dictionary"] = strings(self.genres.values)
+        return {
+            "rows": len(self),
+            "authors": len(self.authors.values),
+            "genres": len(self.genres.values),
+            "bytes": columns,
+            "total_bytes": sum(columns.values()),
+        }
+
+
+_COLUMNS = (
+    LibraryItem.id, LibraryItem.title, LibraryItem.author, LibraryItem.genre,
+    LibraryItem.published_year, LibraryItem.available_copies, LibraryItem.version,
+)
+_Row = namedtuple("_Row", [column.key for column in _COLUMNS] + ["title_rank"])
+
+
+def _title_rank():
+    # Равные названия получают равный ранг; порядок — тот же, что у ORDER BY title в SQL
+    return func.dense_rank().over(order_by=LibraryItem.title).label("title_rank")
+
+
+def _build_columns(rows, authors: _Dictionary, genres: _Dictionary) -> dict:
+    return {
+        "ids": np.fromiter((row.id for row in rows), dtype=np.int32, count=len(rows)),
+        "years": np.fromiter(
+            (_NULL_INT if row.published_year is None else row.published_year for row in rows),
+            dtype=np.int32, count=len(rows),
+        ),
+        "copies": np.fromiter((row.available_copies for row in rows), dtype=np.int32, count=len(rows)),
+        "versions": np.fromiter((row.version for row in rows), dtype=np.int32, count=len(rows)),
+        "author_codes": np.fromiter((authors.encode(row.author) for row in rows), dtype=np.int32, count=len(rows)),
+        "genre_codes": np.fromiter((genres.encode(row.genre) for row in rows), dtype=np.int32, count=len(rows)),
+        "title_ranks": np.fromiter((row.title_rank for row in rows), dtype=np.int32, count=len(rows)),
+        "titles": _TextColumn.from_values([row.title for row in rows]),
+    }
+
+
+def build_snapshot(rows: list, change_seq: int) -> CatalogSnapshot:
+    """
+    Строит снимок из строк с полями _Row (title_rank — ранг названия в БД), упорядоченных по id.
+    """
+    authors, genres = _Dictionary(), _Dictionary()
+    columns = _build_columns(rows, authors, genres)
+    title_order = np.lexsort((columns["ids"], columns["title_ranks"])) if len(rows) else np.empty(0, dtype=np.int64)
+    return CatalogSnapshot(authors=authors, genres=genres, title_order=title_order, change_seq=change_seq, **columns)
+
+
+def load_snapshot(db: Session) -> CatalogSnapshot:
+    # Номер фиксируется до чтения: более поздние изменения будут применены повторно
+    change_seq = last_change_seq(db)
+    rows = db.query(*_COLUMNS, _title_rank()).order_by(LibraryItem.id).yield_per(_LOAD_CHUNK_SIZE).all()
+    return build_snapshot(rows, change_seq)
+
+
+def apply_changes(snapshot: CatalogSnapshot, rows: list, deleted_ids: List[int], change_seq: int,
+                  ranks: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> CatalogSnapshot:
+    """
+    Строит новый снимок с изменёнными строками; исходный снимок не меняется.
+    ranks — пары (id по возрастанию, ранг названия) для всех строк каталога: передаются,
+    когда у изменённых строк новые названия и ранги остальных строк сдвинулись.
+    """
+    rows = sorted(rows, key=lambda row: row.id)
+    changed = np.array([row.id for row in rows] + list(deleted_ids), dtype=np.int32)
+    keep = ~np.isin(snapshot.ids, changed)
+    authors, genres = snapshot.authors.copy(), snapshot.genres.copy()
+    added = _build_columns(rows, authors, genres)
+    titles = added.pop("titles")
+    combined = {name: np.concatenate([getattr(snapshot, name)[keep], added[name]]) for name in added}
+    perm = np.argsort(combined["ids"], kind="stable")
+    columns = {name: values[perm] for name, values in combined.items()}
+    columns["titles"] = snapshot.titles.take(np.flatnonzero(keep)).concat(titles).take(perm)
+    if ranks is not None:
+        rank_ids, rank_values = ranks
+        columns["title_ranks"] = rank_values[np.searchsorted(rank_ids, columns["ids"])].astype(np.int32)
+    new_position = np.empty(len(perm), dtype=np.int64)
+    new_position[perm] = np.arange(len(perm))
+
+    # Взаимный порядок сохранённых строк не меняется (их названия те же): переносим его
+    # и вставляем изменённые строки по (рангу названия, id)
+    kept_index = np.cumsum(keep) - 1
+    title_order = new_position[kept_index[snapshot.title_order[keep[snapshot.title_order]]]]
+    kept_ranks = columns["title_ranks"][title_order]
+    kept_ids = columns["ids"][title_order]
+    first_added = int(keep.sum())
+    inserted = new_position[first_added + np.arange(len(rows))]
+    inserted = inserted[np.lexsort((columns["ids"][inserted], columns["title_ranks"][inserted]))]
+    points = []
+    for pos in inserted:
+        rank = columns["title_ranks"][pos]
+        lo = int(np.searchsorted(kept_ranks, rank, side="left"))
+        hi = int(np.searchsorted(kept_ranks, rank, side="right"))
+        points.append(lo + int(np.searchsorted(kept_ids[lo:hi], columns["ids"][pos])))
+    title_order = np.insert(title_order, points, inserted)
+
+    return CatalogSnapshot(authors=authors, genres=genres, title_order=title_order.astype(np.int64),
+                           change_seq=change_seq, **columns)
+
+
+def _refresh_with_ranks(db: Session, snapshot: CatalogSnapshot) -> CatalogSnapshot:
+    """
+    Применяет изменения вместе с пересчитанными рангами названий. Ранги всех строк
+    и изменённые строки читаются одним запросом, поэтому согласованы между собой;
+    у неизменённых строк читаются только id и ранг. Удалённые — строки снимка,
+    которых нет в ответе.
+    """
+    since = snapshot.change_seq
+    changed = LibraryItem.change_seq > since
+    result = (
+        db.query(LibraryItem.id, _title_rank(), LibraryItem.change_seq,
+                 *[case((changed, column), else_=None).label(column.key) for column in _COLUMNS[1:]])
+        .order_by(LibraryItem.id)
+        .yield_per(_LOAD_CHUNK_SIZE)
+        .all()
+    )
+    rank_ids = np.fromiter((row.id for row in result), dtype=np.int32, count=len(result))
+    rank_values = np.fromiter((row.title_rank for row in result), dtype=np.int32, count=len(result))
+    rows = [_Row(**{name: getattr(row, name) for name in _Row._fields}) for row in result if row.change_seq > since]
+    deleted = snapshot.ids[~np.isin(snapshot.ids, rank_ids)].tolist()
+    change_seq = max([since] + [row.change_seq for row in result])
+    return apply_changes(snapshot, rows, deleted, change_seq, ranks=(rank_ids, rank_values))
+
+
+def refresh_snapshot(db: Session, snapshot: CatalogSnapshot) -> CatalogSnapshot:
+    """
+    Применяет к снимку ленту изменений каталога после snapshot.change_seq.
+    Номера выдаются при коммите в порядке видимости (app/changefeed.py), поэтому
+    наибольший увиденный номер годится как новая отметка: меньшие уже не появятся.
+    Пока названия не меняются, ранги изменённых строк берутся из снимка; новое
+    название требует рангов из БД (см. _refresh_with_ranks).
+    """
+    since = snapshot.change_seq
+    pending = (
+        db.query(func.count(LibraryItem.id)).filter(LibraryItem.change_seq > since).scalar()
+        + db.query(func.count(LibraryItemTombstone.item_id)).filter(LibraryItemTombstone.change_seq > since).scalar()
+    )
+    if pending > SNAPSHOT_MAX_CHANGES:
+        return load_snapshot(db)
+    rows = db.query(*_COLUMNS, LibraryItem.change_seq).filter(LibraryItem.change_seq > since).all()
+    tombstones = (
+        db.query(LibraryItemTombstone.item_id, LibraryItemTombstone.change_seq)
+        .filter(LibraryItemTombstone.change_seq > since)
+        .all()
+    )
+    if not rows and not tombstones:
+        return snapshot
+    change_seq = max(row.change_seq for row in [*rows, *tombstones])
+    positions = np.searchsorted(snapshot.ids, [row.id for row in rows])
+    for pos, row in zip(positions, rows):
+        if pos >= len(snapshot) or snapshot.ids[pos] != row.id or snapshot.titles[int(pos)] != row.title:
+            return _refresh_with_ranks(db, snapshot)
+    rows = [_Row(*row[:len(_COLUMNS)], title_rank=snapshot.title_ranks[pos]) for pos, row in zip(positions, rows)]
+    return apply_changes(snapshot, rows, [row.item_id for row in tombstones], change_seq)
+
+
+class CatalogSnapshotServer:
+    """
+    Держит текущий снимок воркера. События записи помечают его устаревшим,
+    и следующий запрос подменяет снимок обновлённым (атомарно: запросы,
+    уже получившие старый снимок, дорабатывают на нём). Пока один запрос
+    обновляет снимок, остальные не ждут его и читают предыдущий.
+    """
+
+    def __init__(self, enabled: bool = CATALOG_SNAPSHOT):
+        self.enabled = enabled
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._stale = True
+        self._lock = threading.Lock()
+        invalidation_bus.subscribe(ITEM_CHANGED, self.mark_stale)
+        invalidation_bus.subscribe(CATALOG_VERSION_BUMPED, self.mark_stale)
+
+    def preload(self, db: Session) -> None:
+        if self.enabled:
+            self.current(db)
+
+    def mark_stale(self, invalidation: Optional[InvalidationEvent] = None) -> None:
+        self._stale = True
+
+    def current(self, db: Session) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and not self._stale:
+            return snapshot
+        # Ждать обновления приходится только при первой загрузке
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self._stale or self._snapshot is None:
+                # Сбрасывается до чтения, чтобы не потерять события, пришедшие во время обновления
+                self._stale = False
+                if self._snapshot is None:
+                    self._snapshot = load_snapshot(db)
+                else:
+                    self._snapshot = refresh_snapshot(db, self._snapshot)
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def query(self, db: Session, author: Optional[str], published_year: Optional[int], genre: Optional[str],
+              sort_keys: Tuple[Tuple[str, bool], ...], skip: int, limit: int,
+              include_total: bool, model: Type[BaseModel],
+              in_stock: bool = False) -> Tuple[List[BaseModel], Optional[int]]:
+        snapshot = self.current(db)
+        mask = snapshot.filter_mask(author, published_year, genre, in_stock)
+        order = snapshot.order(sort_keys)
+        skip, limit = max(skip, 0), max(limit, 0)
+        if mask is None and order is None:
+            selected = np.arange(min(skip, len(snapshot)), min(skip + limit, len(snapshot)))
+            total = len(snapshot)
+        else:
+            if order is None:
+                matched = np.flatnonzero(mask)
+            else:
+                matched = order if mask is None else order[mask[order]]
+            selected = matched[skip:skip + limit]
+            total = len(matched)
+        if "description" not in model.model_fields or not len(selected):
+            return [snapshot.item(pos, model) for pos in selected], total if include_total else None
+        # Описаний нет в снимке: читаются по первичному ключу только для строк страницы
+        descriptions = dict(
+            db.query(LibraryItem.id, LibraryItem.description)
+            .filter(LibraryItem.id.in_(snapshot.ids[selected].tolist()))
+            .all()
+        )
+        items = [
+            snapshot.item(pos, model, {"description": descriptions.get(int(snapshot.ids[pos]))})
+            for pos in selected
+        ]
+        return items, total if include_total else None
+
+    def footprint(self) -> dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"enabled": self.enabled, "loaded": False}
+        return {"enabled": self.enabled, "loaded": True, "change_seq": snapshot.change_seq, **snapshot.footprint()}
+
+
+catalog_snapshot = CatalogSnapshotServer()
@@ -0,0 +1,62 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.models import LibraryItem
+
+
+def _orderings(*keys: Tuple[str, bool]) -> Dict[str, Tuple[Tuple[str, bool], ...]]:
+    """
+    Возвращает сортировку и обратную ей: обе обслуживаются одним индексом,
+    так как btree можно читать в обоих направлениях.
+    """
+    def spec(reverse: bool) -> str:
+        return ",".join(("-" if desc != reverse else "") + name for name, desc in keys)
+
+    return {
+        spec(False): keys,
+        spec(True): tuple((name, not desc) for name, desc in keys),
+    }
+
+
+# Допустимые сортировки. Для каждой есть составной индекс
+# (см. __table_args__ модели LibraryItem), оканчивающийся на id.
+SORT_ORDERINGS = {
+    **_orderings(("id", False)),
+    **_orderings(("title", False)),
+    **_orderings(("published_year", False), ("title", False)),
+    **_orderings(("published_year", True), ("title", False)),
+    **_orderings(("available_copies", False), ("title", False)),
+    **_orderings(("available_copies", True), ("title", False)),
+}
+
+
+def library_item_sort_keys(sort: Optional[str]) -> Tuple[Tuple[str, bool], ...]:
+    """
+    Проверяет параметр sort (например, "-published_year,title") и возвращает ключи
+    (поле, по убыванию). В конец добавляется id в направлении последнего ключа,
+    чтобы порядок был однозначным и совпадал с индексом.
+    """
+    if not sort:
+        return (("id", False),)
+    keys = SORT_ORDERINGS.get(sort.replace(" ", ""))
+    if keys is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported sort. Allowed values: {', '.join(SORT_ORDERINGS)}",
+        )
+    if keys[-1][0] != "id":
+        keys += (("id", keys[-1][1]),)
+    return keys
+
+
+def library_item_order_by(sort: Optional[str], columns: Optional[Dict[str, Any]] = None) -> List:
+    """
+    Переводит параметр sort в ORDER BY. columns заменяет столбцы LibraryItem
+    (например, available_copies филиала при фильтре по филиалу).
+    """
+    order_by = []
+    for name, desc in library_item_sort_keys(sort):
+        column = (columns or {}).get(name, getattr(LibraryItem, name))
+        order_by.append(column.desc() if desc else column)
+    return order_by
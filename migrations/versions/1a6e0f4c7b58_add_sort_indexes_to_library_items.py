@@ -0,0 +1,40 @@
+"""Add sort indexes to library_items
+
+Revision ID: 1a6e0f4c7b58
+Revises: f5c3b9d8e214
+Create Date: 2026-10-19 22:10:08.336410
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1a6e0f4c7b58'
+down_revision: Union[str, None] = 'f5c3b9d8e214'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SORT_INDEXES = [
+    ('ix_library_items_title_id', ['title', 'id']),
+    ('ix_library_items_year_title_id', ['published_year', 'title', 'id']),
+    ('ix_library_items_year_desc_title_id', [sa.text('published_year DESC'), 'title', 'id']),
+    ('ix_library_items_copies_title_id', ['available_copies', 'title', 'id']),
+    ('ix_library_items_copies_desc_title_id', [sa.text('available_copies DESC'), 'title', 'id']),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись в таблицу, но не может выполняться в транзакции
+    with op.get_context().autocommit_block():
+        for name, columns in SORT_INDEXES:
+            op.create_index(name, 'library_items', columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(SORT_INDEXES):
+            op.drop_index(name, table_name='library_items', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,42 @@
+"""Add change feed to library_items
+
+Revision ID: 3b9e1c7d52a4
+Revises: 94f2f90664b2
+Create Date: 2026-10-19 19:05:12.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e1c7d52a4'
+down_revision: Union[str, None] = '94f2f90664b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('library_items_change_seq')))
+    # Существующие строки получают номера изменений при добавлении столбца
+    op.add_column('library_items', sa.Column('change_seq', sa.BigInteger(),
+                                             server_default=sa.text("nextval('library_items_change_seq')"),
+                                             nullable=False))
+    op.create_index(op.f('ix_library_items_change_seq'), 'library_items', ['change_seq'], unique=False)
+    op.create_table('library_item_tombstones',
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('change_seq', sa.BigInteger(), server_default=sa.text("nextval('library_items_change_seq')"), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('item_id')
+    )
+    op.create_index(op.f('ix_library_item_tombstones_change_seq'), 'library_item_tombstones', ['change_seq'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_library_item_tombstones_change_seq'), table_name='library_item_tombstones')
+    op.drop_table('library_item_tombstones')
+    op.drop_index(op.f('ix_library_items_change_seq'), table_name='library_items')
+    op.drop_column('library_items', 'change_seq')
+    op.execute(sa.schema.DropSequence(sa.Sequence('library_items_change_seq')))
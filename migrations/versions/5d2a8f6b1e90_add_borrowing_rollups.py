@@ -0,0 +1,47 @@
+"""Add borrowing rollups
+
+Revision ID: 5d2a8f6b1e90
+Revises: c81f4a0e9d37
+Create Date: 2026-10-19 20:22:41.905318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2a8f6b1e90'
+down_revision: Union[str, None] = 'c81f4a0e9d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('borrow_daily_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('borrow_count', sa.Integer(), nullable=False),
+    sa.Column('return_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+    sa.PrimaryKeyConstraint('day', 'book_id')
+    )
+    op.create_table('reader_daily_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('reader_id', sa.Integer(), nullable=False),
+    sa.Column('borrow_count', sa.Integer(), nullable=False),
+    sa.Column('return_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['reader_id'], ['readers.id'], ),
+    sa.PrimaryKeyConstraint('day', 'reader_id')
+    )
+    op.create_index('ix_borrowed_books_open_borrow_date', 'borrowed_books', ['borrow_date'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL'))
+    # Агрегаты заполняются командой: python -m app.analytics backfill
+
+
+def downgrade() -> None:
+    op.drop_index('ix_borrowed_books_open_borrow_date', table_name='borrowed_books',
+                  postgresql_where=sa.text('return_date IS NULL'))
+    op.drop_table('reader_daily_stats')
+    op.drop_table('borrow_daily_stats')
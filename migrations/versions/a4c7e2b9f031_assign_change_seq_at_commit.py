@@ -0,0 +1,45 @@
+"""Assign change_seq at commit from catalog_change_counter
+
+Revision ID: a4c7e2b9f031
+Revises: d9b2e6f1a407
+Create Date: 2026-10-20 10:12:41.530266
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c7e2b9f031'
+down_revision: Union[str, None] = 'd9b2e6f1a407'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('catalog_change_counter',
+    sa.Column('id', sa.SmallInteger(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Счётчик продолжает уже выданные номера
+    op.execute("""
+        INSERT INTO catalog_change_counter (id, value)
+        SELECT 1, GREATEST(
+            (SELECT COALESCE(max(change_seq), 0) FROM library_items),
+            (SELECT COALESCE(max(change_seq), 0) FROM library_item_tombstones)
+        )
+    """)
+    for table in ('library_items', 'library_item_tombstones'):
+        op.alter_column(table, 'change_seq', server_default=sa.text('(-txid_current())'))
+    op.execute(sa.schema.DropSequence(sa.Sequence('library_items_change_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('library_items_change_seq')))
+    op.execute("SELECT setval('library_items_change_seq', value + 1, false) FROM catalog_change_counter")
+    for table in ('library_items', 'library_item_tombstones'):
+        op.alter_column(table, 'change_seq', server_default=sa.text("nextval('library_items_change_seq')"))
+    op.drop_table('catalog_change_counter')
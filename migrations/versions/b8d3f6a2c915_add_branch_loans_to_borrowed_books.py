@@ -0,0 +1,44 @@
+"""Add branch loans to borrowed_books
+
+Revision ID: b8d3f6a2c915
+Revises: a4c7e2b9f031
+Create Date: 2026-10-20 14:31:08.274519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d3f6a2c915'
+down_revision: Union[str, None] = 'a4c7e2b9f031'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('borrowed_books', sa.Column('branch_id', sa.Integer(), nullable=True))
+    op.add_column('borrowed_books', sa.Column('item_id', sa.Integer(), nullable=True))
+    op.alter_column('borrowed_books', 'book_id', existing_type=sa.Integer(), nullable=True)
+    op.create_foreign_key('borrowed_books_branch_id_fkey', 'borrowed_books', 'branches', ['branch_id'], ['id'])
+    op.create_foreign_key('borrowed_books_item_id_fkey', 'borrowed_books', 'library_items', ['item_id'], ['id'],
+                          ondelete='SET NULL')
+    op.create_index('ix_borrowed_books_item_id', 'borrowed_books', ['item_id'], unique=False)
+    op.create_check_constraint('ck_borrowed_books_book_or_branch', 'borrowed_books',
+                               'book_id IS NULL OR (branch_id IS NULL AND item_id IS NULL)')
+    op.create_check_constraint('ck_borrowed_books_has_source', 'borrowed_books',
+                               'book_id IS NOT NULL OR branch_id IS NOT NULL')
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM borrowed_books WHERE book_id IS NULL")
+    op.drop_constraint('ck_borrowed_books_has_source', 'borrowed_books', type_='check')
+    op.drop_constraint('ck_borrowed_books_book_or_branch', 'borrowed_books', type_='check')
+    op.drop_index('ix_borrowed_books_item_id', table_name='borrowed_books')
+    op.drop_constraint('borrowed_books_item_id_fkey', 'borrowed_books', type_='foreignkey')
+    op.drop_constraint('borrowed_books_branch_id_fkey', 'borrowed_books', type_='foreignkey')
+    op.alter_column('borrowed_books', 'book_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_column('borrowed_books', 'item_id')
+    op.drop_column('borrowed_books', 'branch_id')
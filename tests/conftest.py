@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+# Модули приложения читают настройки при импорте. Тесты с БД запускаются только
+# при заданном TEST_DATABASE_URL (отдельная база PostgreSQL, схема пересоздаётся).
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+else:
+    os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://localhost/library_catalog_test")
+os.environ.setdefault("SECRET_KEY", "test-secret-key")
+
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def pytest_sessionstart(session):
+    if not TEST_DATABASE_URL:
+        return
+    from app.database import Base, engine
+    import app.models  # noqa: F401
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def db():
+    """
+    Сессия тестовой базы; все таблицы очищаются перед тестом.
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import text
+
+    from app.database import Base, SessionLocal, engine
+
+    # Счётчик ленты изменений не очищается: номера остаются возрастающими между тестами
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables if table.name != "catalog_change_counter")
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    # Без контекстного менеджера: фоновые задачи и слушатели в тестах не запускаются
+    return TestClient(app)
+
+
+@pytest.fixture
+def admin_headers(client):
+    response = client.post("/auth/register", json={
+        "username": "admin", "email": "admin@example.com", "password": "Passw0rdX", "role": "admin",
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
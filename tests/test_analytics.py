@@ -0,0 +1,76 @@
+import threading
+from datetime import date
+
+from sqlalchemy import func, select
+
+from app.analytics import backfill_borrow_stats
+from app.database import SessionLocal
+from app.models import Author, Book, BorrowDailyStat, Reader, ReaderDailyStat
+
+
+def _setup(db):
+    book = Book(title="Dune", published_year=1965, author=Author(name="Frank Herbert"), available_copies=3)
+    reader = Reader(name="Reader")
+    db.add_all([book, reader])
+    db.commit()
+    return book.id, reader.id
+
+
+def _stats(db):
+    db.expire_all()
+    return (
+        sorted((row.book_id, row.borrow_count, row.return_count) for row in db.query(BorrowDailyStat)),
+        sorted((row.reader_id, row.borrow_count, row.return_count) for row in db.query(ReaderDailyStat)),
+    )
+
+
+def _borrow(client, headers, book_id, reader_id):
+    response = client.post("/borrowings/", headers=headers, json={"book_id": book_id, "reader_id": reader_id})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_borrows_and_returns_are_aggregated_by_upsert(client, admin_headers, db):
+    book_id, reader_id = _setup(db)
+    first = _borrow(client, admin_headers, book_id, reader_id)
+    _borrow(client, admin_headers, book_id, reader_id)
+    assert client.post(f"/borrowings/{first}/return", headers=admin_headers).status_code == 200
+    assert client.post(f"/borrowings/{first}/return", headers=admin_headers).status_code == 409
+
+    assert _stats(db) == ([(book_id, 2, 1)], [(reader_id, 2, 1)])
+    assert db.get(Book, book_id).available_copies == 2
+
+
+def test_backfill_rebuilds_the_same_rollups(client, admin_headers, db):
+    book_id, reader_id = _setup(db)
+    loan = _borrow(client, admin_headers, book_id, reader_id)
+    _borrow(client, admin_headers, book_id, reader_id)
+    client.post(f"/borrowings/{loan}/return", headers=admin_headers)
+    expected = _stats(db)
+
+    # Испорченные агрегаты заменяются пересчитанными по истории выдач
+    db.query(BorrowDailyStat).update({"borrow_count": 40})
+    db.query(ReaderDailyStat).delete()
+    db.commit()
+    assert backfill_borrow_stats(db) == 1
+    assert _stats(db) == expected
+
+
+def test_backfill_waits_for_borrows_holding_the_month(db):
+    _setup(db)
+    with SessionLocal() as borrower:
+        # Незафиксированная выдача текущего месяца держит его блокировку совместно
+        key = func.hashtext(f"borrow_stats:{date.today():%Y-%m}")
+        borrower.execute(select(func.pg_advisory_xact_lock_shared(key)))
+
+        def backfill():
+            with SessionLocal() as session:
+                backfill_borrow_stats(session, start=date.today(), end=date.today())
+
+        worker = threading.Thread(target=backfill)
+        worker.start()
+        worker.join(0.5)
+        assert worker.is_alive()
+        borrower.rollback()
+    worker.join(5)
+    assert not worker.is_alive()
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from app.auth import hash_refresh_token, purge_expired_refresh_tokens
+from app.models import RefreshToken
+
+
+def _register(client, username="reader"):
+    response = client.post("/auth/register", json={
+        "username": username, "email": f"{username}@example.com", "password": "Passw0rdX", "role": "user",
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _refresh(client, token):
+    return client.post("/auth/refresh", json={"refresh_token": token})
+
+
+def _stored(db, token):
+    db.expire_all()
+    return db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(token)).one()
+
+
+def test_refresh_rotates_the_token(client, db):
+    issued = _register(client)
+    response = _refresh(client, issued["refresh_token"])
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != issued["refresh_token"]
+    assert client.get("/auth/me", headers={"Authorization": f"Bearer {rotated['access_token']}"}).status_code == 200
+
+    old, new = _stored(db, issued["refresh_token"]), _stored(db, rotated["refresh_token"])
+    assert old.revoked_at is not None and new.revoked_at is None
+    assert old.family_id == new.family_id
+    # Токен хранится только в виде хеша
+    assert db.query(RefreshToken).filter(RefreshToken.token_hash == issued["refresh_token"]).count() == 0
+
+
+def test_reusing_a_rotated_token_revokes_the_family(client, db):
+    issued = _register(client)
+    rotated = _refresh(client, issued["refresh_token"]).json()
+    other_session = client.post("/auth/login", data={"username": "reader", "password": "Passw0rdX"}).json()
+
+    assert _refresh(client, issued["refresh_token"]).status_code == 401
+    # Вся цепочка отозвана, включая ещё не использованный последний токен
+    assert _stored(db, rotated["refresh_token"]).revoked_at is not None
+    assert _refresh(client, rotated["refresh_token"]).status_code == 401
+    # Другие входы того же пользователя — отдельные цепочки
+    assert _refresh(client, other_session["refresh_token"]).status_code == 200
+
+
+def test_unknown_and_expired_tokens_are_rejected(client, db):
+    issued = _register(client)
+    assert _refresh(client, "not-a-token").status_code == 401
+
+    db.query(RefreshToken).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    assert _refresh(client, issued["refresh_token"]).status_code == 401
+
+
+def test_logout_revokes_the_family(client, db):
+    issued = _register(client)
+    rotated = _refresh(client, issued["refresh_token"]).json()
+
+    response = client.post("/auth/logout", json={"refresh_token": rotated["refresh_token"]})
+    assert response.status_code == 200
+    assert _stored(db, rotated["refresh_token"]).revoked_at is not None
+    assert _refresh(client, rotated["refresh_token"]).status_code == 401
+    # Выход с неизвестным токеном ничего не раскрывает
+    assert client.post("/auth/logout", json={"refresh_token": "unknown"}).status_code == 200
+
+
+def test_purge_deletes_only_expired_tokens(client, db):
+    live = _register(client, "live")["refresh_token"]
+    for username in ("old1", "old2", "old3"):
+        _register(client, username)
+    db.query(RefreshToken).filter(RefreshToken.token_hash != hash_refresh_token(live)).update(
+        {"expires_at": datetime.utcnow() - timedelta(days=1)}, synchronize_session=False
+    )
+    db.commit()
+
+    assert purge_expired_refresh_tokens(db, batch_size=2) == 3
+    assert [row.token_hash for row in db.query(RefreshToken)] == [hash_refresh_token(live)]
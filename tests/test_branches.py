@@ -0,0 +1,144 @@
+from app.branches import fold_inventory_deltas
+from app.models import BorrowedBook, BranchInventory, InventoryDelta, LibraryItem, Reader
+
+
+def _create_item(client, headers, title, copies=0):
+    response = client.post("/library_items/?force=true", headers=headers, json={
+        "title": title, "author": "Author", "published_year": 2001, "available_copies": copies,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _create_branch(client, headers, name):
+    response = client.post("/branches/", headers=headers, json={"name": name})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _stock(client, headers, branch_id, item_id, total):
+    response = client.put(f"/branches/{branch_id}/inventory/{item_id}", headers=headers, json={"total_copies": total})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _branch_list(client, headers, branch_id, **params):
+    response = client.get("/library_items/", headers=headers, params={
+        "branch_id": branch_id, "include_total": True, **params,
+    })
+    assert response.status_code == 200, response.text
+    return [(item["id"], item["available_copies"]) for item in response.json()], int(response.headers["X-Total-Count"])
+
+
+def test_branch_list_reads_branch_stock_and_sees_inventory_changes(client, admin_headers):
+    branch = _create_branch(client, admin_headers, "Central")
+    other = _create_branch(client, admin_headers, "North")
+    dune, emma, walden = (_create_item(client, admin_headers, title) for title in ("Dune", "Emma", "Walden"))
+    _stock(client, admin_headers, branch, dune, 1)
+    _stock(client, admin_headers, branch, emma, 3)
+    _stock(client, admin_headers, other, walden, 5)
+
+    assert _branch_list(client, admin_headers, branch) == ([(dune, 1), (emma, 3)], 2)
+    assert _branch_list(client, admin_headers, branch, in_stock=True) == ([(dune, 1), (emma, 3)], 2)
+
+    # Изменение фонда сбрасывает закешированное количество
+    assert _stock(client, admin_headers, branch, dune, 0)["available_copies"] == 0
+    assert _branch_list(client, admin_headers, branch, in_stock=True) == ([(emma, 3)], 1)
+
+
+def test_branch_stock_cannot_drop_below_copies_on_loan(client, admin_headers, db):
+    branch = _create_branch(client, admin_headers, "Central")
+    item = _create_item(client, admin_headers, "Dune")
+    _stock(client, admin_headers, branch, item, 2)
+    # Оба экземпляра выданы
+    db.query(BranchInventory).filter(BranchInventory.item_id == item).update({"available_copies": 0})
+    db.commit()
+
+    response = client.put(f"/branches/{branch}/inventory/{item}", headers=admin_headers, json={"total_copies": 1})
+    assert response.status_code == 409
+    assert _stock(client, admin_headers, branch, item, 3)["available_copies"] == 1
+
+
+def test_merge_keeps_unfolded_inventory_deltas(client, admin_headers, db):
+    branch = _create_branch(client, admin_headers, "Central")
+    item = _create_item(client, admin_headers, "Dune", copies=1)
+    duplicate = _create_item(client, admin_headers, "Dune (2nd copy)", copies=2)
+    _stock(client, admin_headers, branch, duplicate, 4)
+
+    response = client.post(f"/library_items/{item}/merge", headers=admin_headers, json={"duplicate_ids": [duplicate]})
+    assert response.status_code == 200, response.text
+    assert response.json()["available_copies"] == 3
+
+    assert [(row.item_id, row.available_delta) for row in db.query(InventoryDelta)] == [(item, 4)]
+    assert fold_inventory_deltas(db) == 1
+    assert db.get(LibraryItem, item).available_copies == 7
+    stock = client.get(f"/branches/{branch}/inventory/{item}", headers=admin_headers).json()
+    assert (stock["total_copies"], stock["available_copies"]) == (4, 4)
+
+
+def test_branch_list_rejects_sorting_by_available_copies(client, admin_headers):
+    branch = _create_branch(client, admin_headers, "Central")
+    response = client.get("/library_items/", headers=admin_headers,
+                          params={"branch_id": branch, "sort": "-available_copies,title"})
+    assert response.status_code == 400
+
+
+def _reader(db):
+    reader = Reader(name="Reader")
+    db.add(reader)
+    db.commit()
+    return reader.id
+
+
+def _checkout(client, headers, branch_id, item_id, reader_id):
+    return client.post(f"/branches/{branch_id}/inventory/{item_id}/checkout", headers=headers,
+                       json={"reader_id": reader_id})
+
+
+def test_branch_checkout_and_return_touch_only_the_branch_row(client, admin_headers, db):
+    central = _create_branch(client, admin_headers, "Central")
+    north = _create_branch(client, admin_headers, "North")
+    item = _create_item(client, admin_headers, "Dune")
+    _stock(client, admin_headers, central, item, 1)
+    _stock(client, admin_headers, north, item, 2)
+    assert fold_inventory_deltas(db) == 2
+    reader = _reader(db)
+
+    response = _checkout(client, admin_headers, central, item, reader)
+    assert response.status_code == 200, response.text
+    loan = response.json()
+    assert (loan["branch_id"], loan["item_id"], loan["book_id"]) == (central, item, None)
+    assert _checkout(client, admin_headers, central, item, reader).status_code == 409
+
+    db.expire_all()
+    assert db.get(BranchInventory, (central, item)).available_copies == 0
+    assert db.get(BranchInventory, (north, item)).available_copies == 2
+    # Общий счётчик меняется только при свёртке журнала
+    assert db.get(LibraryItem, item).available_copies == 3
+    assert [(row.branch_id, row.available_delta) for row in db.query(InventoryDelta)] == [(central, -1)]
+
+    response = client.post(f"/borrowings/{loan['id']}/return", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["return_date"] is not None
+    assert client.post(f"/borrowings/{loan['id']}/return", headers=admin_headers).status_code == 409
+
+    db.expire_all()
+    assert db.get(BranchInventory, (central, item)).available_copies == 1
+    assert fold_inventory_deltas(db) == 2
+    assert db.get(LibraryItem, item).available_copies == 3
+
+
+def test_merge_moves_branch_loans_to_the_surviving_item(client, admin_headers, db):
+    branch = _create_branch(client, admin_headers, "Central")
+    item = _create_item(client, admin_headers, "Dune")
+    duplicate = _create_item(client, admin_headers, "Dune (2nd copy)")
+    _stock(client, admin_headers, branch, duplicate, 1)
+    loan = _checkout(client, admin_headers, branch, duplicate, _reader(db)).json()
+
+    response = client.post(f"/library_items/{item}/merge", headers=admin_headers, json={"duplicate_ids": [duplicate]})
+    assert response.status_code == 200, response.text
+    assert db.get(BorrowedBook, loan["id"]).item_id == item
+
+    assert client.post(f"/borrowings/{loan['id']}/return", headers=admin_headers).status_code == 200
+    db.expire_all()
+    assert db.get(BranchInventory, (branch, item)).available_copies == 1
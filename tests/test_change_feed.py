@@ -0,0 +1,74 @@
+from sqlalchemy import update
+
+from app.changefeed import pending_change_seq
+from app.database import SessionLocal
+from app.models import LibraryItem
+
+
+def _create_item(client, headers, title):
+    response = client.post("/library_items/?force=true", headers=headers, json={
+        "title": title, "author": "Author", "published_year": 2001, "available_copies": 1,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _changes(client, headers, since, limit=100):
+    response = client.get(f"/library_items/changes?since={since}&limit={limit}", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _rename(session, item_id, title):
+    session.execute(
+        update(LibraryItem)
+        .where(LibraryItem.id == item_id)
+        .values(title=title, change_seq=pending_change_seq(session)),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def test_interleaved_transactions_are_not_skipped(client, admin_headers):
+    first = _create_item(client, admin_headers, "First")
+    second = _create_item(client, admin_headers, "Second")
+    since = _changes(client, admin_headers, 0)["next_since"]
+
+    early, late = SessionLocal(), SessionLocal()
+    try:
+        # Транзакция early начинает запись раньше, а фиксируется позже
+        _rename(early, first, "First (edited)")
+        early.flush()
+        _rename(late, second, "Second (edited)")
+        late.commit()
+
+        feed = _changes(client, admin_headers, since)
+        assert [change["item_id"] for change in feed["changes"]] == [second]
+        since = feed["next_since"]
+
+        early.commit()
+    finally:
+        early.close()
+        late.close()
+
+    feed = _changes(client, admin_headers, since)
+    assert [change["item_id"] for change in feed["changes"]] == [first]
+    assert feed["changes"][0]["item"]["title"] == "First (edited)"
+    assert feed["next_since"] > since
+
+
+def test_change_feed_pages_in_commit_order(client, admin_headers):
+    ids = [_create_item(client, admin_headers, f"Item {i}") for i in range(5)]
+    assert client.delete(f"/library_items/{ids[1]}", headers=admin_headers).status_code == 200
+
+    seen, since, pages = [], 0, 0
+    while True:
+        feed = _changes(client, admin_headers, since, limit=2)
+        seen.extend((change["item_id"], change["deleted"]) for change in feed["changes"])
+        pages += 1
+        since = feed["next_since"]
+        if not feed["has_more"]:
+            break
+
+    assert pages == 3
+    assert seen == [(ids[0], False), (ids[2], False), (ids[3], False), (ids[4], False), (ids[1], True)]
+    assert _changes(client, admin_headers, since)["changes"] == []
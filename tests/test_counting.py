@@ -0,0 +1,58 @@
+from app.counting import CountCache
+
+
+def test_count_cache_evicts_least_recently_used():
+    cache = CountCache(max_entries=2, ttl=60)
+    cache.put(("a",), 1, now=0)
+    cache.put(("b",), 2, now=0)
+    assert cache.get(("a",), now=1) == 1  # ("a",) становится последним использованным
+    cache.put(("c",), 3, now=1)
+
+    assert len(cache) == 2
+    assert cache.get(("b",), now=1) is None
+    assert cache.get(("a",), now=1) == 1
+    assert cache.get(("c",), now=1) == 3
+
+
+def test_count_cache_drops_expired_entries():
+    cache = CountCache(max_entries=10, ttl=60)
+    cache.put(("a",), 1, now=0)
+    cache.put(("b",), 2, now=30)
+
+    assert cache.get(("a",), now=60) is None
+    assert len(cache) == 1
+
+    cache.put(("c",), 3, now=95)
+    assert len(cache) == 1  # ("b",) истёк и удалён при записи
+    assert cache.get(("c",), now=95) == 3
+
+
+def test_count_cache_size_is_bounded_by_distinct_filters():
+    cache = CountCache(max_entries=100, ttl=60)
+    for i in range(1000):
+        cache.put(("library_items", ("author", f"author-{i}")), i, now=0)
+    assert len(cache) == 100
+
+
+def test_count_cache_put_touches_only_the_lru_end():
+    cache = CountCache(max_entries=10, ttl=60)
+    cache.put(("a",), 1, now=0)
+    cache.put(("b",), 2, now=50)
+    assert cache.get(("a",), now=55) == 1  # ("a",) переходит в конец и при записи не проверяется
+    cache.put(("c",), 3, now=70)
+    assert len(cache) == 3
+    assert cache.get(("a",), now=70) is None  # истёкшая запись удаляется при чтении
+    assert len(cache) == 2
+
+
+def test_empty_filters_share_the_unfiltered_count(client, admin_headers):
+    response = client.post("/library_items/?force=true", headers=admin_headers, json={
+        "title": "Dune", "author": "Frank Herbert", "published_year": 1965, "available_copies": 1,
+    })
+    assert response.status_code == 200, response.text
+
+    unfiltered = client.get("/library_items/?include_total=true", headers=admin_headers)
+    empty = client.get("/library_items/?include_total=true&author=&genre=", headers=admin_headers)
+    assert unfiltered.headers["X-Total-Count"] == empty.headers["X-Total-Count"] == "1"
+    assert unfiltered.headers["X-Total-Count-Mode"] == "exact"
+    assert empty.headers["X-Total-Count-Mode"] == "cached"
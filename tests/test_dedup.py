@@ -0,0 +1,45 @@
+import numpy as np
+
+from app import dedup
+
+
+def test_normalize_ignores_case_diacritics_and_punctuation():
+    assert dedup.normalize("Les Misérables!", "Victor  HUGO") == "les miserables victor hugo"
+
+
+def test_signatures_are_deterministic_and_close_for_near_duplicates():
+    sigs = dedup.signatures([
+        ("The Lord of the Rings", "J. R. R. Tolkien"),
+        ("the lord of the rings", "J.R.R. Tolkien"),
+        ("A Brief History of Time", "Stephen Hawking"),
+    ])
+    assert sigs.shape == (3, dedup.NUM_PERMUTATIONS)
+    assert np.array_equal(sigs, dedup.signatures([
+        ("The Lord of the Rings", "J. R. R. Tolkien"),
+        ("the lord of the rings", "J.R.R. Tolkien"),
+        ("A Brief History of Time", "Stephen Hawking"),
+    ]))
+    assert (sigs[0] == sigs[1]).mean() >= dedup.DEDUP_THRESHOLD
+    assert (sigs[0] == sigs[2]).mean() < dedup.DEDUP_THRESHOLD
+
+
+def test_signature_round_trips_through_bytes():
+    sig = dedup.signatures([("Dune", "Frank Herbert")])[0]
+    assert np.array_equal(dedup.decode_signature(dedup.encode_signature(sig)), sig)
+
+
+def test_duplicates_within_points_to_earliest_match():
+    sigs = dedup.signatures([
+        ("Dune", "Frank Herbert"),
+        ("Emma", "Jane Austen"),
+        ("DUNE", "Frank Herbert"),
+        ("Dune.", "Frank  Herbert"),
+    ])
+    assert dedup.duplicates_within(sigs) == [None, None, 0, 0]
+
+
+def test_empty_text_is_not_signed_or_matched():
+    sigs = dedup.signatures([("!!!", "..."), ("", ""), ("Dune", "Frank Herbert")])
+    assert (sigs[:2] == dedup.UNSIGNED).all()
+    assert (sigs[2] != dedup.UNSIGNED).all()
+    assert dedup.duplicates_within(sigs) == [None, None, None]
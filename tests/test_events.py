@@ -0,0 +1,104 @@
+import json
+import threading
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app import events
+from app.database import SessionLocal
+from app.events import InMemoryInvalidationBus, InvalidationEvent, PostgresInvalidationBus, create_invalidation_bus
+
+TEST_EVENT = "test_event"
+
+
+@pytest.fixture
+def memory_bus(monkeypatch):
+    bus = InMemoryInvalidationBus()
+    # Слушатели сессии доставляют события через глобальную шину модуля
+    monkeypatch.setattr(events, "invalidation_bus", bus)
+    return bus
+
+
+def _collect(bus, kind=TEST_EVENT):
+    received = []
+    bus.subscribe(kind, received.append)
+    return received
+
+
+def test_event_is_delivered_only_after_commit(memory_bus):
+    received = _collect(memory_bus)
+    session = Session()
+    memory_bus.publish(session, InvalidationEvent(TEST_EVENT, 1))
+    memory_bus.publish(session, InvalidationEvent(TEST_EVENT, 1))
+    memory_bus.publish(session, InvalidationEvent(TEST_EVENT, 2))
+    assert received == []
+
+    session.commit()
+    # Повторы одного события в транзакции доставляются один раз
+    assert received == [InvalidationEvent(TEST_EVENT, 1), InvalidationEvent(TEST_EVENT, 2)]
+    session.commit()
+    assert len(received) == 2
+
+
+def test_event_is_dropped_on_rollback(memory_bus):
+    received = _collect(memory_bus)
+    session = Session()
+    session.begin()
+    memory_bus.publish(session, InvalidationEvent(TEST_EVENT, 1))
+    session.rollback()
+    session.commit()
+    assert received == []
+
+
+def test_every_subscriber_receives_the_event(memory_bus):
+    first, second, other_kind = _collect(memory_bus), _collect(memory_bus), _collect(memory_bus, "other_event")
+
+    def failing(invalidation):
+        raise RuntimeError("subscriber error")
+
+    memory_bus.subscribe(TEST_EVENT, failing)
+    third = _collect(memory_bus)
+    memory_bus.dispatch(InvalidationEvent(TEST_EVENT, 5))
+    # Ошибка одного подписчика не мешает остальным
+    assert first == second == third == [InvalidationEvent(TEST_EVENT, 5)]
+    assert other_kind == []
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_invalidation_bus("redis")
+
+
+def _notify_from_other_worker(session, channel, invalidation):
+    payload = json.dumps({"kind": invalidation.kind, "id": invalidation.id, "origin": "other-worker"})
+    session.execute(select(func.pg_notify(channel, payload)))
+
+
+def test_postgres_bus_delivers_notifications_after_commit(db):
+    bus = PostgresInvalidationBus(channel="test_invalidation", reconnect_delay=0.1)
+    listening, delivered = threading.Event(), threading.Event()
+    received = []
+    bus.subscribe(events.CATALOG_VERSION_BUMPED, lambda _: listening.set())
+    bus.subscribe(TEST_EVENT, lambda invalidation: (received.append(invalidation), delivered.set()))
+    bus.start()
+    try:
+        assert listening.wait(5)
+        with SessionLocal() as writer:
+            _notify_from_other_worker(writer, bus.channel, InvalidationEvent(TEST_EVENT, 1))
+            writer.rollback()
+            _notify_from_other_worker(writer, bus.channel, InvalidationEvent(TEST_EVENT, 2))
+            assert not delivered.wait(0.3)
+            writer.commit()
+        assert delivered.wait(5)
+        assert received == [InvalidationEvent(TEST_EVENT, 2)]
+
+        # Собственные уведомления уже доставлены локально после коммита и пропускаются
+        delivered.clear()
+        with SessionLocal() as writer:
+            bus.publish(writer, InvalidationEvent(TEST_EVENT, 3))
+            writer.commit()
+        assert not delivered.wait(0.3)
+        assert received == [InvalidationEvent(TEST_EVENT, 2)]
+    finally:
+        bus.stop()
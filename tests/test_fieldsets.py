@@ -0,0 +1,49 @@
+import pytest
+from fastapi import HTTPException
+
+from app.fieldsets import DEFAULT_LIST_FIELDS, LIBRARY_ITEM_FIELDS, fieldset_columns, fieldset_model, parse_fields
+
+
+def test_fields_subset_builds_a_response_model_with_only_those_fields():
+    selected = parse_fields("title,available_copies", DEFAULT_LIST_FIELDS)
+    assert selected == ("id", "title", "available_copies")
+
+    model = fieldset_model(selected)
+    assert list(model.model_fields) == ["id", "title", "available_copies"]
+    assert model(id=1, title="Dune", available_copies=2).model_dump() == {"id": 1, "title": "Dune", "available_copies": 2}
+    assert [column.key for column in fieldset_columns(selected)] == ["id", "title", "available_copies"]
+
+
+def test_field_order_and_whitespace_do_not_change_the_cached_model():
+    first = fieldset_model(parse_fields("genre,title", DEFAULT_LIST_FIELDS))
+    second = fieldset_model(parse_fields(" title , genre,,id", DEFAULT_LIST_FIELDS))
+    assert first is second
+    assert fieldset_model(parse_fields("*", DEFAULT_LIST_FIELDS)) is fieldset_model(tuple(LIBRARY_ITEM_FIELDS))
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(HTTPException) as exc_info:
+        parse_fields("title,isbn", DEFAULT_LIST_FIELDS)
+    assert exc_info.value.status_code == 422
+    assert "isbn" in exc_info.value.detail
+
+
+def test_list_endpoint_returns_only_requested_fields(client, admin_headers):
+    response = client.post("/library_items/?force=true", headers=admin_headers, json={
+        "title": "Dune", "author": "Herbert", "published_year": 1965, "available_copies": 2,
+        "description": "Desert planet",
+    })
+    assert response.status_code == 200, response.text
+    item_id = response.json()["id"]
+
+    response = client.get("/library_items/?fields=available_copies,title", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"id": item_id, "title": "Dune", "available_copies": 2}]
+
+    response = client.get(f"/library_items/{item_id}?fields=description", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"id": item_id, "description": "Desert planet"}
+
+    response = client.get("/library_items/?fields=title,isbn", headers=admin_headers)
+    assert response.status_code == 422
+    assert "isbn" in response.json()["detail"]
@@ -0,0 +1,115 @@
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import jobs
+from app.database import SessionLocal
+from app.jobs import JOB_CANCELLED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, enqueue_job, job_handler
+from app.models import Job
+
+_attempts = []
+
+
+@job_handler("test_flaky")
+def _flaky_job(ctx, params):
+    _attempts.append((ctx.attempt, ctx.progress))
+    ctx.report_progress(ctx.progress + 1, total=3)
+    if ctx.attempt < params["succeed_on"]:
+        raise RuntimeError(f"attempt {ctx.attempt} failed")
+    return {"progress": ctx.progress}
+
+
+@job_handler("test_cancellable")
+def _cancellable_job(ctx, params):
+    ctx.report_progress(1)
+    with SessionLocal() as other:
+        other.query(Job).filter(Job.id == ctx.job_id).update({"cancel_requested": True})
+        other.commit()
+    ctx.report_progress(2)
+    raise AssertionError("report_progress must raise JobCancelled")
+
+
+def _job(db, job_id):
+    db.expire_all()
+    return db.get(Job, job_id)
+
+
+def test_claim_skips_locked_jobs(db):
+    first = enqueue_job(db, "test_flaky", {"succeed_on": 1}).id
+    second = enqueue_job(db, "test_flaky", {"succeed_on": 1}).id
+
+    with SessionLocal() as other:
+        # Другой воркер держит блокировку первой задачи
+        other.query(Job).filter(Job.id == first).with_for_update().one()
+        assert jobs._claim_next_job() == second
+    assert jobs._claim_next_job() == first
+    assert jobs._claim_next_job() is None
+    assert {_job(db, first).status, _job(db, second).status} == {JOB_RUNNING}
+    assert _job(db, first).attempts == 1
+
+
+def test_failed_attempt_is_retried_with_backoff_and_resumes(db):
+    _attempts.clear()
+    job_id = enqueue_job(db, "test_flaky", {"succeed_on": 2}, max_attempts=2).id
+
+    assert jobs._claim_next_job() == job_id
+    jobs._execute_job(job_id)
+    job = _job(db, job_id)
+    assert (job.status, job.error, job.progress) == (JOB_QUEUED, "attempt 1 failed", 1)
+    delay = job.run_after - datetime.utcnow()
+    assert timedelta(seconds=jobs.JOB_RETRY_DELAY_SECONDS - 2) < delay <= timedelta(seconds=jobs.JOB_RETRY_DELAY_SECONDS)
+    # До run_after задача не выдаётся
+    assert jobs._claim_next_job() is None
+
+    db.query(Job).filter(Job.id == job_id).update({"run_after": datetime.utcnow()})
+    db.commit()
+    assert jobs._claim_next_job() == job_id
+    jobs._execute_job(job_id)
+    job = _job(db, job_id)
+    assert (job.status, job.result, job.error) == (JOB_SUCCEEDED, {"progress": 2}, None)
+    # Вторая попытка продолжила с сохранённого прогресса
+    assert _attempts == [(1, 0), (2, 1)]
+
+
+def test_last_failed_attempt_fails_the_job(db):
+    job_id = enqueue_job(db, "test_flaky", {"succeed_on": 5}, max_attempts=1).id
+    assert jobs._claim_next_job() == job_id
+    jobs._execute_job(job_id)
+    job = _job(db, job_id)
+    assert (job.status, job.error) == (JOB_FAILED, "attempt 1 failed")
+    assert job.finished_at is not None
+
+
+def test_cancellation_is_checked_in_report_progress(db):
+    job_id = enqueue_job(db, "test_cancellable").id
+    assert jobs._claim_next_job() == job_id
+    jobs._execute_job(job_id)
+    job = _job(db, job_id)
+    assert (job.status, job.progress) == (JOB_CANCELLED, 2)
+
+
+def test_deleted_job_is_skipped(db):
+    job_id = enqueue_job(db, "test_flaky", {"succeed_on": 1}).id
+    assert jobs._claim_next_job() == job_id
+    db.query(Job).filter(Job.id == job_id).delete()
+    db.commit()
+    jobs._execute_job(job_id)
+
+
+def test_periodic_job_is_enqueued_once_under_advisory_lock(db, monkeypatch):
+    monkeypatch.setattr(jobs, "PERIODIC_JOBS", {"test_flaky": (3600, {"succeed_on": 1})})
+
+    with SessionLocal() as other:
+        # Другой воркер сейчас ставит ту же периодическую задачу
+        other.execute(select(func.pg_advisory_xact_lock(func.hashtext("jobs:test_flaky"))))
+        worker = threading.Thread(target=jobs._enqueue_due_periodic_jobs)
+        worker.start()
+        worker.join(0.5)
+        assert worker.is_alive()
+        other.rollback()
+    worker.join(5)
+    assert not worker.is_alive()
+
+    jobs._enqueue_due_periodic_jobs()
+    assert db.query(Job).filter(Job.kind == "test_flaky").count() == 1
@@ -0,0 +1,50 @@
+from app.library import _parse_if_match
+from tests.conftest import requires_postgres
+
+
+def test_parse_if_match_without_header_or_wildcard():
+    assert _parse_if_match(None) is None
+    assert _parse_if_match(" * ") is None
+
+
+def test_parse_if_match_accepts_strong_and_weak_tags():
+    assert _parse_if_match('"3"') == [3]
+    assert _parse_if_match('W/"4", "5" ,"x"') == [4, 5]
+    assert _parse_if_match('"abc"') == []
+
+
+def _create_item(client, headers):
+    response = client.post("/library_items/?force=true", headers=headers, json={
+        "title": "Dune", "author": "Frank Herbert", "published_year": 1965, "available_copies": 2,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"], response.headers["ETag"]
+
+
+@requires_postgres
+def test_update_with_stale_etag_is_rejected(client, admin_headers):
+    item_id, etag = _create_item(client, admin_headers)
+    assert client.get(f"/library_items/{item_id}").headers["ETag"] == etag
+
+    first = client.put(f"/library_items/{item_id}", json={"available_copies": 3},
+                       headers={**admin_headers, "If-Match": etag})
+    assert first.status_code == 200, first.text
+    assert first.headers["ETag"] != etag
+
+    stale = client.put(f"/library_items/{item_id}", json={"available_copies": 4},
+                       headers={**admin_headers, "If-Match": etag})
+    assert stale.status_code == 412
+    assert client.get(f"/library_items/{item_id}").json()["available_copies"] == 3
+
+    stale_delete = client.delete(f"/library_items/{item_id}", headers={**admin_headers, "If-Match": etag})
+    assert stale_delete.status_code == 412
+    fresh_delete = client.delete(f"/library_items/{item_id}",
+                                 headers={**admin_headers, "If-Match": first.headers["ETag"]})
+    assert fresh_delete.status_code == 200
+
+
+@requires_postgres
+def test_missing_item_is_404_not_412(client, admin_headers):
+    response = client.put("/library_items/999999", json={"available_copies": 1},
+                          headers={**admin_headers, "If-Match": '"1"'})
+    assert response.status_code == 404
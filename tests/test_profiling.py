@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from app.jobs import JOB_HANDLERS, PERIODIC_JOBS, LocalJobContext
+from app.models import ProfileReport, User
+
+
+def test_deterministic_profile_covers_sync_dependencies(db, client, admin_headers):
+    response = client.get("/auth/me", headers={**admin_headers, "X-Profile": "deterministic"})
+    assert response.status_code == 200, response.text
+
+    report = db.get(ProfileReport, response.headers["x-profile-id"])
+    assert report.mode == "deterministic"
+    # get_current_user и get_db выполняются в пуле потоков отдельно от обработчика
+    assert "get_current_user" in report.stats
+    assert "get_db" in report.stats
+    assert "runcall" not in (report.collapsed or "")
+
+
+def test_dependency_overrides_still_apply_to_profiled_routes(client):
+    from app.auth import get_current_user
+    from app.main import app
+
+    app.dependency_overrides[get_current_user] = lambda: User(
+        id=42, username="override", email="override@example.com", role="reader", is_admin=False,
+    )
+    try:
+        response = client.get("/auth/me")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == "override"
+
+
+def _report(created_at):
+    return ProfileReport(id=f"{created_at:%Y%m%d%H%M%S}", created_at=created_at, method="GET", path="/",
+                         duration_ms=1.0, mode="sample")
+
+
+def test_purge_profile_reports_job_removes_expired_reports(db, client):
+    assert "purge_profile_reports" in PERIODIC_JOBS
+    now = datetime.utcnow()
+    db.add_all([_report(now - timedelta(days=30)), _report(now - timedelta(days=8)), _report(now)])
+    db.commit()
+
+    result = JOB_HANDLERS["purge_profile_reports"](LocalJobContext(db), {"batch_size": 1})
+
+    assert result == {"deleted": 2}
+    assert [report.created_at for report in db.query(ProfileReport).all()] == [now]
@@ -0,0 +1,142 @@
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import event, update
+
+from app.database import engine
+from app.models import Author, Book, BorrowedBook, Reader
+from app.jobs import JOB_HANDLERS, LocalJobContext
+from app.reconciliation import _new_stats, plan_corrections, read_totals_csv, reconcile_chunk, set_book_totals
+
+Row = namedtuple("Row", "id available_copies total_copies on_loan")
+
+
+def test_plan_corrections_drift_math():
+    stats = _new_stats()
+    rows = [
+        Row(1, 3, 5, 2),  # совпадает
+        Row(2, 4, 5, 2),  # лишний доступный экземпляр
+        Row(3, 0, 5, 2),  # потеряны три экземпляра
+        Row(4, 1, 2, 3),  # выдано больше, чем есть
+        Row(5, None, 2, 2),  # не задан, ожидается 0
+        Row(6, 7, None, 1),  # всего неизвестно
+    ]
+    assert plan_corrections(rows, stats) == [(2, 4, 3), (3, 0, 3), (4, 1, 0), (5, None, 0)]
+    assert stats["drifted"] == 4
+    assert stats["drifted_ids"] == [2, 3, 4, 5]
+    assert stats["total_abs_drift"] == 1 + 3 + 1 + 0
+    assert stats["max_abs_drift"] == 3
+    assert stats["over_loaned"] == 1
+    assert (stats["unknown_total"], stats["unknown_total_ids"]) == (1, [6])
+
+
+def _book(db, available, total, loans=0):
+    author = db.query(Author).first() or Author(name="Author")
+    reader = db.query(Reader).first() or Reader(name="Reader")
+    book = Book(title="Book", published_year=2000, author=author, available_copies=available, total_copies=total)
+    db.add(book)
+    db.flush()
+    if available is None:
+        # None в ORM заменяется значением по умолчанию столбца
+        db.execute(update(Book).where(Book.id == book.id).values(available_copies=None))
+    for _ in range(loans):
+        db.add(BorrowedBook(reader=reader, book_id=book.id, borrow_date=date.today()))
+    db.commit()
+    return book.id
+
+
+def test_reconcile_chunk_fixes_drift_and_skips_unknown_totals(db):
+    drifted = _book(db, available=5, total=3, loans=1)
+    unknown = _book(db, available=9, total=None, loans=1)
+    missing = _book(db, available=None, total=1, loans=1)
+
+    stats = _new_stats()
+    assert reconcile_chunk(db, 0, stats) == missing
+    db.commit()
+    db.expire_all()
+    assert (stats["corrected"], stats["skipped_concurrent"], stats["unknown_total"]) == (2, 0, 1)
+    assert db.get(Book, drifted).available_copies == 2
+    assert (db.get(Book, unknown).available_copies, db.get(Book, unknown).total_copies) == (9, None)
+    assert db.get(Book, missing).available_copies == 0
+
+
+def test_reconcile_chunk_of_null_observed_values(db):
+    book_ids = [_book(db, available=None, total=2) for _ in range(2)]
+
+    stats = _new_stats()
+    reconcile_chunk(db, 0, stats)
+    db.commit()
+    assert stats["corrected"] == 2
+    assert [db.get(Book, book_id).available_copies for book_id in book_ids] == [2, 2]
+
+
+def test_reconcile_chunk_skips_rows_changed_after_reading(db):
+    book_id = _book(db, available=5, total=3)
+
+    def borrow_concurrently(orm_execute_state):
+        # Выдача фиксируется между чтением порции и её исправлением
+        if orm_execute_state.is_update:
+            with engine.begin() as connection:
+                connection.execute(update(Book).where(Book.id == book_id).values(available_copies=4))
+
+    event.listen(db, "do_orm_execute", borrow_concurrently)
+    try:
+        stats = _new_stats()
+        reconcile_chunk(db, 0, stats)
+        db.commit()
+    finally:
+        event.remove(db, "do_orm_execute", borrow_concurrently)
+    assert (stats["drifted"], stats["corrected"], stats["skipped_concurrent"]) == (1, 0, 1)
+    db.expire_all()
+    assert db.get(Book, book_id).available_copies == 4
+
+
+def test_set_book_copies_recomputes_available(client, admin_headers, db):
+    book_id = _book(db, available=7, total=None, loans=2)
+
+    response = client.put(f"/inventory/books/{book_id}", headers=admin_headers, json={"total_copies": 5})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"id": book_id, "total_copies": 5, "available_copies": 3, "on_loan": 2}
+
+    response = client.put(f"/inventory/books/{book_id}", headers=admin_headers, json={"total_copies": 1})
+    assert response.status_code == 409
+    assert client.put("/inventory/books/999999", headers=admin_headers, json={"total_copies": 1}).status_code == 404
+
+
+def test_set_book_totals_in_bulk(db):
+    counted = _book(db, available=7, total=None, loans=2)
+    over_loaned = _book(db, available=0, total=None, loans=3)
+    untouched = _book(db, available=4, total=None)
+
+    stats = set_book_totals(db, {counted: 5, over_loaned: 2, untouched + 1000: 1, untouched: -1}, chunk_size=2)
+
+    assert (stats["updated"], stats["over_loaned"], stats["not_found"], stats["invalid"]) == (1, 1, 1, 1)
+    assert (stats["over_loaned_ids"], stats["not_found_ids"], stats["invalid_ids"]) == (
+        [over_loaned], [untouched + 1000], [untouched]
+    )
+    db.expire_all()
+    assert (db.get(Book, counted).total_copies, db.get(Book, counted).available_copies) == (5, 3)
+    assert db.get(Book, over_loaned).total_copies is None
+    assert db.get(Book, untouched).total_copies is None
+
+    # После задания total_copies сверка больше не пропускает книгу
+    stats = _new_stats()
+    reconcile_chunk(db, counted - 1, stats, chunk_size=1)
+    assert (stats["scanned"], stats["unknown_total"], stats["drifted"]) == (1, 0, 0)
+
+
+def test_set_book_totals_job_and_csv(db, tmp_path):
+    first = _book(db, available=1, total=None)
+    second = _book(db, available=1, total=None, loans=1)
+    path = tmp_path / "totals.csv"
+    path.write_text(f"book_id,total_copies\n{first},3\n{second},4\n", encoding="utf-8")
+    assert read_totals_csv(str(path)) == {first: 3, second: 4}
+
+    ctx = LocalJobContext(db)
+    result = JOB_HANDLERS["set_book_totals"](ctx, {"totals": {str(first): 3, str(second): 4}})
+
+    assert result["updated"] == 2
+    assert ctx.progress == 2
+    db.expire_all()
+    assert [(db.get(Book, book_id).total_copies, db.get(Book, book_id).available_copies)
+            for book_id in (first, second)] == [(3, 3), (4, 3)]
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from app import similarity
+from app.similarity import SimilarityIndex, build_similarity_index, refresh_similarity_index
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(similarity, "SIMILARITY_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(similarity, "_reader", None)
+    monkeypatch.setattr(similarity, "_reader_path", None)
+    return tmp_path
+
+
+def _create_item(client, headers, title, description):
+    response = client.post("/library_items/?force=true", headers=headers, json={
+        "title": title, "author": "Author", "published_year": 2001, "available_copies": 1,
+        "genre": "Fiction", "description": description,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _catalog(client, headers):
+    return {
+        "whale": _create_item(client, headers, "Moby Dick", "whale hunt at sea captain ahab obsession"),
+        "whale_2": _create_item(client, headers, "Whale Tales", "stories of whale hunt and the sea"),
+        "ship": _create_item(client, headers, "Sea Wolf", "captain at sea aboard a sealing ship"),
+        "garden": _create_item(client, headers, "Secret Garden", "orphan girl finds a hidden garden"),
+        "roses": _create_item(client, headers, "Rose Garden", "tending roses in a hidden garden"),
+    }
+
+
+def _neighbor_ids(index, item_id):
+    return [neighbor_id for neighbor_id, _ in index.similar(item_id, similarity.SIMILAR_ITEMS_K)]
+
+
+def test_build_ranks_neighbors_by_similarity(db, client, admin_headers, index_dir):
+    items = _catalog(client, admin_headers)
+    assert build_similarity_index(db) == {"items": 5}
+
+    index = similarity.get_similarity_index()
+    neighbors = index.similar(items["whale"], 10)
+    assert neighbors[0][0] == items["whale_2"]
+    assert [score for _, score in neighbors] == sorted((score for _, score in neighbors), reverse=True)
+    assert items["whale"] not in _neighbor_ids(index, items["whale"])
+    assert _neighbor_ids(index, items["garden"])[0] == items["roses"]
+
+    response = client.get(f"/library_items/{items['whale']}/similar?limit=1", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert [item["id"] for item in response.json()] == [items["whale_2"]]
+
+
+def test_refresh_writes_a_new_generation_and_keeps_the_current_one_intact(db, client, admin_headers, index_dir):
+    items = _catalog(client, admin_headers)
+    build_similarity_index(db)
+    old_path = similarity._current_path()
+    old_index = SimilarityIndex(old_path)
+    old_neighbors = old_index.neighbors.copy()
+
+    added = _create_item(client, admin_headers, "Whale Song", "whale hunt at sea")
+    assert refresh_similarity_index(db) == {"updated": 1}
+
+    new_path = similarity._current_path()
+    assert new_path != old_path
+    assert not os.path.exists(old_path)
+    # Открытое прежнее поколение не изменилось
+    assert (old_index.neighbors == old_neighbors).all()
+    assert old_index.count == 5
+
+    index = similarity.get_similarity_index()
+    assert index.path == new_path
+    assert index.meta["generation"] == 2
+    assert added in _neighbor_ids(index, items["whale"])
+    assert items["whale"] in _neighbor_ids(index, added)
+    assert refresh_similarity_index(db) == {"updated": 0}
+
+
+def test_refresh_recomputes_neighbors_of_changed_and_deleted_items(db, client, admin_headers, index_dir):
+    items = _catalog(client, admin_headers)
+    build_similarity_index(db)
+
+    # Элемент больше не похож на прежних соседей и должен исчезнуть из их списков
+    response = client.put(f"/library_items/{items['whale_2']}", headers=admin_headers, json={
+        "title": "Rose Tales", "description": "roses in a hidden garden",
+    })
+    assert response.status_code == 200, response.text
+    response = client.delete(f"/library_items/{items['ship']}", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert refresh_similarity_index(db) == {"updated": 2}
+
+    index = similarity.get_similarity_index()
+    for item_id in items.values():
+        assert items["ship"] not in _neighbor_ids(index, item_id)
+    assert _neighbor_ids(index, items["ship"]) == []
+    assert items["whale_2"] not in _neighbor_ids(index, items["whale"])
+    assert items["whale_2"] in _neighbor_ids(index, items["roses"])
+    assert items["roses"] in _neighbor_ids(index, items["whale_2"])
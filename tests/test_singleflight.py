@@ -0,0 +1,92 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def _wait_for_leader(flight):
+    while flight.stats()["in_flight"] == 0:
+        time.sleep(0.005)
+
+
+def _wait_for_followers(flight, count):
+    # Ведомые учитываются под блокировкой до того, как начинают ждать лидера
+    for _ in range(1000):
+        if flight.stats()["coalesced"] >= count:
+            return
+        time.sleep(0.005)
+    raise AssertionError("followers did not join")
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight("test-coalescing")
+    release, calls = threading.Event(), []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return ["row"]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(flight.do, "key", load)]
+        _wait_for_leader(flight)
+        futures += [pool.submit(flight.do, "key", load) for _ in range(3)]
+        _wait_for_followers(flight, 3)
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    stats = flight.stats()
+    assert (stats["executed"], stats["coalesced"], stats["max_followers"], stats["in_flight"]) == (1, 3, 3, 0)
+
+
+def test_leader_error_is_raised_in_followers():
+    flight = SingleFlight("test-errors")
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", fail)
+        _wait_for_leader(flight)
+        follower = pool.submit(flight.do, "key", fail)
+        _wait_for_followers(flight, 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError, match="boom"):
+                future.result(timeout=5)
+
+    assert flight.stats()["errors"] == 1
+    # Ошибка не кешируется: следующий вызов выполняется заново
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_invalidate_starts_a_new_generation():
+    flight = SingleFlight("test-generation")
+    release, calls = threading.Event(), []
+
+    def load(value):
+        def run():
+            calls.append(value)
+            if value == "before":
+                release.wait(5)
+            return value
+        return run
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        before = pool.submit(flight.do, "key", load("before"))
+        _wait_for_leader(flight)
+        flight.invalidate()
+        # Вызов после записи не присоединяется к начатому до неё
+        assert flight.do("key", load("after")) == "after"
+        release.set()
+        assert before.result(timeout=5) == "before"
+
+    assert calls == ["before", "after"]
+    assert flight.stats()["coalesced"] == 0
@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from app import snapshot as snapshot_module
+from app.snapshot import CatalogSnapshotServer, apply_changes, build_snapshot, load_snapshot, refresh_snapshot
+
+Row = namedtuple("Row", "id title author genre published_year available_copies version title_rank")
+
+
+def _row(item_id, title, author="Author", copies=1):
+    return Row(item_id, title, author, "Fiction", 2000, copies, 1, None)
+
+
+def _ranked(rows):
+    # Ранги названий, как их выдал бы dense_rank() в БД
+    ranks = {title: rank for rank, title in enumerate(sorted({row.title for row in rows}), start=1)}
+    return [row._replace(title_rank=ranks[row.title]) for row in rows]
+
+
+def _titles(snapshot):
+    return [(snapshot.titles[pos], int(snapshot.ids[pos])) for pos in snapshot.title_order]
+
+
+def test_apply_changes_matches_full_rebuild():
+    rows = _ranked([_row(1, "Dune"), _row(2, "Emma"), _row(3, "Beloved"), _row(4, "Emma"), _row(5, "Walden")])
+    snapshot = build_snapshot(rows, change_seq=5)
+
+    changed = [_row(2, "Zorba"), _row(6, "Emma"), _row(7, "Anna Karenina"), _row(0, "Dune", copies=0)]
+    final = {row.id: row for row in rows if row.id != 5}
+    final.update({row.id: row for row in changed})
+    final = {row.id: row for row in _ranked(list(final.values()))}
+    ranks = (np.array(sorted(final)), np.array([final[item_id].title_rank for item_id in sorted(final)]))
+    updated = apply_changes(snapshot, [final[row.id] for row in changed], deleted_ids=[5], change_seq=9, ranks=ranks)
+
+    expected = build_snapshot([final[item_id] for item_id in sorted(final)], change_seq=9)
+
+    assert updated.change_seq == 9
+    assert updated.ids.tolist() == [0, 1, 2, 3, 4, 6, 7]
+    assert _titles(updated) == _titles(expected) == [
+        ("Anna Karenina", 7), ("Beloved", 3), ("Dune", 0), ("Dune", 1), ("Emma", 4), ("Emma", 6), ("Zorba", 2),
+    ]
+    assert updated.title_ranks.tolist() == expected.title_ranks.tolist()
+    assert updated.copies.tolist() == expected.copies.tolist()
+    # Исходный снимок не меняется
+    assert _titles(snapshot) == [("Beloved", 3), ("Dune", 1), ("Emma", 2), ("Emma", 4), ("Walden", 5)]
+
+
+def test_apply_changes_keeps_dictionaries_of_the_source_snapshot():
+    snapshot = build_snapshot([_row(1, "Dune", author="Herbert")._replace(title_rank=1)], change_seq=1)
+    updated = apply_changes(snapshot, [_row(2, "Emma", author="Austen")._replace(title_rank=2)],
+                            deleted_ids=[], change_seq=2)
+    assert snapshot.authors.values == ["Herbert"]
+    assert [updated.value("author", pos) for pos in range(len(updated))] == ["Herbert", "Austen"]
+    assert np.array_equal(updated.order((("title", True), ("id", True))), [1, 0])
+
+
+def test_titles_are_stored_in_one_buffer():
+    snapshot = build_snapshot(_ranked([_row(1, "Анна"), _row(2, ""), _row(3, "Émile")]), change_seq=1)
+    assert [snapshot.titles[pos] for pos in range(3)] == ["Анна", "", "Émile"]
+    assert snapshot.titles.data.dtype == np.uint8
+    assert snapshot.titles.offsets.tolist() == [0, 8, 8, 14]
+    assert [snapshot.titles.take(np.array([2, 0]))[pos] for pos in range(2)] == ["Émile", "Анна"]
+
+
+def test_stale_snapshot_is_served_while_another_request_refreshes():
+    server = CatalogSnapshotServer(enabled=True)
+    snapshot = build_snapshot(_ranked([_row(1, "Dune")]), change_seq=1)
+    server._snapshot = snapshot
+    server.mark_stale()
+
+    server._lock.acquire()
+    try:
+        # Обновление уже идёт в другом потоке: запрос не ждёт его и не обращается к БД
+        assert server.current(db=None) is snapshot
+    finally:
+        server._lock.release()
+
+
+def _create_item(client, headers, title, description=None):
+    response = client.post("/library_items/?force=true", headers=headers, json={
+        "title": title, "author": "Author", "published_year": 2001, "available_copies": 1,
+        "description": description,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+@pytest.fixture
+def case_insensitive_titles(monkeypatch):
+    # Правила сравнения, отличные от порядка кодовых точек: снимок должен следовать БД
+    from sqlalchemy import func
+
+    from app.models import LibraryItem
+
+    monkeypatch.setattr(snapshot_module, "_title_rank",
+                        lambda: func.dense_rank().over(order_by=func.lower(LibraryItem.title)).label("title_rank"))
+
+
+def test_title_order_follows_database_ranks(db, client, admin_headers, case_insensitive_titles):
+    banana = _create_item(client, admin_headers, "Banana")
+    apple = _create_item(client, admin_headers, "apple")
+    snapshot = load_snapshot(db)
+    assert [int(snapshot.ids[pos]) for pos in snapshot.title_order] == [apple, banana]
+
+    # Новое название получает ранг из БД, а не по кодовым точкам
+    cherry = _create_item(client, admin_headers, "Cherry")
+    avocado = _create_item(client, admin_headers, "avocado")
+    updated = refresh_snapshot(db, snapshot)
+    assert [int(updated.ids[pos]) for pos in updated.title_order] == [apple, avocado, banana, cherry]
+    assert updated.title_ranks.tolist() == [3, 1, 4, 2]
+
+    # Без смены названий ранги берутся из снимка
+    response = client.put(f"/library_items/{banana}", headers=admin_headers, json={"available_copies": 5})
+    assert response.status_code == 200, response.text
+    refreshed = refresh_snapshot(db, updated)
+    assert refreshed.title_ranks.tolist() == [3, 1, 4, 2]
+    assert refreshed.copies.tolist() == [5, 1, 1, 1]
+
+
+def test_snapshot_reads_descriptions_by_id(db, client, admin_headers):
+    from app.fieldsets import LIBRARY_ITEM_FIELDS, fieldset_model
+
+    first = _create_item(client, admin_headers, "Dune", description="Desert planet")
+    _create_item(client, admin_headers, "Emma")
+    server = CatalogSnapshotServer(enabled=True)
+    model = fieldset_model(tuple(LIBRARY_ITEM_FIELDS))
+    items, total = server.query(db, None, None, None, (("title", False), ("id", False)), 0, 10, True, model)
+    assert total == 2
+    assert [(item.title, item.description) for item in items] == [("Dune", "Desert planet"), ("Emma", None)]
+    assert items[0].id == first
+    assert "descriptions" not in server.footprint()["bytes"]
@@ -0,0 +1,41 @@
+import pytest
+from fastapi import HTTPException
+
+from app.sorting import library_item_order_by, library_item_sort_keys
+
+
+def test_default_sort_is_by_id():
+    assert library_item_sort_keys(None) == (("id", False),)
+    assert library_item_sort_keys("") == (("id", False),)
+
+
+def test_id_tiebreaker_follows_last_key_direction():
+    assert library_item_sort_keys("title") == (("title", False), ("id", False))
+    assert library_item_sort_keys("-published_year,title") == (
+        ("published_year", True), ("title", False), ("id", False),
+    )
+    assert library_item_sort_keys("published_year,-title") == (
+        ("published_year", False), ("title", True), ("id", True),
+    )
+    assert library_item_sort_keys("-id") == (("id", True),)
+
+
+def test_spaces_are_ignored():
+    assert library_item_sort_keys("-available_copies, title") == library_item_sort_keys("-available_copies,title")
+
+
+@pytest.mark.parametrize("sort", ["author", "title,published_year", "-published_year,-title,id", "nope"])
+def test_unsupported_sort_is_rejected(sort):
+    with pytest.raises(HTTPException) as exc_info:
+        library_item_sort_keys(sort)
+    assert exc_info.value.status_code == 400
+
+
+def test_order_by_uses_replacement_columns():
+    from sqlalchemy import column
+
+    branch_copies = column("branch_available_copies")
+    order_by = library_item_order_by("-available_copies,title", {"available_copies": branch_copies})
+    assert [str(clause.compile()) for clause in order_by] == [
+        "branch_available_copies DESC", "library_items.title", "library_items.id",
+    ]